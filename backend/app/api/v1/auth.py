@@ -6,8 +6,9 @@
 from datetime import timedelta
 from typing import Any, Dict
 
-from fastapi import APIRouter, Body, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Body, Depends, HTTPException, status, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm
+from pydantic import TypeAdapter
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.dependencies.auth import get_current_user
@@ -16,7 +17,7 @@ from app.core.config import settings
 from app.db import crud
 from app.db.session import get_db
 from app.schemas.token import Token, LoginResponse
-from app.schemas.user import User, UserCreate
+from app.schemas.user import User, UserCreate, user_from_orm
 from app.core.security import create_access_token
 import logging
 
@@ -24,6 +25,9 @@ router = APIRouter()
 
 logger = logging.getLogger(__name__)
 
+# 登录响应序列化器，模块级缓存避免每次请求重新构建
+_LOGIN_ADAPTER = TypeAdapter(LoginResponse)
+
 
 @router.post("/login", response_model=LoginResponse)
 async def login_access_token(
@@ -59,11 +63,16 @@ async def login_access_token(
         user.id, expires_delta=access_token_expires
     )
     
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": User.model_validate(user)
-    }
+    login_response = LoginResponse(
+        access_token=access_token,
+        token_type="bearer",
+        user=user_from_orm(user)
+    )
+    # 直接返回序列化后的字节，跳过FastAPI对response_model的二次校验
+    return Response(
+        content=_LOGIN_ADAPTER.dump_json(login_response),
+        media_type="application/json"
+    )
 
 
 @router.post("/register", response_model=User)
@@ -718,9 +718,6 @@ async def explain_query_results(
                     "token": token,
                     "done": False
                 }) + "\n"
-                
-                # 模拟延迟，真实环境可能不需要
-                await asyncio.sleep(0.01)
             
             # 发送完成标志
             yield json.dumps({
@@ -0,0 +1,33 @@
+"""响应压缩中间件
+
+在Starlette的GZipMiddleware基础上跳过流式接口：
+GZip压缩流不会在每个数据块后刷新，逐token输出的小数据块会在压缩缓冲区中堆积，
+客户端只能成批收到，失去流式输出的意义。
+"""
+
+from typing import Sequence
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class StreamingAwareGZipMiddleware(GZipMiddleware):
+    """不压缩指定流式接口响应的GZip中间件"""
+
+    def __init__(self, app: ASGIApp, streaming_paths: Sequence[str] = (), **kwargs) -> None:
+        """
+        初始化中间件
+
+        Args:
+            app: ASGI应用
+            streaming_paths: 不压缩的流式接口路径
+            **kwargs: 传递给GZipMiddleware的其他参数
+        """
+        super().__init__(app, **kwargs)
+        self.streaming_paths = frozenset(streaming_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].rstrip("/") in self.streaming_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
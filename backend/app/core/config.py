@@ -105,6 +105,15 @@ class Settings(BaseSettings):
     # AI模型设置
     DEFAULT_AI_MODEL: str = config_data.get("ai_models", {}).get("default_ai_model", "deepseek")
     
+    # 单个进程内同时进行的LLM请求上限
+    LLM_MAX_CONCURRENCY: int = config_data.get("ai_models", {}).get("max_concurrency", 8)
+    
+    # 是否合并并发的相同LLM请求（相同消息与参数只向提供商发送一次）
+    ENABLE_BATCHING: bool = config_data.get("ai_models", {}).get("enable_batching", False)
+    
+    # 是否为NL2SQL结果启用基于嵌入向量的语义缓存（精确匹配缓存始终启用）
+    ENABLE_SEMANTIC_CACHE: bool = config_data.get("ai_models", {}).get("enable_semantic_cache", False)
+    
     # 推理功能设置
     ENABLE_REASONING: bool = config_data.get("ai_models", {}).get("enable_reasoning", True)
     
@@ -141,6 +150,10 @@ class Settings(BaseSettings):
     VECTOR_STORE_API_KEY: Optional[str] = config_data.get("vector_store", {}).get("api_key", None)
     VECTOR_COLLECTION_NAME: str = config_data.get("vector_store", {}).get("collection_name", "ecommerce_knowledge")
     
+    # 服务器设置
+    # 同步依赖和端点所用线程池的最大线程数
+    THREADPOOL_SIZE: int = config_data.get("server", {}).get("threadpool_size", 200)
+    
     # 日志配置
     LOG_LEVEL: str = config_data.get("logging", {}).get("level", "INFO")
     
@@ -0,0 +1,58 @@
+"""CORS中间件
+
+在Starlette的CORSMiddleware基础上预编译允许的来源，
+将每次请求的来源校验从列表遍历变为集合查找。
+"""
+
+from typing import Sequence
+
+from starlette.middleware.cors import CORSMiddleware
+from starlette.types import ASGIApp
+
+
+class PrecompiledCORSMiddleware(CORSMiddleware):
+    """使用frozenset校验来源的CORS中间件
+
+    支持以"*."开头的通配子域名配置，例如"*.example.com"。
+    """
+
+    def __init__(self, app: ASGIApp, allow_origins: Sequence[str] = (), **kwargs) -> None:
+        """
+        初始化中间件
+
+        Args:
+            app: ASGI应用
+            allow_origins: 允许的来源列表
+            **kwargs: 传递给CORSMiddleware的其他参数
+        """
+        # 去重并保持原有顺序
+        origins = list(dict.fromkeys(allow_origins))
+        super().__init__(app, allow_origins=origins, **kwargs)
+
+        # 精确匹配的来源使用集合查找
+        self.allow_origins = frozenset(o for o in origins if not o.startswith("*."))
+        # 通配子域名预编译为后缀元组，交给str.endswith一次性匹配
+        self.allow_origin_suffixes = tuple(o[1:] for o in origins if o.startswith("*."))
+
+    def is_allowed_origin(self, origin: str) -> bool:
+        """
+        检查来源是否被允许
+
+        Args:
+            origin: 请求的Origin头
+
+        Returns:
+            是否允许该来源
+        """
+        if self.allow_all_origins:
+            return True
+
+        if origin in self.allow_origins:
+            return True
+
+        if self.allow_origin_suffixes and origin.endswith(self.allow_origin_suffixes):
+            return True
+
+        return self.allow_origin_regex is not None and bool(
+            self.allow_origin_regex.fullmatch(origin)
+        )
@@ -0,0 +1,97 @@
+"""全局异常处理中间件
+
+以纯ASGI中间件的方式捕获未处理异常，返回预先序列化的500响应。
+"""
+
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# 预先序列化的500错误响应体
+_ERR_500 = json.dumps({"detail": "服务器内部错误，请稍后再试"}, ensure_ascii=False).encode("utf-8")
+
+# 异常指纹 -> 最近一次记录完整堆栈的时间，用于异常风暴时跳过重复的堆栈格式化
+_EXC_DEDUP_WINDOW = 1.0
+_EXC_DEDUP_MAXSIZE = 256
+_recent_exceptions: "OrderedDict[str, float]" = OrderedDict()
+
+
+def _should_log_traceback(exc: Exception) -> bool:
+    """
+    判断本次异常是否需要记录完整堆栈
+    
+    同一指纹的异常在去重窗口内只记录一次堆栈
+    
+    Args:
+        exc: 异常对象
+        
+    Returns:
+        是否记录堆栈
+    """
+    fingerprint = type(exc).__name__ + str(exc)[:64]
+    now = time.monotonic()
+    last_seen = _recent_exceptions.get(fingerprint)
+    if last_seen is not None and now - last_seen < _EXC_DEDUP_WINDOW:
+        return False
+    
+    _recent_exceptions[fingerprint] = now
+    _recent_exceptions.move_to_end(fingerprint)
+    if len(_recent_exceptions) > _EXC_DEDUP_MAXSIZE:
+        _recent_exceptions.popitem(last=False)
+    return True
+
+
+class ErrorMiddleware:
+    """未处理异常捕获中间件"""
+    
+    def __init__(self, app: ASGIApp):
+        """
+        初始化中间件
+        
+        Args:
+            app: ASGI应用
+        """
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        处理请求，出现未处理异常时返回500响应
+        
+        Args:
+            scope: ASGI连接信息
+            receive: 接收消息的可调用对象
+            send: 发送消息的可调用对象
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        response_started = False
+        
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            logger.error(f"Unhandled exception: {exc}", exc_info=_should_log_traceback(exc))
+            # 响应已开始发送时无法再改写状态码，交由服务器关闭连接
+            if response_started:
+                raise
+            await send({
+                "type": "http.response.start",
+                "status": 500,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(_ERR_500)).encode("latin-1")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": _ERR_500})
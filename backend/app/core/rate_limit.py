@@ -4,17 +4,37 @@
 """
 
 import time
-from typing import Dict, Tuple, Callable, Optional
+from array import array
+from typing import Callable, Optional
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.status import HTTP_429_TOO_MANY_REQUESTS
+from starlette.types import Receive, Scope, Send
+
+# 不参与限流的路径（健康检查探针等）
+EXEMPT_PATHS = frozenset({"/ping"})
 
 
 class RateLimiter:
-    """内存中的请求计数器"""
+    """内存中的请求计数器
+    
+    使用两个定长数组（SoA布局）分别保存计数和窗口起始时间，
+    按键的哈希值取槽位。哈希冲突的键共享同一计数，只会让它们更早被限流。
+    """
     
-    def __init__(self):
-        self.requests: Dict[str, Tuple[int, float]] = {}
+    def __init__(self, slots: int = 1 << 16):
+        """
+        初始化计数器
+        
+        Args:
+            slots: 槽位数量，会向上取整为2的幂
+        """
+        size = 1
+        while size < slots:
+            size <<= 1
+        self._mask = size - 1
+        self._counts = array("I", bytes(4 * size))
+        self._window_starts = array("d", bytes(8 * size))
     
     def is_allowed(self, key: str, max_requests: int, window: float) -> bool:
         """
@@ -29,45 +49,23 @@ class RateLimiter:
             是否允许请求
         """
         current_time = time.time()
+        slot = hash(key) & self._mask
         
-        # 清理过期的记录
-        self._clean_expired_records(current_time, window)
-        
-        # 如果键不存在，添加新记录并允许请求
-        if key not in self.requests:
-            self.requests[key] = (1, current_time)
+        # 窗口已过期（或槽位未使用），开启新窗口
+        if current_time - self._window_starts[slot] > window:
+            self._counts[slot] = 1
+            self._window_starts[slot] = current_time
             return True
         
-        count, timestamp = self.requests[key]
+        count = self._counts[slot]
         
         # 检查是否在时间窗口内超过最大请求数
-        if current_time - timestamp <= window and count >= max_requests:
+        if count >= max_requests:
             return False
         
-        # 如果在新窗口，重置计数器
-        if current_time - timestamp > window:
-            self.requests[key] = (1, current_time)
-        else:
-            # 更新计数器
-            self.requests[key] = (count + 1, timestamp)
-        
+        # 更新计数器
+        self._counts[slot] = count + 1
         return True
-    
-    def _clean_expired_records(self, current_time: float, window: float) -> None:
-        """
-        清理过期的记录
-        
-        Args:
-            current_time: 当前时间戳
-            window: 时间窗口（秒）
-        """
-        expired_keys = [
-            key for key, (_, timestamp) in self.requests.items()
-            if current_time - timestamp > window
-        ]
-        
-        for key in expired_keys:
-            del self.requests[key]
 
 
 # 全局限流器实例
@@ -98,6 +96,23 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         self.window = window
         self.key_func = key_func or self._default_key_func
     
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        ASGI入口，CORS预检请求和健康检查直接放行
+        
+        Args:
+            scope: ASGI连接信息
+            receive: 接收消息的可调用对象
+            send: 发送消息的可调用对象
+        """
+        if scope["type"] == "http" and (
+            scope["method"] == "OPTIONS" or scope["path"] in EXEMPT_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+        
+        await super().__call__(scope, receive, send)
+    
     async def dispatch(
         self, request: Request, call_next: RequestResponseEndpoint
     ) -> Response:
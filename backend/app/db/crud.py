@@ -144,10 +144,48 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
 
 # 用户CRUD操作
 from app.db.models import User
+from app.schemas.user import clear_user_cache
 
 class CRUDUser(CRUDBase[User, CreateSchemaType, UpdateSchemaType]):
     """用户CRUD操作类"""
     
+    async def update(
+        self,
+        db: AsyncSession,
+        *,
+        db_obj: User,
+        obj_in: Union[UpdateSchemaType, Dict[str, Any]]
+    ) -> User:
+        """
+        更新用户，并清空已校验的User实例缓存
+        
+        Args:
+            db: 数据库会话
+            db_obj: 要更新的用户记录
+            obj_in: 要更新的用户数据，可以是Pydantic模型或字典
+            
+        Returns:
+            更新后的用户记录
+        """
+        db_obj = await super().update(db, db_obj=db_obj, obj_in=obj_in)
+        clear_user_cache()
+        return db_obj
+    
+    async def delete(self, db: AsyncSession, *, id: int) -> Optional[User]:
+        """
+        删除用户，并清空已校验的User实例缓存
+        
+        Args:
+            db: 数据库会话
+            id: 用户ID
+            
+        Returns:
+            删除的用户记录或None
+        """
+        obj = await super().delete(db, id=id)
+        clear_user_cache()
+        return obj
+    
     async def get_by_email(self, db: AsyncSession, *, email: str) -> Optional[User]:
         """
         通过邮箱获取用户
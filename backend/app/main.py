@@ -1,15 +1,22 @@
 ﻿from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
+import anyio.to_thread
+import json
 import logging
 
 from app.api.v1 import api_router
+from app.core.compression import StreamingAwareGZipMiddleware
 from app.core.config import settings
+from app.core.cors import PrecompiledCORSMiddleware
+from app.core.errors import ErrorMiddleware
 from app.core.rate_limit import RateLimitMiddleware
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
+# 健康检查响应体，启动时序列化一次
+_PING_BYTES = json.dumps({"status": "ok", "message": "服务正常运行"}, ensure_ascii=False).encode("utf-8")
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     description=settings.PROJECT_DESCRIPTION,
@@ -20,13 +27,21 @@ app = FastAPI(
 
 # 配置CORS
 app.add_middleware(
-    CORSMiddleware,
+    PrecompiledCORSMiddleware,
     allow_origins=settings.CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# 响应压缩（位于限流中间件内层，小于1KB的响应不压缩；流式解释接口逐块输出，不压缩）
+app.add_middleware(
+    StreamingAwareGZipMiddleware,
+    streaming_paths=[f"{settings.API_V1_STR}/data/explain-results"],
+    minimum_size=1024,
+    compresslevel=5,
+)
+
 # 添加限流中间件
 app.add_middleware(
     RateLimitMiddleware,
@@ -34,22 +49,32 @@ app.add_middleware(
     window=60.0,       # 时间窗口（秒）
 )
 
+# 异常处理（最后添加，位于最外层）
+app.add_middleware(ErrorMiddleware)
+
 # 注册路由
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
-# 异常处理
-@app.exception_handler(Exception)
-async def generic_exception_handler(request, exc):
-    logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
-        status_code=500,
-        content={"detail": "服务器内部错误，请稍后再试"},
-    )
+@app.on_event("startup")
+async def configure_threadpool():
+    """扩大同步依赖（如表单解析）使用的线程池容量"""
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = settings.THREADPOOL_SIZE
+    logger.info(f"线程池容量: {settings.THREADPOOL_SIZE}")
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """关闭LLM、嵌入和重排序调用共享的HTTP客户端"""
+    from app.services.ai.adapters.langchain_llm import aclose_shared_clients
+    from app.services.ai.http_clients import aclose_async_clients
+    await aclose_shared_clients()
+    await aclose_async_clients()
 
 @app.get("/ping")
 async def ping():
     """健康检查接口"""
-    return {"status": "ok", "message": "服务正常运行"}
+    # 保持async：同步def会被FastAPI派发到线程池，反而更慢
+    return Response(content=_PING_BYTES, media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
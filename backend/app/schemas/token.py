@@ -1,15 +1,19 @@
 ﻿"""令牌相关模型
 
 包含JWT令牌相关的Pydantic模型。
+
+Token和LoginResponse在登录时高频创建，使用带__slots__的Pydantic数据类以减少实例内存。
 """
 
 from typing import Optional
 from pydantic import BaseModel
+from pydantic.dataclasses import dataclass
 
 from app.schemas.user import User
 
 
-class Token(BaseModel):
+@dataclass(slots=True)
+class Token:
     """访问令牌模型"""
     access_token: str
     token_type: str
@@ -21,7 +25,8 @@ class TokenPayload(BaseModel):
     exp: Optional[int] = None
 
 
-class LoginResponse(BaseModel):
+@dataclass(slots=True)
+class LoginResponse:
     """登录响应模型"""
     access_token: str
     token_type: str
@@ -3,7 +3,8 @@
 包含用户相关的Pydantic模型。
 """
 
-from typing import Optional, List
+from collections import OrderedDict
+from typing import Any, Optional, List, Tuple
 from datetime import datetime
 from pydantic import BaseModel, EmailStr, Field, validator
 
@@ -81,6 +82,40 @@ class User(UserInDBBase):
     pass
 
 
+# 已校验的User实例缓存，键包含updated_at，用户信息变更后旧条目自然失效；
+# 通过CRUDUser更新或删除用户时还会调用clear_user_cache整体清空
+_USER_CACHE_MAXSIZE = 4096
+_user_cache: "OrderedDict[Tuple[Any, ...], User]" = OrderedDict()
+
+
+def user_from_orm(db_user: Any) -> User:
+    """
+    从ORM用户对象获取User模型，复用已校验的实例
+    
+    Args:
+        db_user: 数据库用户对象
+        
+    Returns:
+        User模型实例
+    """
+    key = (db_user.id, db_user.updated_at, db_user.last_login)
+    cached = _user_cache.get(key)
+    if cached is not None:
+        _user_cache.move_to_end(key)
+        return cached
+    
+    user = User.model_validate(db_user)
+    _user_cache[key] = user
+    if len(_user_cache) > _USER_CACHE_MAXSIZE:
+        _user_cache.popitem(last=False)
+    return user
+
+
+def clear_user_cache() -> None:
+    """清空User实例缓存"""
+    _user_cache.clear()
+
+
 class UserInDB(UserInDBBase):
     """数据库中的用户模型"""
     password: str
@@ -5,12 +5,14 @@
 
 import logging
 import asyncio
-from typing import Any, Dict, List, Mapping, Optional, Iterator, Union, cast, Callable, AsyncGenerator
-import os
+import atexit
+import functools
+import hashlib
+import threading
+import weakref
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple, Union
 import time
 import httpx
-import requests
-import re
 
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import (
@@ -20,10 +22,10 @@ from langchain_core.messages import (
     HumanMessage,
     SystemMessage,
 )
-from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 from langchain_core.callbacks.manager import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
 from langchain_community.chat_models import ChatOpenAI
-from pydantic import Field, SecretStr
+from pydantic import PrivateAttr
 
 from app.services.ai.llm import OpenRouterLLMService, get_llm_service, log_llm_request
 from app.core.config import settings
@@ -31,9 +33,41 @@ from app.core.logging import get_logger
 
 logger = get_logger(__name__)
 
+# API密钥验证结果缓存：(提供商, 密钥SHA-256摘要) -> 验证成功的时间
+# 只缓存成功的验证结果，且不保存原始密钥
+_VALIDATION_TTL = 300
+_validation_cache: Dict[Tuple[str, str], float] = {}
+_validation_lock = threading.Lock()
+
+# API密钥验证使用的共享HTTP客户端，保持长连接以复用TLS会话
+_VALIDATION_CLIENT = httpx.Client(
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=8, max_connections=16)
+)
+atexit.register(_VALIDATION_CLIENT.close)
+
+# 适配器直接调用DeepSeek流式接口时共享的异步HTTP客户端，避免每个适配器各自建立连接池
+_SHARED_ASYNC_CLIENT = httpx.AsyncClient(
+    timeout=60.0,
+    limits=httpx.Limits(max_keepalive_connections=64, max_connections=256)
+)
+
+async def aclose_shared_clients() -> None:
+    """关闭共享的异步HTTP客户端，在应用关闭时调用"""
+    await _SHARED_ASYNC_CLIENT.aclose()
+
+# 已在首次调用时完成异步验证的密钥：(提供商, 密钥摘要)
+_validated_keys: Set[Tuple[str, str]] = set()
+
+def _api_key_digest(api_key: str, provider: str) -> Tuple[str, str]:
+    """计算API密钥的缓存键，不保存原始密钥"""
+    return provider.lower(), hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
 def sync_validate_api_key(api_key: str, provider: str = "deepseek") -> bool:
     """同步方式验证API密钥
     
+    验证成功的结果会缓存一段时间，避免每次创建模型实例都发起网络请求
+    
     Args:
         api_key: API密钥
         provider: 提供商，可以是"deepseek"或"openrouter"
@@ -41,42 +75,164 @@ def sync_validate_api_key(api_key: str, provider: str = "deepseek") -> bool:
     Returns:
         验证结果，True表示有效，False表示无效
     """
+    cache_key = _api_key_digest(api_key, provider)
+    with _validation_lock:
+        validated_at = _validation_cache.get(cache_key)
+    if validated_at is not None and time.monotonic() - validated_at < _VALIDATION_TTL:
+        return True
+    
+    # 使用模型列表端点验证API密钥
+    if provider.lower() == "deepseek":
+        url = "https://api.deepseek.com/v1/models"
+    else:  # openrouter
+        url = "https://openrouter.ai/api/v1/models"
+    headers = {"Authorization": f"Bearer {api_key}"}
+    
     try:
-        if provider.lower() == "deepseek":
-            # 使用简单的模型列表请求验证DeepSeek API
-            response = requests.get(
-                "https://api.deepseek.com/v1/models",
-                headers={"Authorization": f"Bearer {api_key}"},
-                timeout=10.0
-            )
-        else:  # openrouter
-            # 使用模型列表端点验证OpenRouter API
-            response = requests.get(
-                "https://openrouter.ai/api/v1/models",
-                headers={"Authorization": f"Bearer {api_key}"},
-                timeout=10.0
-            )
+        # 先用HEAD请求，只需要状态码，不下载模型列表
+        response = _VALIDATION_CLIENT.head(url, headers=headers)
+        status_code = response.status_code
+        error_text = ""
+        
+        # HEAD失败（或提供商不支持HEAD）时回退到GET，成功时不读取响应体
+        if status_code != 200:
+            with _VALIDATION_CLIENT.stream("GET", url, headers=headers) as response:
+                status_code = response.status_code
+                if status_code != 200:
+                    error_text = response.read().decode("utf-8", errors="replace")[:200]
             
         # 记录响应，便于调试
-        logger.debug(f"{provider.capitalize()} API密钥验证状态码: {response.status_code}")
+        logger.debug(f"{provider.capitalize()} API密钥验证状态码: {status_code}")
         
         # 检查响应是否成功
-        if response.status_code == 200:
+        if status_code == 200:
             logger.info(f"{provider.capitalize()} API密钥验证成功")
+            with _validation_lock:
+                _validation_cache[cache_key] = time.monotonic()
             return True
         
-        logger.warning(f"{provider.capitalize()} API密钥验证失败: {response.text[:200]}")
+        logger.warning(f"{provider.capitalize()} API密钥验证失败: {error_text}")
         return False
     except Exception as e:
         logger.error(f"验证{provider.capitalize()} API密钥时出错: {str(e)}")
         return False
 
+async def ensure_api_key_validated(api_key: str, provider: str) -> None:
+    """在首次调用时异步验证API密钥
+    
+    验证在线程中执行，不阻塞事件循环；每个密钥只验证一次，
+    验证失败仅记录警告，与初始化时验证的行为保持一致
+    
+    Args:
+        api_key: API密钥
+        provider: 提供商，可以是"deepseek"或"openrouter"
+    """
+    digest = _api_key_digest(api_key, provider)
+    if digest in _validated_keys:
+        return
+    
+    try:
+        key_valid = await asyncio.to_thread(sync_validate_api_key, api_key, provider)
+        if not key_valid:
+            logger.warning(f"{provider.capitalize()} API密钥验证失败，但仍将继续请求")
+    except Exception as e:
+        logger.error(f"验证{provider.capitalize()} API密钥时出错: {str(e)}")
+    
+    _validated_keys.add(digest)
+
+def _error_choice(content: str) -> Dict[str, Any]:
+    """构造一个表示错误的choice"""
+    return {"message": {"content": content}, "finish_reason": "error"}
+
+def _error_response(content: str, model_name: str, response_id: str = "error_id") -> Dict[str, Any]:
+    """构造请求失败时返回的替代响应
+    
+    所有错误路径共用这一处结构定义；每次调用都返回新的字典，调用方可以安全修改
+    
+    Args:
+        content: 错误提示内容
+        model_name: 模型名称
+        response_id: 响应ID
+        
+    Returns:
+        与OpenAI响应格式兼容的字典
+    """
+    return {
+        "id": response_id,
+        "choices": [_error_choice(content)],
+        "usage": {"total_tokens": 0},
+        "model": model_name
+    }
+
+def _normalize_openai_response(response: Any, model_name: str, provider: str) -> Dict[str, Any]:
+    """校验并修复OpenAI兼容接口的响应格式
+    
+    正常响应只做一次取值检查即返回，只有格式异常时才逐项修复
+    
+    Args:
+        response: 原始API响应
+        model_name: 模型名称，用于构造替代响应
+        provider: 提供商名称，用于日志
+        
+    Returns:
+        保证choices[0].message.content存在的响应字典
+    """
+    # 快速路径：格式正确的响应
+    try:
+        if isinstance(response, dict) and isinstance(response["choices"], list):
+            first_choice = response["choices"][0]
+            if isinstance(first_choice, dict) and isinstance(first_choice["message"], dict):
+                first_choice["message"]["content"]
+                return response
+    except (KeyError, TypeError, IndexError):
+        pass
+    
+    # 确保响应具有正确的格式
+    if not isinstance(response, dict):
+        logger.warning(f"{provider}返回了非字典响应: {type(response)}")
+        # 创建一个最小化的有效响应
+        return _error_response("API返回了非预期的响应格式，无法处理。请稍后再试。", model_name, "mock_id")
+    
+    # 检查必要的字段
+    if not isinstance(response.get("choices"), list):
+        logger.warning(f"{provider}响应缺少choices字段或格式不正确")
+        response["choices"] = [_error_choice("API响应缺少必要的choices字段，无法提取结果。")]
+    
+    # 确保choices非空
+    if not response["choices"]:
+        logger.warning(f"{provider}返回空choices列表")
+        response["choices"] = [_error_choice("API未返回任何生成内容。")]
+    
+    # 检查并修复第一个choice
+    first_choice = response["choices"][0]
+    if not isinstance(first_choice, dict):
+        logger.warning(f"{provider} choice不是字典: {type(first_choice)}")
+        first_choice = response["choices"][0] = _error_choice("API响应格式异常，无法提取生成内容。")
+    
+    # 检查并修复message字段
+    if not isinstance(first_choice.get("message"), dict):
+        logger.warning(f"{provider}响应缺少message字段或格式不正确")
+        first_choice["message"] = {"content": "API响应缺少必要的message字段，无法提取结果。"}
+    
+    # 检查并修复content字段
+    if "content" not in first_choice["message"]:
+        logger.warning(f"{provider}响应message缺少content字段")
+        first_choice["message"]["content"] = "API响应缺少必要的content字段，无法提取结果。"
+    
+    return response
+
 class ChatOpenRouter(ChatOpenAI):
     """专门为OpenRouter API设计的ChatOpenAI子类
     
     使用OpenRouter的API兼容OpenAI的接口
     """
     
+    # 待在首次请求时验证的API密钥
+    _pending_api_key: Optional[str] = PrivateAttr(default=None)
+    # 每次请求都相同的额外请求头和请求体参数，初始化时预先计算
+    _extra_headers: Dict[str, str] = PrivateAttr(default_factory=dict)
+    _extra_body_template: Dict[str, Any] = PrivateAttr(default_factory=dict)
+    
     def __init__(
         self,
         model_name: str = None,
@@ -105,18 +261,6 @@ class ChatOpenRouter(ChatOpenAI):
             logger.error("未提供OpenRouter API密钥")
             raise ValueError("未提供OpenRouter API密钥")
         
-        # 如果开启了验证，则在初始化时使用同步方法验证API密钥
-        if validate_api_key:
-            try:
-                # 使用同步验证方法，避免异步事件循环问题
-                key_valid = sync_validate_api_key(openrouter_api_key, "openrouter")
-                
-                if not key_valid:
-                    logger.warning(f"OpenRouter API密钥验证失败，但仍将继续初始化")
-            except Exception as e:
-                logger.error(f"验证OpenRouter API密钥时出错: {str(e)}")
-                # 继续初始化，因为密钥可能在某些情况下仍然有效
-        
         # 设置基本参数
         model_name = model_name or settings.OPENROUTER_MODEL
         
@@ -136,6 +280,14 @@ class ChatOpenRouter(ChatOpenAI):
             **kwargs
         )
         
+        # API密钥验证推迟到首次请求时异步执行，避免构造时阻塞事件循环
+        if validate_api_key:
+            self._pending_api_key = openrouter_api_key
+        
+        # 预先计算OpenRouter特定的头部和参数，如include_reasoning
+        self._extra_headers = self._prepare_request_headers()
+        self._extra_body_template = {"include_reasoning": True} if settings.ENABLE_REASONING else {}
+        
         logger.info(f"初始化ChatOpenRouter成功，使用模型: {model_name}")
     
     def _prepare_request_headers(self) -> Dict[str, str]:
@@ -152,6 +304,44 @@ class ChatOpenRouter(ChatOpenAI):
             
         return headers
     
+    async def _prepare_request(self, kwargs: Dict[str, Any]) -> None:
+        """请求前的准备：首次请求时验证API密钥，并添加OpenRouter特定的头部和参数"""
+        if self._pending_api_key:
+            await ensure_api_key_validated(self._pending_api_key, "openrouter")
+            self._pending_api_key = None
+        
+        kwargs.setdefault("extra_headers", {}).update(self._extra_headers)
+        kwargs.setdefault("extra_body", {}).update(self._extra_body_template)
+    
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """非流式生成
+        
+        ainvoke默认经由此方法发送请求，不会调用_acreate，因此在这里完成请求前的准备
+        """
+        await self._prepare_request(kwargs)
+        return await super()._agenerate(messages, stop, run_manager, **kwargs)
+    
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """流式生成，逐个产出SSE增量块
+        
+        streaming=True时ChatOpenAI的_agenerate会经由此方法聚合结果
+        """
+        await self._prepare_request(kwargs)
+        async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+            yield chunk
+    
     async def _acreate(
         self,
         messages: List[Dict[str, Any]],
@@ -169,97 +359,23 @@ class ChatOpenRouter(ChatOpenAI):
             API响应字典
         """
         try:
-            # 添加OpenRouter特定的头部
-            headers = self._prepare_request_headers()
-            if headers and "extra_headers" not in kwargs:
-                kwargs["extra_headers"] = headers
-            elif headers and "extra_headers" in kwargs:
-                kwargs["extra_headers"].update(headers)
-            
-            # 添加OpenRouter特定的参数，如include_reasoning
-            if "extra_body" not in kwargs:
-                kwargs["extra_body"] = {}
-            
-            # 如果启用了推理功能，添加include_reasoning参数
-            if settings.ENABLE_REASONING:
-                kwargs["extra_body"]["include_reasoning"] = True
+            await self._prepare_request(kwargs)
             
             # 调用父类的方法发送请求
             response = await super()._acreate(messages, stop, **kwargs)
             
             # 检查并记录响应
-            logger.debug(f"OpenRouter API 原始响应: {response}")
+            logger.debug("OpenRouter API 原始响应: %r", response)
             
             # 确保响应具有正确的格式
-            if not isinstance(response, dict):
-                logger.warning(f"OpenRouter返回了非字典响应: {type(response)}")
-                # 创建一个最小化的有效响应
-                return {
-                    "id": "mock_id",
-                    "choices": [
-                        {
-                            "message": {
-                                "content": "API返回了非预期的响应格式，无法处理。请稍后再试。"
-                            },
-                            "finish_reason": "error"
-                        }
-                    ],
-                    "usage": {"total_tokens": 0},
-                    "model": self.model_name
-                }
-                
-            # 检查必要的字段
-            if "choices" not in response or not isinstance(response["choices"], list):
-                logger.warning("OpenRouter响应缺少choices字段或格式不正确")
-                response["choices"] = [
-                    {
-                        "message": {
-                            "content": "API响应缺少必要的choices字段，无法提取结果。"
-                        },
-                        "finish_reason": "error"
-                    }
-                ]
-            
-            # 确保choices非空
-            if not response["choices"]:
-                logger.warning("OpenRouter返回空choices列表")
-                response["choices"] = [
-                    {
-                        "message": {
-                            "content": "API未返回任何生成内容。"
-                        },
-                        "finish_reason": "error"
-                    }
-                ]
-                
-            # 检查并修复第一个choice
+            response = _normalize_openai_response(response, self.model_name, "OpenRouter")
             first_choice = response["choices"][0]
-            if not isinstance(first_choice, dict):
-                logger.warning(f"OpenRouter choice不是字典: {type(first_choice)}")
-                response["choices"][0] = {
-                    "message": {
-                        "content": "API响应格式异常，无法提取生成内容。"
-                    },
-                    "finish_reason": "error"
-                }
-                
-            # 检查并修复message字段
-            if "message" not in first_choice or not isinstance(first_choice["message"], dict):
-                logger.warning("OpenRouter响应缺少message字段或格式不正确")
-                response["choices"][0]["message"] = {
-                    "content": "API响应缺少必要的message字段，无法提取结果。"
-                }
-                
-            # 检查并修复content字段  
-            if "content" not in first_choice.get("message", {}):
-                logger.warning("OpenRouter响应message缺少content字段")
-                response["choices"][0]["message"]["content"] = "API响应缺少必要的content字段，无法提取结果。"
-                
+            
             # 额外处理reasoning字段
             if settings.ENABLE_REASONING and "reasoning" in first_choice.get("message", {}):
                 # 记录推理过程
                 reasoning = first_choice["message"].get("reasoning", "")
-                logger.debug(f"OpenRouter推理内容: {reasoning[:500]}...")
+                logger.debug("OpenRouter推理内容: %.500s...", reasoning)
                 
                 # 可以根据需要对推理内容进行额外处理
                 
@@ -268,19 +384,7 @@ class ChatOpenRouter(ChatOpenAI):
         except Exception as e:
             logger.error(f"OpenRouter API请求失败: {str(e)}")
             # 返回一个模拟响应以避免崩溃
-            return {
-                "id": "error_id",
-                "choices": [
-                    {
-                        "message": {
-                            "content": f"API请求失败: {str(e)}"
-                        },
-                        "finish_reason": "error"
-                    }
-                ],
-                "usage": {"total_tokens": 0},
-                "model": self.model_name
-            }
+            return _error_response(f"API请求失败: {str(e)}", self.model_name)
 
 class ChatDeepSeek(ChatOpenAI):
     """专门为DeepSeek API设计的ChatOpenAI子类
@@ -288,6 +392,9 @@ class ChatDeepSeek(ChatOpenAI):
     使用DeepSeek的API兼容OpenAI的接口
     """
     
+    # 待在首次请求时验证的API密钥
+    _pending_api_key: Optional[str] = PrivateAttr(default=None)
+    
     def __init__(
         self,
         model_name: str = None,
@@ -312,18 +419,6 @@ class ChatDeepSeek(ChatOpenAI):
             logger.error("未提供DeepSeek API密钥")
             raise ValueError("未提供DeepSeek API密钥")
         
-        # 如果开启了验证，则在初始化时使用同步方法验证API密钥
-        if validate_api_key:
-            try:
-                # 使用同步验证方法，避免异步事件循环问题
-                key_valid = sync_validate_api_key(deepseek_api_key, "deepseek")
-                
-                if not key_valid:
-                    logger.warning(f"DeepSeek API密钥验证失败，但仍将继续初始化")
-            except Exception as e:
-                logger.error(f"验证DeepSeek API密钥时出错: {str(e)}")
-                # 继续初始化，因为密钥可能在某些情况下仍然有效
-        
         # 设置基本参数
         model_name = model_name or settings.DEEPSEEK_MODEL
         
@@ -339,8 +434,47 @@ class ChatDeepSeek(ChatOpenAI):
             **kwargs
         )
         
+        # API密钥验证推迟到首次请求时异步执行，避免构造时阻塞事件循环
+        if validate_api_key:
+            self._pending_api_key = deepseek_api_key
+        
         logger.info(f"初始化ChatDeepSeek成功，使用模型: {model_name}")
     
+    async def _prepare_request(self) -> None:
+        """请求前的准备：首次请求时异步验证API密钥"""
+        if self._pending_api_key:
+            await ensure_api_key_validated(self._pending_api_key, "deepseek")
+            self._pending_api_key = None
+    
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """非流式生成
+        
+        ainvoke默认经由此方法发送请求，不会调用_acreate，因此在这里完成请求前的准备
+        """
+        await self._prepare_request()
+        return await super()._agenerate(messages, stop, run_manager, **kwargs)
+    
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """流式生成，逐个产出SSE增量块
+        
+        streaming=True时ChatOpenAI的_agenerate会经由此方法聚合结果
+        """
+        await self._prepare_request()
+        async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+            yield chunk
+    
     async def _acreate(
         self,
         messages: List[Dict[str, Any]],
@@ -358,81 +492,22 @@ class ChatDeepSeek(ChatOpenAI):
             API响应字典
         """
         try:
+            await self._prepare_request()
+            
             # 调用父类的方法发送请求
             response = await super()._acreate(messages, stop, **kwargs)
             
             # 检查并记录响应
-            logger.debug(f"DeepSeek API 原始响应: {response}")
+            logger.debug("DeepSeek API 原始响应: %r", response)
             
             # 确保响应具有正确的格式
-            if not isinstance(response, dict):
-                logger.warning(f"DeepSeek返回了非字典响应: {type(response)}")
-                # 创建一个最小化的有效响应
-                return {
-                    "id": "mock_id",
-                    "choices": [
-                        {
-                            "message": {
-                                "content": "API返回了非预期的响应格式，无法处理。请稍后再试。"
-                            },
-                            "finish_reason": "error"
-                        }
-                    ],
-                    "usage": {"total_tokens": 0},
-                    "model": self.model_name
-                }
-                
-            # 检查必要的字段
-            if "choices" not in response or not isinstance(response["choices"], list):
-                logger.warning("DeepSeek响应缺少choices字段或格式不正确")
-                response["choices"] = [
-                    {
-                        "message": {
-                            "content": "API响应缺少必要的choices字段，无法提取结果。"
-                        },
-                        "finish_reason": "error"
-                    }
-                ]
-            
-            # 确保choices非空
-            if not response["choices"]:
-                logger.warning("DeepSeek返回空choices列表")
-                response["choices"] = [
-                    {
-                        "message": {
-                            "content": "API未返回任何生成内容。"
-                        },
-                        "finish_reason": "error"
-                    }
-                ]
-                
-            # 检查并修复第一个choice
+            response = _normalize_openai_response(response, self.model_name, "DeepSeek")
             first_choice = response["choices"][0]
-            if not isinstance(first_choice, dict):
-                logger.warning(f"DeepSeek choice不是字典: {type(first_choice)}")
-                response["choices"][0] = {
-                    "message": {
-                        "content": "API响应格式异常，无法提取生成内容。"
-                    },
-                    "finish_reason": "error"
-                }
-                
-            # 检查并修复message字段
-            if "message" not in first_choice or not isinstance(first_choice["message"], dict):
-                logger.warning("DeepSeek响应缺少message字段或格式不正确")
-                response["choices"][0]["message"] = {
-                    "content": "API响应缺少必要的message字段，无法提取结果。"
-                }
-                
-            # 检查并修复content字段  
-            if "content" not in first_choice.get("message", {}):
-                logger.warning("DeepSeek响应message缺少content字段")
-                response["choices"][0]["message"]["content"] = "API响应缺少必要的content字段，无法提取结果。"
-                
+            
             # 处理DeepSeek的推理内容字段
             if settings.ENABLE_REASONING and "reasoning_content" in first_choice.get("message", {}):
                 reasoning_content = first_choice["message"].get("reasoning_content", "")
-                logger.debug(f"DeepSeek推理内容: {reasoning_content[:500]}...")
+                logger.debug("DeepSeek推理内容: %.500s...", reasoning_content)
                 
                 # 可以根据需要对推理内容进行额外处理
                 
@@ -441,19 +516,106 @@ class ChatDeepSeek(ChatOpenAI):
         except Exception as e:
             logger.error(f"DeepSeek API请求失败: {str(e)}")
             # 返回一个模拟响应以避免崩溃
-            return {
-                "id": "error_id",
-                "choices": [
-                    {
-                        "message": {
-                            "content": f"API请求失败: {str(e)}"
-                        },
-                        "finish_reason": "error"
-                    }
-                ],
-                "usage": {"total_tokens": 0},
-                "model": self.model_name
-            }
+            return _error_response(f"API请求失败: {str(e)}", self.model_name)
+
+# 每个事件循环一个信号量，限制同时进行的LLM请求数；
+# 延迟创建以避免在导入时绑定事件循环
+_llm_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _get_llm_semaphore() -> asyncio.Semaphore:
+    """获取当前事件循环的LLM并发信号量"""
+    loop = asyncio.get_running_loop()
+    semaphore = _llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _llm_semaphores[loop] = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+    return semaphore
+
+class RequestBatcher:
+    """合并并发的相同LLM请求
+    
+    同一事件循环中键相同的请求在第一个请求完成前到达时，
+    不再单独调用提供商，而是等待并共享第一个请求的结果。
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+    
+    async def submit(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        提交请求
+        
+        实际请求在独立任务中运行，所有等待方（包括第一个）都通过shield等待它，
+        某个等待方被取消时不会连带取消其他等待方共享的请求
+        
+        Args:
+            key: 请求的合并键
+            factory: 实际发起请求的协程工厂
+            
+        Returns:
+            请求结果
+        """
+        loop = asyncio.get_running_loop()
+        inflight_key = (id(loop), key)
+        
+        task = self._inflight.get(inflight_key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[inflight_key] = task
+            task.add_done_callback(lambda done: self._on_done(inflight_key, done))
+        return await asyncio.shield(task)
+    
+    def _on_done(self, inflight_key: Tuple[int, Hashable], task: asyncio.Future) -> None:
+        """请求任务结束后移除登记，并获取异常以避免没有等待方时产生告警"""
+        if self._inflight.get(inflight_key) is task:
+            del self._inflight[inflight_key]
+        if not task.cancelled():
+            task.exception()
+
+# 全局请求合并器实例
+request_batcher = RequestBatcher()
+
+# LangChain消息类型到OpenRouter角色的映射
+_ROLE_MAP: Dict[type, str] = {
+    HumanMessage: "user",
+    AIMessage: "assistant",
+    SystemMessage: "system",
+}
+
+# OpenRouter API仅支持的角色
+_OPENROUTER_ROLES = frozenset({"system", "user", "assistant"})
+
+def _convert_other_message(message: BaseMessage) -> Dict[str, str]:
+    """转换不在_ROLE_MAP中的消息（子类、ChatMessage及其他类型）"""
+    for message_type, role in _ROLE_MAP.items():
+        if isinstance(message, message_type):
+            return {"role": role, "content": message.content}
+    
+    if isinstance(message, ChatMessage):
+        # 默认将未知角色转为user
+        role = message.role if message.role in _OPENROUTER_ROLES else "user"
+        return {"role": role, "content": message.content}
+    
+    # 处理其他消息类型，默认作为user消息
+    return {"role": "user", "content": str(message.content)}
+
+# 供同步接口在运行中的事件循环内调用异步方法的后台事件循环
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_loop_lock = threading.Lock()
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """获取（必要时创建）运行在守护线程中的后台事件循环"""
+    global _background_loop
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever,
+                    name="langchain-llm-bg-loop",
+                    daemon=True
+                ).start()
+                _background_loop = loop
+    return _background_loop
 
 class CustomChatModel(BaseChatModel):
     """将现有LLM服务适配到LangChain框架的聊天模型类"""
@@ -466,79 +628,60 @@ class CustomChatModel(BaseChatModel):
     # 配置选项
     use_direct_connection: bool = False
     proxy: Optional[Dict[str, str]] = None
-    _llm_service: Optional[OpenRouterLLMService] = None
     
     @property
     def _llm_type(self) -> str:
         """返回LLM类型标识"""
         return "custom_openrouter_chat"
     
-    @property
+    @functools.cached_property
     def llm_service(self) -> OpenRouterLLMService:
-        """获取或创建LLM服务实例"""
-        if self._llm_service is None:
-            self._llm_service = get_llm_service(
-                use_direct_connection=self.use_direct_connection,
-                proxy=self.proxy,
-                use_sdk=True
-            )
-        return self._llm_service
+        """获取或创建LLM服务实例，首次访问后缓存在实例上"""
+        return get_llm_service(
+            use_direct_connection=self.use_direct_connection,
+            proxy=self.proxy,
+            use_sdk=True
+        )
     
     def _convert_messages_to_openrouter_format(self, messages: List[BaseMessage]) -> List[Dict[str, str]]:
         """将LangChain消息格式转换为OpenRouter格式"""
-        openrouter_messages = []
-        
-        for message in messages:
-            if isinstance(message, HumanMessage):
-                openrouter_messages.append({"role": "user", "content": message.content})
-            elif isinstance(message, AIMessage):
-                openrouter_messages.append({"role": "assistant", "content": message.content})
-            elif isinstance(message, SystemMessage):
-                openrouter_messages.append({"role": "system", "content": message.content})
-            elif isinstance(message, ChatMessage):
-                role = message.role
-                # OpenRouter API仅支持system、user、assistant角色
-                if role not in ["system", "user", "assistant"]:
-                    # 默认将未知角色转为user
-                    role = "user"
-                openrouter_messages.append({"role": role, "content": message.content})
-            else:
-                # 处理其他消息类型，默认作为user消息
-                openrouter_messages.append({"role": "user", "content": str(message.content)})
-        
-        return openrouter_messages
+        # 常见消息类型按精确类型查表，其余类型走_convert_other_message
+        return [
+            {"role": _ROLE_MAP[type(message)], "content": message.content}
+            if type(message) in _ROLE_MAP
+            else _convert_other_message(message)
+            for message in messages
+        ]
     
     def _create_chat_result(self, response: Dict[str, Any]) -> ChatResult:
         """将OpenRouter响应转换为LangChain ChatResult"""
-        generations = []
+        llm_output = {
+            "token_usage": response.get("usage", {}),
+            "model_name": response.get("model", self.model_name)
+        }
         
-        if "error" in response and response["error"]:
+        if response.get("error"):
             # 处理错误情况
-            error_message = response.get("message", "Unknown error")
-            logger.error(f"OpenRouter API error: {error_message}")
+            logger.error(f"OpenRouter API error: {response.get('message', 'Unknown error')}")
             
             # 创建一个错误消息的生成结果
-            content = response.get("choices", [{}])[0].get("message", {}).get("content", 
+            choices = response.get("choices") or ({},)
+            content = choices[0].get("message", {}).get("content",
                 "抱歉，我遇到了技术问题，无法处理您的请求。请稍后再试。")
             generation = ChatGeneration(
                 message=AIMessage(content=content),
                 generation_info={"finish_reason": "error"}
             )
-            generations.append(generation)
-        else:
-            # 处理正常情况
-            for choice in response.get("choices", []):
-                message_content = choice.get("message", {}).get("content", "")
-                generation = ChatGeneration(
-                    message=AIMessage(content=message_content),
-                    generation_info={"finish_reason": choice.get("finish_reason")}
-                )
-                generations.append(generation)
-        
-        # 获取token使用信息
-        token_usage = response.get("usage", {})
-        llm_output = {"token_usage": token_usage, "model_name": response.get("model", self.model_name)}
+            return ChatResult(generations=[generation], llm_output=llm_output)
         
+        # 处理正常情况
+        generations = [
+            ChatGeneration(
+                message=AIMessage(content=choice.get("message", {}).get("content", "")),
+                generation_info={"finish_reason": choice.get("finish_reason")}
+            )
+            for choice in response.get("choices", ())
+        ]
         return ChatResult(generations=generations, llm_output=llm_output)
     
     def _generate(
@@ -549,32 +692,18 @@ class CustomChatModel(BaseChatModel):
         **kwargs: Any,
     ) -> ChatResult:
         """同步生成聊天完成结果"""
-        # 不使用asyncio.run，避免在已有事件循环中嵌套
+        coro = self._agenerate(messages, stop, run_manager, **kwargs)
+        
         try:
-            loop = asyncio.get_event_loop()
+            asyncio.get_running_loop()
         except RuntimeError:
-            # 如果没有事件循环，创建一个新的
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        # 执行异步方法
-        if loop.is_running():
-            # 当前在事件循环中，不能直接使用run_until_complete
-            logger.warning("在运行中的事件循环中调用同步方法，将使用替代方案")
-            # 创建一个Future并在当前事件循环中安排它的执行
-            future = asyncio.ensure_future(
-                self._agenerate(messages, stop, run_manager, **kwargs)
-            )
-            # 阻塞直到Future完成
-            while not future.done():
-                # 给事件循环一些时间处理其他任务
-                loop.run_until_complete(asyncio.sleep(0.01))
-            return future.result()
-        else:
             # 不在事件循环中，可以直接运行
-            return loop.run_until_complete(
-                self._agenerate(messages, stop, run_manager, **kwargs)
-            )
+            return asyncio.run(coro)
+        
+        # 当前线程的事件循环正在运行，不能阻塞等待它自己；
+        # 将协程提交到后台事件循环线程执行并等待结果
+        logger.warning("在运行中的事件循环中调用同步方法，将在后台事件循环中执行")
+        return asyncio.run_coroutine_threadsafe(coro, _get_background_loop()).result()
     
     async def _agenerate(
         self,
@@ -591,12 +720,26 @@ class CustomChatModel(BaseChatModel):
         temperature = kwargs.get("temperature", self.temperature)
         max_tokens = kwargs.get("max_tokens", self.max_tokens)
         
-        # 调用LLM服务
-        response = await self.llm_service.generate(
-            messages=openrouter_messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        async def call_llm_service() -> Dict[str, Any]:
+            # 调用LLM服务，受并发信号量限制
+            async with _get_llm_semaphore():
+                return await self.llm_service.generate(
+                    messages=openrouter_messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+        
+        if settings.ENABLE_BATCHING:
+            # 合并并发的相同请求
+            key = (
+                self.model_name,
+                temperature,
+                max_tokens,
+                tuple((m["role"], m["content"]) for m in openrouter_messages)
+            )
+            response = await request_batcher.submit(key, call_llm_service)
+        else:
+            response = await call_llm_service()
         
         # 转换结果
         return self._create_chat_result(response)
@@ -610,64 +753,73 @@ class WrappedChatOpenAI(ChatOpenAI):
     
     async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[Any] = None, **kwargs: Any) -> Any:
         """重写异步生成方法以添加日志记录"""
-        start_time = time.perf_counter()
+        # 记录请求信息，只有开启DEBUG日志时才拼接完整提示词
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        if debug_enabled:
+            prompt_str = "\n".join([f"{msg.type}: {msg.content}" for msg in messages])
+            logger.debug("发送请求到模型: %s", self.model_name)
         
+        start_ns = time.perf_counter_ns()
+        error: Optional[Exception] = None
         try:
-            # 记录请求信息
-            prompt_str = "\n".join([f"{msg.type}: {msg.content}" for msg in messages])
-            logger.debug(f"发送请求到模型: {self.model_name}")
-            
-            # 调用原始方法
-            response = await super()._agenerate(messages, stop, run_manager, **kwargs)
-            
-            # 记录详细日志
-            elapsed_time = time.perf_counter() - start_time
+            # 调用原始方法，受并发信号量限制
+            async with _get_llm_semaphore():
+                response = await super()._agenerate(messages, stop, run_manager, **kwargs)
+        except Exception as e:
+            error = e
+        finally:
+            # 成功和失败路径统一计算一次耗时
+            elapsed_time = (time.perf_counter_ns() - start_ns) / 1e9
+        
+        if error is not None:
+            logger.error(f"LLM请求错误: {str(error)}, 耗时: {elapsed_time:.2f}秒")
             
-            # 修复：增加更强健的错误处理
-            if hasattr(response, "generations"):
-                if response.generations is None:
-                    logger.warning("响应的generations属性为None")
-                elif len(response.generations) > 0:
-                    first_gen = response.generations[0]
-                    if first_gen:
-                        message = first_gen[0].message if isinstance(first_gen, list) and len(first_gen) > 0 else None
-                
-                    # 记录token使用情况
-                    token_usage = None
-                    if hasattr(response, "llm_output") and response.llm_output:
-                        token_usage = response.llm_output.get("token_usage")
-                
-                    # 详细日志记录
-                    log_llm_request(
-                        prompt=prompt_str,
-                        response=message,
-                        model=self.model_name,
-                        tokens=token_usage,
-                        time=elapsed_time
-                    )
-            else:
-                logger.warning("响应缺少generations属性")
+            # 返回带有错误信息的空响应，而不是直接抛出异常
+            generation = ChatGeneration(
+                message=AIMessage(content=f"生成失败: {str(error)}"),
+                generation_info={"finish_reason": "error"}
+            )
+            return ChatResult(generations=[[generation]], llm_output={"error": str(error)})
+        
+        # 修复：增加更强健的错误处理
+        if not hasattr(response, "generations"):
+            logger.warning("响应缺少generations属性")
+            if debug_enabled:
                 log_llm_request(
                     prompt=prompt_str,
-                    response="缺少结构化响应",
+                    content="缺少结构化响应",
                     model=self.model_name,
                     tokens=None,
                     time=elapsed_time
                 )
+        elif response.generations is None:
+            logger.warning("响应的generations属性为None")
+        elif len(response.generations) > 0 and debug_enabled:
+            first_gen = response.generations[0]
+            message = first_gen[0].message if isinstance(first_gen, list) and len(first_gen) > 0 else None
             
-            return response
-        except Exception as e:
-            elapsed_time = time.perf_counter() - start_time
-            logger.error(f"LLM请求错误: {str(e)}, 耗时: {elapsed_time:.2f}秒")
+            # 记录token使用情况
+            token_usage = None
+            if hasattr(response, "llm_output") and response.llm_output:
+                token_usage = response.llm_output.get("token_usage")
             
-            # 返回带有错误信息的空响应，而不是直接抛出异常
-            from langchain_core.outputs import ChatGeneration, ChatResult
-            error_message = f"生成失败: {str(e)}"
-            generation = ChatGeneration(
-                message=AIMessage(content=error_message),
-                generation_info={"finish_reason": "error"}
+            # 详细日志记录
+            log_llm_request(
+                prompt=prompt_str,
+                content=extract_content_from_response(message),
+                model=self.model_name,
+                tokens=token_usage,
+                time=elapsed_time
             )
-            return ChatResult(generations=[[generation]], llm_output={"error": str(e)})
+        
+        return response
+
+
+# AI模型提供商 -> (模型名称, 聊天模型类)
+_FACTORIES: Dict[str, Tuple[str, type]] = {
+    "deepseek": (settings.DEEPSEEK_MODEL, ChatDeepSeek),
+    "openrouter": (settings.OPENROUTER_MODEL, ChatOpenRouter),
+}
 
 
 def get_langchain_chat_model(
@@ -679,6 +831,8 @@ def get_langchain_chat_model(
     """
     获取LangChain聊天模型
     
+    相同参数的调用返回同一个缓存的模型实例
+    
     Args:
         temperature: 温度参数
         max_tokens: 最大生成token数
@@ -688,83 +842,69 @@ def get_langchain_chat_model(
     Returns:
         LangChain聊天模型
     """
-    # 根据默认AI模型配置选择不同的模型
-    if settings.DEFAULT_AI_MODEL.lower() == "deepseek":
-        model_name = settings.DEEPSEEK_MODEL
-        
-        logger.info(f"使用LangChain与DeepSeek连接, 模型: {model_name}")
-        
-        try:
-            # 构建模型参数
-            model_kwargs = {
-                "temperature": temperature
-            }
-            
-            if max_tokens:
-                model_kwargs["max_tokens"] = max_tokens
-            
-            # 创建ChatDeepSeek实例
-            return ChatDeepSeek(
-                model_name=model_name,
-                **model_kwargs
-            )
-        except Exception as e:
-            logger.error(f"初始化DeepSeek LangChain聊天模型失败: {str(e)}")
-            raise
-    elif settings.DEFAULT_AI_MODEL.lower() == "openrouter":
-        model_name = settings.OPENROUTER_MODEL
-        
-        logger.info(f"使用LangChain与OpenRouter连接, 模型: {model_name}")
-        
-        try:
-            # 创建ChatOpenRouter实例，优先使用这个专用类
-            model_kwargs = {
-                "temperature": temperature
-            }
-            
-            if max_tokens:
-                model_kwargs["max_tokens"] = max_tokens
-            
-            return ChatOpenRouter(
-                model_name=model_name,
-                **model_kwargs
-            )
-        except Exception as e:
-            logger.error(f"初始化OpenRouter LangChain聊天模型失败，尝试使用通用CustomChatModel: {str(e)}")
-            # 如果专用类失败，回退到CustomChatModel
-            try:
-                return CustomChatModel(
-                    model_name=model_name,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    use_direct_connection=use_direct_connection,
-                    proxy=proxy
-                )
-            except Exception as e2:
-                logger.error(f"初始化CustomChatModel也失败: {str(e2)}")
-            raise
-    else:
-        # 不支持的模型类型，默认使用DeepSeek
+    # 代理设置是字典，转换为可哈希的元组作为缓存键
+    proxy_items = tuple(sorted(proxy.items())) if proxy else None
+    return _get_langchain_chat_model_cached(temperature, max_tokens, use_direct_connection, proxy_items)
+
+
+@functools.lru_cache(maxsize=32)
+def _get_langchain_chat_model_cached(
+    temperature: float,
+    max_tokens: Optional[int],
+    use_direct_connection: bool,
+    proxy_items: Optional[Tuple[Tuple[str, str], ...]]
+) -> BaseChatModel:
+    """
+    创建LangChain聊天模型，结果按参数缓存
+    
+    Args:
+        temperature: 温度参数
+        max_tokens: 最大生成token数
+        use_direct_connection: 是否使用直接连接
+        proxy_items: 代理设置的键值对元组
+    
+    Returns:
+        LangChain聊天模型
+    """
+    proxy = dict(proxy_items) if proxy_items else None
+    
+    # 根据默认AI模型配置选择不同的模型，不支持的类型默认使用DeepSeek
+    provider = settings.DEFAULT_AI_MODEL.lower()
+    if provider not in _FACTORIES:
         logger.warning(f"不支持的AI模型类型: {settings.DEFAULT_AI_MODEL}，使用DeepSeek作为默认")
-        model_name = settings.DEEPSEEK_MODEL
+        provider = "deepseek"
+    model_name, model_cls = _FACTORIES[provider]
+    
+    logger.info(f"使用LangChain与{provider}连接, 模型: {model_name}")
+    
+    # 构建模型参数
+    model_kwargs = {
+        "temperature": temperature
+    }
+    
+    if max_tokens:
+        model_kwargs["max_tokens"] = max_tokens
+    
+    try:
+        return model_cls(model_name=model_name, **model_kwargs)
+    except Exception as e:
+        if provider != "openrouter":
+            logger.error(f"初始化{provider} LangChain聊天模型失败: {str(e)}")
+            raise
         
+        logger.error(f"初始化OpenRouter LangChain聊天模型失败，尝试使用通用CustomChatModel: {str(e)}")
+        # 如果专用类失败，回退到CustomChatModel
         try:
-            # 构建模型参数
-            model_kwargs = {
-                "temperature": temperature
-            }
-            
-            if max_tokens:
-                model_kwargs["max_tokens"] = max_tokens
-            
-            # 创建ChatDeepSeek实例
-            return ChatDeepSeek(
+            return CustomChatModel(
                 model_name=model_name,
-                **model_kwargs
+                temperature=temperature,
+                max_tokens=max_tokens,
+                use_direct_connection=use_direct_connection,
+                proxy=proxy
             )
-        except Exception as e:
-            logger.error(f"初始化DeepSeek LangChain聊天模型失败: {str(e)}")
-            raise
+        except Exception as e2:
+            logger.error(f"初始化CustomChatModel也失败: {str(e2)}")
+        raise
 
 
 # 测试例子
@@ -793,6 +933,165 @@ async def test_langchain_chat_model():
         logger.error(f"测试LangChain聊天模型失败: {str(e)}")
         return False
 
+# 区分"没有元素"与"元素为None"的哨兵对象
+_SENTINEL = object()
+
+def _extract_attr_content(response):
+    """提取带content属性的响应(如AIMessage)"""
+    return response.content
+
+def _extract_message_content(response):
+    """提取带message属性的响应，message无content时继续按LangChain格式或字符串处理"""
+    message = getattr(response, "message", None)
+    if message is not None and hasattr(message, "content"):
+        return message.content
+    if hasattr(response, "generations"):
+        return _extract_from_generations(response)
+    return str(response)
+
+def _extract_str(response):
+    """字符串直接返回"""
+    return response
+
+def _extract_from_dict(response):
+    """提取字典格式(OpenAI/OpenRouter)的响应"""
+    # 直接content字段
+    if "content" in response:
+        return response["content"]
+        
+    # OpenAI/OpenRouter格式
+    if "choices" in response:
+        choices = response.get("choices")
+        # 安全检查choices
+        if choices is None:
+            logger.warning("响应中choices为None")
+            return "API返回了无效的响应格式"
+            
+        if not isinstance(choices, list):
+            logger.warning(f"响应中choices不是列表: {type(choices)}")
+            return "API返回了意外的响应格式，choices应为列表"
+            
+        if not choices:  # 空列表
+            logger.warning("响应中choices列表为空")
+            return "API未返回任何生成内容"
+        
+        # 获取第一个choice
+        first_choice = choices[0]
+        if not isinstance(first_choice, dict):
+            logger.warning(f"响应中first_choice不是字典: {type(first_choice)}")
+            return f"API返回了意外的choice格式: {first_choice}"
+        
+        # 检查message字段
+        message = first_choice.get("message")
+        if message is None:
+            logger.warning("响应中message为None")
+            
+            # 尝试直接从choice中获取文本，某些API可能直接提供text字段
+            if "text" in first_choice:
+                return first_choice["text"]
+                
+            return "API返回了无效的响应格式，缺少message字段"
+        
+        if not isinstance(message, dict):
+            logger.warning(f"响应中message不是字典: {type(message)}")
+            
+            # 如果message是字符串，可能直接就是内容
+            if isinstance(message, str):
+                return message
+                
+            return f"API返回了意外的message格式: {message}"
+        
+        # 从message中获取content
+        if "content" in message:
+            content = message["content"]
+            if content is None:
+                logger.warning("响应中content为None")
+                return "API返回了空内容"
+            return content
+        else:
+            logger.warning("响应中message缺少content字段")
+            # 尝试使用整个message作为内容
+            return str(message)
+    
+    return str(response)
+
+def _extract_from_generations(response):
+    """提取LangChain专用格式(ChatResult/LLMResult)的响应"""
+    generations = getattr(response, "generations", None)
+    
+    # 检查generations
+    if generations is None:
+        logger.warning("响应的generations属性为None")
+        return "无法解析生成的回复，生成结果为空"
+    
+    # 检查是否可迭代且非空
+    if not hasattr(generations, "__iter__"):
+        logger.warning(f"响应的generations属性不可迭代: {type(generations)}")
+        return "无法解析生成的回复，generations格式无效"
+    
+    try:
+        # 只取第一个generation，不把整个可迭代对象物化为列表
+        generation = next(iter(generations), _SENTINEL)
+        if generation is _SENTINEL:
+            logger.warning("响应的generations列表为空")
+            return "无法解析生成的回复，generations列表为空"
+        
+        # 尝试不同的提取路径，直接访问属性，缺失时捕获AttributeError
+        try:
+            return generation.message.content
+        except AttributeError:
+            pass
+            
+        try:
+            return generation.text
+        except AttributeError:
+            pass
+            
+        # 检查是否为列表
+        if isinstance(generation, list) and generation:
+            try:
+                return generation[0].message.content
+            except AttributeError:
+                pass
+                
+        # 如果是字典，尝试直接获取text或content字段
+        if isinstance(generation, dict):
+            if "text" in generation:
+                return generation["text"]
+            if "content" in generation:
+                return generation["content"]
+            if "message" in generation and isinstance(generation["message"], dict):
+                msg = generation["message"]
+                if "content" in msg:
+                    return msg["content"]
+        
+        # 尝试转为字符串
+        return str(generation)
+        
+    except (TypeError, IndexError) as e:
+        logger.error(f"处理generations时出错: {str(e)}")
+        return f"处理LLM响应时出错: {str(e)}"
+
+def _resolve_extractor(response) -> Callable[[Any], Any]:
+    """按原有的判断顺序为响应类型选出提取函数，仅在首次遇到该类型时调用"""
+    if hasattr(response, "content"):
+        return _extract_attr_content
+    if hasattr(response, "message"):
+        return _extract_message_content
+    if isinstance(response, str):
+        return _extract_str
+    if isinstance(response, dict):
+        return _extract_from_dict
+    if hasattr(response, "generations"):
+        return _extract_from_generations
+    return str
+
+# 响应类型 -> 提取函数的缓存；响应类型只有少数几种，首次遇到时解析一次即可
+_EXTRACTORS: Dict[type, Callable[[Any], Any]] = {
+    str: _extract_str,
+    dict: _extract_from_dict,
+}
+
 def extract_content_from_response(response):
     """
     从LLM响应中提取内容，处理各种返回类型
@@ -801,6 +1100,15 @@ def extract_content_from_response(response):
     if response is None:
         logger.warning("收到空响应(None)，无法提取内容")
         return "无法从空响应中提取内容"
+    
+    # 字符串(常见于流式分块)直接返回
+    if isinstance(response, str):
+        return response
+    
+    # 快速路径：绝大多数响应是content为字符串的AIMessage
+    content = getattr(response, "content", None)
+    if isinstance(content, str):
+        return content
         
     # 检查空字典或空列表
     if isinstance(response, dict) and not response:
@@ -813,182 +1121,61 @@ def extract_content_from_response(response):
     
     # 处理各种响应类型
     try:
-        # 基本属性检查，使用安全的getattr和get方法
-        if hasattr(response, "content"):
-            return response.content
-            
-        if hasattr(response, "message"):
-            message = getattr(response, "message", None)
-            if message is not None and hasattr(message, "content"):
-                return message.content
-                
-        # 字符串直接返回
-        if isinstance(response, str):
-            return response
-            
-        # 安全处理字典
-        if isinstance(response, dict):
-            # 直接content字段
-            if "content" in response:
-                return response["content"]
-                
-            # OpenAI/OpenRouter格式
-            if "choices" in response:
-                choices = response.get("choices")
-                # 安全检查choices
-                if choices is None:
-                    logger.warning("响应中choices为None")
-                    return "API返回了无效的响应格式"
-                    
-                if not isinstance(choices, list):
-                    logger.warning(f"响应中choices不是列表: {type(choices)}")
-                    return "API返回了意外的响应格式，choices应为列表"
-                    
-                if not choices:  # 空列表
-                    logger.warning("响应中choices列表为空")
-                    return "API未返回任何生成内容"
-                
-                # 获取第一个choice
-                first_choice = choices[0]
-                if not isinstance(first_choice, dict):
-                    logger.warning(f"响应中first_choice不是字典: {type(first_choice)}")
-                    return f"API返回了意外的choice格式: {first_choice}"
-                
-                # 检查message字段
-                message = first_choice.get("message")
-                if message is None:
-                    logger.warning("响应中message为None")
-                    
-                    # 尝试直接从choice中获取文本，某些API可能直接提供text字段
-                    if "text" in first_choice:
-                        return first_choice["text"]
-                        
-                    return "API返回了无效的响应格式，缺少message字段"
-                
-                if not isinstance(message, dict):
-                    logger.warning(f"响应中message不是字典: {type(message)}")
-                    
-                    # 如果message是字符串，可能直接就是内容
-                    if isinstance(message, str):
-                        return message
-                        
-                    return f"API返回了意外的message格式: {message}"
-                
-                # 从message中获取content
-                if "content" in message:
-                    content = message["content"]
-                    if content is None:
-                        logger.warning("响应中content为None")
-                        return "API返回了空内容"
-                    return content
-                else:
-                    logger.warning("响应中message缺少content字段")
-                    # 尝试使用整个message作为内容
-                    return str(message)
-        
-        # LangChain专用格式
-        if hasattr(response, "generations"):
-            generations = getattr(response, "generations", None)
-            
-            # 检查generations
-            if generations is None:
-                logger.warning("响应的generations属性为None")
-                return "无法解析生成的回复，生成结果为空"
-            
-            # 检查是否可迭代且非空
-            if not hasattr(generations, "__iter__"):
-                logger.warning(f"响应的generations属性不可迭代: {type(generations)}")
-                return "无法解析生成的回复，generations格式无效"
-            
-            try:
-                # 安全地获取第一个generation
-                generations_list = list(generations)
-                if not generations_list:
-                    logger.warning("响应的generations列表为空")
-                    return "无法解析生成的回复，generations列表为空"
-                
-                generation = generations_list[0]
-                
-                # 尝试不同的提取路径
-                if hasattr(generation, "message") and hasattr(generation.message, "content"):
-                    return generation.message.content
-                    
-                if hasattr(generation, "text"):
-                    return generation.text
-                    
-                # 检查是否为列表
-                if isinstance(generation, list) and generation:
-                    first_gen = generation[0]
-                    if hasattr(first_gen, "message") and hasattr(first_gen.message, "content"):
-                        return first_gen.message.content
-                        
-                # 如果是字典，尝试直接获取text或content字段
-                if isinstance(generation, dict):
-                    if "text" in generation:
-                        return generation["text"]
-                    if "content" in generation:
-                        return generation["content"]
-                    if "message" in generation and isinstance(generation["message"], dict):
-                        msg = generation["message"]
-                        if "content" in msg:
-                            return msg["content"]
-                
-                # 尝试转为字符串
-                return str(generation)
-                
-            except (TypeError, IndexError) as e:
-                logger.error(f"处理generations时出错: {str(e)}")
-                return f"处理LLM响应时出错: {str(e)}"
-    
-        # 最后尝试转为字符串
-        return str(response)
+        response_type = type(response)
+        extractor = _EXTRACTORS.get(response_type)
+        if extractor is None:
+            extractor = _EXTRACTORS[response_type] = _resolve_extractor(response)
+        return extractor(response)
         
     except Exception as e:
         logger.error(f"提取响应内容时出错: {str(e)}")
         return f"无法提取内容，处理响应时出错: {str(e)}"
 
 # 详细日志记录函数
-def log_llm_request(prompt, response, model, tokens=None, time=None):
+def log_llm_request(prompt, content, model, tokens=None, time=None):
     """
     记录LLM请求的详细信息
     
     Args:
         prompt: 发送给LLM的提示词
-        response: LLM的响应内容
+        content: 已从LLM响应中提取的内容
         model: 使用的LLM模型名称
         tokens: 使用的token数量
         time: 请求耗时(秒)
     """
+    # 未开启DEBUG时跳过所有日志字符串的构建
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    
     logger.debug("----- LLM请求详情 -----")
-    logger.debug(f"模型: {model}")
+    logger.debug("模型: %s", model)
     
-    # 记录提示词
+    # 记录提示词，%.1000s在格式化时截断，无需先判断长度再切片
     if isinstance(prompt, list):
         # 如果是消息列表，记录每条消息
         for i, msg in enumerate(prompt):
             msg_role = getattr(msg, "type", "unknown")
-            msg_content = getattr(msg, "content", str(msg))
-            logger.debug(f"提示词[{i}] - {msg_role}: {msg_content[:1000]}..." if len(msg_content) > 1000 else f"提示词[{i}] - {msg_role}: {msg_content}")
-    elif isinstance(prompt, str):
-        logger.debug(f"提示词: {prompt[:1000]}..." if len(prompt) > 1000 else f"提示词: {prompt}")
+            msg_content = getattr(msg, "content", msg)
+            logger.debug("提示词[%d] - %s: %.1000s", i, msg_role, msg_content)
     else:
-        logger.debug(f"提示词: {str(prompt)[:1000]}...")
+        logger.debug("提示词: %.1000s", prompt)
     
-    # 提取并记录响应内容
-    content = extract_content_from_response(response)
-    logger.debug(f"响应内容: {content[:1000]}..." if len(content) > 1000 else f"响应内容: {content}")
+    logger.debug("响应内容: %.1000s", content)
     
     if tokens:
-        logger.debug(f"Token使用: {tokens}")
+        logger.debug("Token使用: %s", tokens)
     if time:
-        logger.debug(f"请求耗时: {time:.2f}秒")
+        logger.debug("请求耗时: %.2f秒", time)
     logger.debug("--------------------------")
-    
-    return content  # 返回提取的内容
+
+# 非流式回退时每次输出的字符数
+_STREAM_FALLBACK_CHUNK = 64
 
 class LangChainAdapter:
     """LangChain适配器类，将LLM包装为LangChain兼容的接口"""
     
+    __slots__ = ("model_name", "temperature", "max_tokens", "llm", "_openai_client")
+    
     def __init__(
         self,
         model_name: Optional[str] = None,
@@ -1006,6 +1193,8 @@ class LangChainAdapter:
         self.temperature = temperature 
         self.max_tokens = max_tokens
         self.llm = None
+        # DeepSeek流式输出使用的AsyncOpenAI客户端，首次使用时创建后复用
+        self._openai_client = None
         
         # 初始化LLM
         self._init_llm()
@@ -1067,10 +1256,23 @@ class LangChainAdapter:
         self,
         prompt: Union[str, List[BaseMessage]],
         system_message: Optional[str] = None,
-        max_tokens: Optional[int] = 1024
+        max_tokens: Optional[int] = 1024,
+        response_format: Optional[Dict[str, Any]] = None
     ) -> str:
-        """生成文本响应"""
-        start_time = time.perf_counter()
+        """生成文本响应
+        
+        Args:
+            prompt: 提示文本或消息列表
+            system_message: 系统消息
+            max_tokens: 最大生成token数
+            response_format: 结构化输出格式，例如{"type": "json_object"}；
+                仅对OpenAI兼容接口(DeepSeek/OpenRouter)生效
+            
+        Returns:
+            生成的文本
+        """
+        # 仅在实际调用LLM前开始计时，耗时只在失败日志中使用
+        start_time = None
         
         try:
             # 初始化LLM（如果需要）
@@ -1098,79 +1300,96 @@ class LangChainAdapter:
             # 记录查询信息
             logger.info(f"使用模型 {self.model_name} 生成响应")
             
+            # OpenAI兼容接口支持response_format，其他实现忽略该参数
+            invoke_kwargs: Dict[str, Any] = {"max_tokens": max_tokens}
+            if response_format and isinstance(self.llm, ChatOpenAI):
+                invoke_kwargs["response_format"] = response_format
+            
             # 调用LLM
+            start_time = time.perf_counter()
             try:
                 # 设置超时
                 response = await asyncio.wait_for(
-                    self.llm.ainvoke(
-                        messages,
-                        max_tokens=max_tokens
-                    ),
+                    self.llm.ainvoke(messages, **invoke_kwargs),
                     timeout=60  # 60秒超时
                 )
                 
                 # 处理可能为None的响应
                 if response is None:
                     logger.warning("LLM返回了空响应(None)")
-                    elapsed_time = time.perf_counter() - start_time
+                    elapsed_time = time.perf_counter() - start_time if start_time else 0.0
                     logger.error(f"LLM调用失败: 返回了None, 耗时: {elapsed_time:.2f}秒")
                     return "生成回复失败，LLM返回了空响应"
                 
                 # 记录原始响应以便调试
-                logger.debug(f"LLM原始响应: {type(response)} - {response}")
+                logger.debug("LLM原始响应: %s - %r", type(response), response)
             
-                # 提取回复内容
-                if isinstance(response, dict):
-                    if "choices" in response and response["choices"]:
-                        content = response["choices"][0].get("message", {}).get("content", "")
-                        if content:
-                            return content
-                    if "content" in response:
-                        return response["content"]
-                
-                # 提取AIMessage中的内容
-                if hasattr(response, "content"):
-                    return response.content
-                    
-                # 处理字符串回复
-                if isinstance(response, str):
-                    return response
-                
-                # 返回响应的字符串表示（如果以上提取方法都失败）
-                return str(response)
+                # 提取回复内容，每次调用只遍历一次响应结构
+                content = extract_content_from_response(response)
+                if logger.isEnabledFor(logging.DEBUG):
+                    log_llm_request(messages, content, self.model_name)
+                return content
                 
             except asyncio.TimeoutError:
-                elapsed_time = time.perf_counter() - start_time
+                elapsed_time = time.perf_counter() - start_time if start_time else 0.0
                 logger.error(f"LLM调用超时，耗时: {elapsed_time:.2f}秒")
                 return "抱歉，生成回复超时，请稍后重试或调整查询"
                 
             except Exception as e:
-                elapsed_time = time.perf_counter() - start_time
+                elapsed_time = time.perf_counter() - start_time if start_time else 0.0
                 logger.error(f"LLM调用失败: {str(e)}, 耗时: {elapsed_time:.2f}秒")
                 return f"生成回复失败: {str(e)}"
                 
         except Exception as e:
-            elapsed_time = time.perf_counter() - start_time
+            elapsed_time = time.perf_counter() - start_time if start_time else 0.0
             logger.error(f"生成文本响应失败: {str(e)}, 耗时: {elapsed_time:.2f}秒")
             return f"处理请求时出错: {str(e)}"
 
-    async def generate_stream(self, prompt: str) -> AsyncGenerator[str, None]:
+    def _get_openai_client(self):
+        """获取复用的AsyncOpenAI客户端，避免每次流式请求重建连接池和TLS会话
+        
+        底层使用模块共享的异步HTTP客户端，由aclose_shared_clients在应用关闭时统一关闭，
+        因此这里不再单独关闭
+        """
+        if self._openai_client is None:
+            from openai import AsyncOpenAI
+            
+            self._openai_client = AsyncOpenAI(
+                api_key=settings.DEEPSEEK_API_KEY,
+                base_url=settings.DEEPSEEK_API_BASE or "https://api.deepseek.com",
+                http_client=_SHARED_ASYNC_CLIENT
+            )
+        return self._openai_client
+
+    async def generate_stream(self, prompt: str, max_tokens: Optional[int] = None) -> AsyncGenerator[str, None]:
         """
         流式生成LLM响应
         
         Args:
             prompt: 提示文本
+            max_tokens: 最大生成token数，为None时使用模型默认值
             
         Yields:
             生成的文本块
         """
         logger.info(f"使用模型 {self.model_name} 流式生成响应")
         
+        stream_kwargs: Dict[str, Any] = {} if max_tokens is None else {"max_tokens": max_tokens}
         try:
+            # 优先使用异步流式接口，同步的stream会在迭代期间阻塞事件循环
+            if callable(getattr(self.llm, "astream", None)):
+                async for chunk in self.llm.astream(prompt, **stream_kwargs):
+                    content = getattr(chunk, "content", None)
+                    if isinstance(content, str):
+                        if content:
+                            yield content
+                    else:
+                        yield extract_content_from_response(chunk)
+            
             # 确保我们的LLM支持流式输出
-            if hasattr(self.llm, "stream") and callable(getattr(self.llm, "stream")):
+            elif hasattr(self.llm, "stream") and callable(getattr(self.llm, "stream")):
                 # 检查stream方法返回的是否为异步生成器
-                stream_result = self.llm.stream(prompt)
+                stream_result = self.llm.stream(prompt, **stream_kwargs)
                 
                 # 判断返回值类型
                 if hasattr(stream_result, "__aiter__"):
@@ -1197,19 +1416,14 @@ class LangChainAdapter:
                         
             elif self.model_name.startswith("deepseek"):
                 # 使用DeepSeek API的流式功能
-                from openai import AsyncOpenAI
-                
-                client = AsyncOpenAI(
-                    api_key=self.api_key,
-                    base_url=self.api_base if self.api_base else "https://api.deepseek.com"
-                )
+                client = self._get_openai_client()
                 
                 response = await client.chat.completions.create(
                     model=self.model_name,
                     messages=[{"role": "user", "content": prompt}],
                     stream=True,
                     temperature=0.7,
-                    max_tokens=1500
+                    max_tokens=max_tokens or 1500
                 )
                 
                 async for chunk in response:
@@ -1219,12 +1433,12 @@ class LangChainAdapter:
                             if delta_content:
                                 yield delta_content
             else:
-                # 回退到非流式方式，然后模拟流式输出
-                response = await self.generate(prompt)
-                # 按字符模拟流式输出
-                for i in range(0, len(response), 2):
-                    yield response[i:i+2]
-                    await asyncio.sleep(0.01)
+                # 回退到非流式方式，然后按块输出
+                response = await self.generate(prompt, **stream_kwargs)
+                # 内容已完整生成，不再人为延时，分块后让出一次事件循环即可
+                for i in range(0, len(response), _STREAM_FALLBACK_CHUNK):
+                    yield response[i:i + _STREAM_FALLBACK_CHUNK]
+                    await asyncio.sleep(0)
         except Exception as e:
             logger.error(f"流式生成出错: {str(e)}")
             # 在错误情况下，我们也要让生成器正常结束
@@ -6,10 +6,11 @@
 import os
 import json
 import asyncio
-from typing import Any, Dict, List, Optional, Union, Callable
+from typing import Any, Dict, List, Optional, Set, Union, Callable
 from datetime import datetime
 import random
 import re
+import threading
 from uuid import uuid4
 
 from app.core.logging import get_logger
@@ -23,6 +24,8 @@ logger = get_logger(__name__)
 
 # 缓存AI代理实例
 _data_query_agent = None
+# 保护代理实例的创建，避免并发首次调用时重复初始化
+_data_query_agent_lock = threading.Lock()
 
 def get_data_query_agent(force_new: bool = False):
     """
@@ -36,10 +39,40 @@ def get_data_query_agent(force_new: bool = False):
     """
     global _data_query_agent
     
-    if _data_query_agent is None or force_new:
-        _data_query_agent = DataQueryAgent()
-        
-    return _data_query_agent
+    agent = _data_query_agent
+    if agent is not None and not force_new:
+        return agent
+    
+    with _data_query_agent_lock:
+        # 双重检查：等待锁期间其他调用方可能已完成创建
+        if _data_query_agent is None or (force_new and _data_query_agent is agent):
+            _data_query_agent = DataQueryAgent()
+        return _data_query_agent
+
+# 不再等待结果的后台任务(如继续接收后续查询建议的流式响应)，保留强引用直到完成
+_background_tasks: Set["asyncio.Future"] = set()
+
+def _on_background_done(future: "asyncio.Future") -> None:
+    """后台任务完成时释放引用，并记录其异常，避免异常无人读取"""
+    _background_tasks.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"后台任务失败: {str(future.exception())}")
+
+def _detach(future: "asyncio.Future") -> None:
+    """
+    让不再等待结果的任务在后台运行完毕
+    
+    Args:
+        future: 任务或Future
+    """
+    if future.done():
+        _on_background_done(future)
+        return
+    _background_tasks.add(future)
+    future.add_done_callback(_on_background_done)
+
+# 可直接JSON序列化的标量类型，使用集合做O(1)类型判断
+_PRIMITIVES = frozenset({str, int, float, bool, type(None)})
 
 def stringify_special_objects(data):
     """
@@ -51,9 +84,25 @@ def stringify_special_objects(data):
     Returns:
         处理后的数据
     """
-    if data is None:
-        return None
+    # 绝大多数节点是标量单元格，先用一次类型查找返回
+    data_type = type(data)
+    if data_type in _PRIMITIVES:
+        return data
+    
+    # 容器在属性探测之前处理，元素为标量时不再进入递归
+    if data_type is dict:
+        return {
+            k: v if type(v) in _PRIMITIVES else stringify_special_objects(v)
+            for k, v in data.items()
+        }
         
+    if data_type is list or data_type is tuple:
+        return [
+            item if type(item) in _PRIMITIVES else stringify_special_objects(item)
+            for item in data
+        ]
+    
+    # 标量子类(如IntEnum)保持原样
     if isinstance(data, (str, int, float, bool)):
         return data
         
@@ -104,11 +153,16 @@ def stringify_special_objects(data):
 
 import logging
 import json
+import hashlib
+import time
+from collections import OrderedDict
 from typing import Any, Dict, List, Optional, Union, Tuple
 import asyncio
 from datetime import datetime
 from uuid import uuid4
 
+import orjson
+
 # 我们将直接导入这些依赖，而不是延迟导入
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
@@ -120,16 +174,66 @@ from app.services.ai.memory import ConversationMemory
 
 logger = get_logger(__name__)
 
+# 预编译的代码围栏正则，避免每次调用时重新查找/编译
+_FENCE_OPEN = re.compile(r'^```(?:json)?\s*\n?')
+_FENCE_CLOSE = re.compile(r'\n?```\s*$')
+
+# 无法识别意图时返回的默认结构；调用方只读取、不修改，直接共享同一实例
+_DEFAULT_INTENT: Dict[str, Any] = {
+    "query_topic": "未识别",
+    "query_goal": "未识别",
+    "time_range": "未指定",
+    "dimensions": ()
+}
+
+# 意图分析提示词模板
+_INTENT_PROMPT_TMPL = """分析以下数据查询的意图，确定用户想要了解的信息：
+
+查询: {query}
+
+请提供以下信息:
+1. 查询主题 (例如: 销售额, 客户行为, 库存等)
+2. 查询目标 (例如: 排名前10, 同比增长, 分布情况等)
+3. 时间范围 (例如: 过去30天, 上个月, 2023年全年等)
+4. 可能相关的数据维度 (例如: 产品类别, 地区, 客户类型等)
+
+以JSON格式返回，包含上述字段。
+"""
+
+# 意图分析结果缓存：相同查询在有效期内不再调用LLM
+_INTENT_CACHE_MAXSIZE = 512
+_INTENT_CACHE_TTL = 600  # 秒，过期后重新分析以反映数据结构的变化
+# 全角标点统一为半角，空白折叠后作为缓存键，提高命中率
+_QUERY_PUNCT_TABLE = str.maketrans("，。？！：；（）", ",.?!:;()")
+
+
+def _query_cache_key(query: str) -> str:
+    """
+    计算查询的缓存键
+    
+    Args:
+        query: 用户查询
+        
+    Returns:
+        归一化查询的blake2b摘要
+    """
+    normalized = " ".join(query.translate(_QUERY_PUNCT_TABLE).lower().split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+
 
 class DataQueryAgent:
     """数据查询Agent类，协调各组件处理自然语言查询"""
     
+    __slots__ = ("llm_adapter", "memory", "nl2sql_chain", "_intent_cache")
+    
     def __init__(self):
         """
         初始化数据查询Agent
         """
         self.llm_adapter = LangChainAdapter(temperature=0.1)
         self.memory = ConversationMemory(window_size=5)  # 保留最近5轮对话
+        # 查询缓存键 -> (过期时间, 意图分析结果)
+        self._intent_cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
         
         # 初始化NL2SQL链
         try:
@@ -157,62 +261,65 @@ class DataQueryAgent:
         Returns:
             查询意图分析结果
         """
+        cache_key = _query_cache_key(query)
+        cached = self._intent_cache.get(cache_key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self._intent_cache.move_to_end(cache_key)
+                return cached[1]
+            del self._intent_cache[cache_key]
+        
         try:
             # 构建意图分析提示词
-            prompt = f"""分析以下数据查询的意图，确定用户想要了解的信息：
-
-查询: {query}
-
-请提供以下信息:
-1. 查询主题 (例如: 销售额, 客户行为, 库存等)
-2. 查询目标 (例如: 排名前10, 同比增长, 分布情况等)
-3. 时间范围 (例如: 过去30天, 上个月, 2023年全年等)
-4. 可能相关的数据维度 (例如: 产品类别, 地区, 客户类型等)
-
-以JSON格式返回，包含上述字段。
-"""
+            prompt = _INTENT_PROMPT_TMPL.format(query=query)
             
-            # 调用LLM分析意图
-            response = await self.llm_adapter.generate(prompt=prompt, max_tokens=500)
+            # 调用LLM分析意图，要求以JSON对象输出，省去围栏/说明文字的剥离
+            response = await self.llm_adapter.generate(
+                prompt=prompt,
+                max_tokens=500,
+                response_format={"type": "json_object"}
+            )
             
             # 尝试解析返回的JSON
             intent_str = extract_content_from_response(response)
             
             # 尝试提取JSON
-            import re
-            import json
-            json_match = re.search(r'\{.*\}', intent_str, re.DOTALL)
-            if json_match:
-                try:
-                    intent_json = json.loads(json_match.group(0))
-                except json.JSONDecodeError:
-                    logger.warning(f"无法解析JSON: {json_match.group(0)}")
-                    intent_json = {
-                        "query_topic": "未识别",
-                        "query_goal": "未识别",
-                        "time_range": "未指定",
-                        "dimensions": []
-                    }
-            else:
-                # 如果没有找到JSON格式，则创建基本结构
-                intent_json = {
-                    "query_topic": "未识别",
-                    "query_goal": "未识别",
-                    "time_range": "未指定",
-                    "dimensions": []
-                }
+            stripped = intent_str.strip()
+            if stripped.startswith("```"):
+                stripped = _FENCE_CLOSE.sub("", _FENCE_OPEN.sub("", stripped))
+
+            try:
+                # LLM通常直接返回JSON，优先直接解析
+                intent_json = orjson.loads(stripped)
+                json_parsed = True
+            except orjson.JSONDecodeError:
+                json_parsed = False
+                # 解析失败时才截取首个"{"与最后一个"}"之间的内容再解析
+                lo, hi = stripped.find("{"), stripped.rfind("}")
+                if 0 <= lo < hi:
+                    json_text = stripped[lo:hi + 1]
+                    try:
+                        intent_json = orjson.loads(json_text)
+                        json_parsed = True
+                    except orjson.JSONDecodeError:
+                        logger.warning(f"无法解析JSON: {json_text}")
+                        intent_json = _DEFAULT_INTENT
+                else:
+                    # 如果没有找到JSON格式，则创建基本结构
+                    intent_json = _DEFAULT_INTENT
+            
+            # 仅缓存成功解析的结果，默认结构下次仍重新分析
+            if json_parsed:
+                self._intent_cache[cache_key] = (time.monotonic() + _INTENT_CACHE_TTL, intent_json)
+                if len(self._intent_cache) > _INTENT_CACHE_MAXSIZE:
+                    self._intent_cache.popitem(last=False)
             
             return intent_json
             
         except Exception as e:
             logger.error(f"分析查询意图失败: {str(e)}")
             # 返回默认结构
-            return {
-                "query_topic": "未识别",
-                "query_goal": "未识别",
-                "time_range": "未指定",
-                "dimensions": []
-            }
+            return _DEFAULT_INTENT
     
     async def query(self, query: str, need_visualization: bool = True, include_suggestions: bool = True) -> Dict:
         """
@@ -227,37 +334,46 @@ class DataQueryAgent:
             查询结果
         """
         try:
-            # 1. 分析查询意图
-            intent = await self.analyze_query_intent(query)
-            logger.debug(f"查询意图分析: {json.dumps(intent, ensure_ascii=False)}")
-            
-            # 2. 生成SQL
-            sql = await self.nl2sql_chain.generate_sql(query)
+            # 1-2. 意图分析与SQL生成都只依赖原始查询，并发执行；
+            # SQL生成以流式方式返回，SQL就绪后即可执行，后续查询建议在后台继续生成
+            intent, (sql, suggestions_future) = await asyncio.gather(
+                self.analyze_query_intent(query),
+                self.nl2sql_chain.generate_sql_streaming(query)
+            )
+            debug_enabled = logger.isEnabledFor(logging.DEBUG)
+            if debug_enabled:
+                logger.debug("查询意图分析: %s", orjson.dumps(intent, default=str).decode())
             logger.info(f"生成的SQL: {sql}")
             
-            # 3. 执行SQL查询
-            results, row_count = await self.nl2sql_chain.execute_query(sql)
-            
-            # 记录结果
-            if results:
-                logger.info(f"查询成功, 返回{row_count}行结果")
-                if row_count > 0:
-                    logger.debug(f"结果样例: {json.dumps(results[0], ensure_ascii=False)}")
-            else:
-                logger.warning("查询未返回结果")
-                
-            # 4. 生成结果解释
-            explanation = await self.nl2sql_chain.explain_results(query, sql, results)
-            
-            # 5. 生成可视化配置(如需要)
-            visualization_config = None
-            if need_visualization and results:
-                visualization_config = await self.nl2sql_chain.generate_visualization_config(query, sql, results)
+            # 后台接收建议的任务必须有归属：出错或被取消时取消它，不需要建议时让它在后台完成(以写入SQL缓存)
+            suggestions_owned = False
+            try:
+                # 3. 执行SQL查询
+                results, row_count = await self.nl2sql_chain.execute_query(sql)
                 
-            # 6. 生成后续查询建议(如需要)
-            query_suggestions = []
-            if include_suggestions:
-                query_suggestions = await self.nl2sql_chain.suggest_queries(query, sql, explanation[:200])
+                # 记录结果
+                if results:
+                    logger.info(f"查询成功, 返回{row_count}行结果")
+                    if row_count > 0 and debug_enabled:
+                        logger.debug("结果样例: %s", orjson.dumps(results[0], default=str).decode())
+                else:
+                    logger.warning("查询未返回结果")
+                    
+                # 4-5. 结果解释与可视化配置(如需要)互不依赖，并发生成
+                explanation, visualization_config = await self.nl2sql_chain.generate_post_query_artifacts(
+                    query, sql, results, need_visualization=need_visualization
+                )
+                    
+                # 6. 后续查询建议(如需要)
+                suggestions_owned = True
+                if include_suggestions:
+                    query_suggestions = await suggestions_future
+                else:
+                    query_suggestions = []
+                    _detach(suggestions_future)
+            finally:
+                if not suggestions_owned and not suggestions_future.done():
+                    suggestions_future.cancel()
                 
             # 7. 更新会话记忆
             self.memory.add_interaction(
@@ -271,7 +387,7 @@ class DataQueryAgent:
             
             # 8. 构建并返回结果
             query_result = {
-                "id": str(uuid4()),
+                "id": uuid4().hex,
                 "timestamp": datetime.now().isoformat(),
                 "query": query,
                 "intent": intent,
@@ -289,7 +405,7 @@ class DataQueryAgent:
             logger.error(f"查询执行失败: {str(e)}", exc_info=True)
             # 返回错误信息
             error_result = {
-                "id": str(uuid4()),
+                "id": uuid4().hex,
                 "timestamp": datetime.now().isoformat(),
                 "query": query,
                 "error": str(e),
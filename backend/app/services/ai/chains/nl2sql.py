@@ -5,25 +5,39 @@
 
 import logging
 import json
+import orjson
 import re
-from typing import Any, Dict, List, Optional, Union, cast, Tuple, AsyncGenerator
+import string
+from typing import Any, Dict, List, Optional, Set, Union, cast, Tuple, AsyncGenerator
 import sqlalchemy
-from sqlalchemy import inspect, text
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import Integer, bindparam, inspect, text
 import time
 from datetime import datetime, timedelta
 import random
 import asyncio
-
-# 延迟导入以下依赖
-# from langchain_core.prompts import PromptTemplate
-# from langchain_core.output_parsers import StrOutputParser
-# from langchain_community.utilities.sql_database import SQLDatabase
-# from langchain.chains.sql_database.prompt import PROMPT, _mysql_prompt, _postgres_prompt, _sqlite_prompt
-# from langchain.chains import create_sql_query_chain
-# from langchain_core.runnables import RunnablePassthrough
+import threading
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# SQLDatabase在不同langchain版本中位于不同模块，导入时解析一次
+try:
+    from langchain_community.utilities import SQLDatabase as _SQLDatabase
+except ImportError:
+    try:
+        from langchain.utilities import SQLDatabase as _SQLDatabase
+    except ImportError:
+        try:
+            from langchain.utilities.sql_database import SQLDatabase as _SQLDatabase
+        except ImportError:
+            _SQLDatabase = None
 
 from app.db.session import SyncSessionLocal, sync_engine
 from app.services.ai.adapters.langchain_llm import get_langchain_chat_model, LangChainAdapter, extract_content_from_response, ChatOpenRouter
+from app.services.ai.embedding import get_embedding_service
+from app.services.ai.semantic_cache import SemanticCache
 from app.utils.sql_query import SQLQueryTool, get_sql_query_tool
 from app.core.logging import get_logger
 from app.core.config import settings
@@ -31,112 +45,36 @@ from app.core.config import settings
 logger = get_logger(__name__)
 
 # 电商数据库表结构描述 - 模拟数据
+# 紧凑的DDL风格，每表一行：PK=主键，FK=外键，[...]为枚举取值
 DEFAULT_DB_SCHEMA = """
-电商数据库结构:
-
-1. users (用户表)
-   - user_id: INTEGER PRIMARY KEY (用户ID)
-   - username: VARCHAR(50) (用户名)
-   - email: VARCHAR(100) (电子邮件)
-   - phone: VARCHAR(20) (手机号)
-   - registration_date: DATETIME (注册日期)
-   - last_login: DATETIME (最后登录时间)
-   - status: VARCHAR(20) (账户状态: active, inactive, suspended)
-
-2. products (产品表)
-   - product_id: INTEGER PRIMARY KEY (产品ID)
-   - name: VARCHAR(200) (产品名称)
-   - description: TEXT (产品描述)
-   - category_id: INTEGER FOREIGN KEY (类别ID, 关联categories表)
-   - price: DECIMAL(10,2) (价格)
-   - cost: DECIMAL(10,2) (成本)
-   - inventory: INTEGER (库存数量)
-   - created_at: DATETIME (创建时间)
-   - updated_at: DATETIME (更新时间)
-   - status: VARCHAR(20) (状态: active, discontinued)
-
-3. categories (产品分类表)
-   - category_id: INTEGER PRIMARY KEY (类别ID)
-   - name: VARCHAR(100) (类别名称)
-   - parent_id: INTEGER (父类别ID, 自关联)
-   - description: TEXT (类别描述)
-
-4. orders (订单表)
-   - order_id: INTEGER PRIMARY KEY (订单ID)
-   - user_id: INTEGER FOREIGN KEY (用户ID, 关联users表)
-   - order_date: DATETIME (订单日期)
-   - total_amount: DECIMAL(12,2) (订单总金额)
-   - status: VARCHAR(20) (状态: pending, paid, shipped, delivered, canceled)
-   - shipping_address: TEXT (配送地址)
-   - payment_method: VARCHAR(50) (支付方式)
-
-5. order_items (订单项表)
-   - item_id: INTEGER PRIMARY KEY (项目ID)
-   - order_id: INTEGER FOREIGN KEY (订单ID, 关联orders表)
-   - product_id: INTEGER FOREIGN KEY (产品ID, 关联products表)
-   - quantity: INTEGER (数量)
-   - unit_price: DECIMAL(10,2) (单价)
-   - discount: DECIMAL(10,2) (折扣)
-   - subtotal: DECIMAL(10,2) (小计)
-
-6. reviews (评价表)
-   - review_id: INTEGER PRIMARY KEY (评价ID)
-   - product_id: INTEGER FOREIGN KEY (产品ID, 关联products表)
-   - user_id: INTEGER FOREIGN KEY (用户ID, 关联users表)
-   - rating: INTEGER (评分, 1-5)
-   - comment: TEXT (评论内容)
-   - review_date: DATETIME (评价日期)
-   - helpful_votes: INTEGER (有用票数)
-
-7. inventory_history (库存历史表)
-   - history_id: INTEGER PRIMARY KEY (历史记录ID)
-   - product_id: INTEGER FOREIGN KEY (产品ID, 关联products表)
-   - change_amount: INTEGER (变动数量, 正为入库, 负为出库)
-   - change_date: DATETIME (变动日期)
-   - reason: VARCHAR(100) (变动原因: purchase, sale, return, adjustment)
-   - operator: VARCHAR(50) (操作员)
-
-8. promotions (促销活动表)
-   - promotion_id: INTEGER PRIMARY KEY (促销ID)
-   - name: VARCHAR(100) (活动名称)
-   - description: TEXT (活动描述)
-   - discount_type: VARCHAR(20) (折扣类型: percentage, fixed_amount)
-   - discount_value: DECIMAL(10,2) (折扣值)
-   - start_date: DATETIME (开始日期)
-   - end_date: DATETIME (结束日期)
-   - active: BOOLEAN (是否激活)
-
-9. returns (退货表)
-   - return_id: INTEGER PRIMARY KEY (退货ID)
-   - order_id: INTEGER FOREIGN KEY (订单ID, 关联orders表)
-   - product_id: INTEGER FOREIGN KEY (产品ID, 关联products表)
-   - return_date: DATETIME (退货日期)
-   - quantity: INTEGER (数量)
-   - reason: TEXT (退货原因)
-   - status: VARCHAR(20) (状态: pending, approved, rejected, refunded)
-   - refund_amount: DECIMAL(10,2) (退款金额)
-
-10. suppliers (供应商表)
-    - supplier_id: INTEGER PRIMARY KEY (供应商ID)
-    - name: VARCHAR(100) (供应商名称)
-    - contact_person: VARCHAR(50) (联系人)
-    - email: VARCHAR(100) (电子邮件)
-    - phone: VARCHAR(20) (电话)
-    - address: TEXT (地址)
-    - status: VARCHAR(20) (状态: active, inactive)
-
-常见关联关系:
-- 订单(orders)通过user_id关联用户(users)
-- 订单项(order_items)通过order_id关联订单(orders)
-- 订单项(order_items)通过product_id关联产品(products)
-- 产品(products)通过category_id关联类别(categories)
-- 评价(reviews)通过product_id关联产品(products)和通过user_id关联用户(users)
-- 退货(returns)通过order_id关联订单(orders)和通过product_id关联产品(products)
-- 库存历史(inventory_history)通过product_id关联产品(products)
+电商数据库结构(表名(列 类型)):
+users(user_id INT PK, username VARCHAR(50), email VARCHAR(100), phone VARCHAR(20), registration_date DATETIME, last_login DATETIME, status VARCHAR(20)[active,inactive,suspended])
+products(product_id INT PK, name VARCHAR(200), description TEXT, category_id INT FK, price DECIMAL(10,2), cost DECIMAL(10,2), inventory INT, created_at DATETIME, updated_at DATETIME, status VARCHAR(20)[active,discontinued])
+categories(category_id INT PK, name VARCHAR(100), parent_id INT, description TEXT)
+orders(order_id INT PK, user_id INT FK, order_date DATETIME, total_amount DECIMAL(12,2), status VARCHAR(20)[pending,paid,shipped,delivered,canceled], shipping_address TEXT, payment_method VARCHAR(50))
+order_items(item_id INT PK, order_id INT FK, product_id INT FK, quantity INT, unit_price DECIMAL(10,2), discount DECIMAL(10,2), subtotal DECIMAL(10,2))
+reviews(review_id INT PK, product_id INT FK, user_id INT FK, rating INT[1-5], comment TEXT, review_date DATETIME, helpful_votes INT)
+inventory_history(history_id INT PK, product_id INT FK, change_amount INT[+入库,-出库], change_date DATETIME, reason VARCHAR(100)[purchase,sale,return,adjustment], operator VARCHAR(50))
+promotions(promotion_id INT PK, name VARCHAR(100), description TEXT, discount_type VARCHAR(20)[percentage,fixed_amount], discount_value DECIMAL(10,2), start_date DATETIME, end_date DATETIME, active BOOLEAN)
+returns(return_id INT PK, order_id INT FK, product_id INT FK, return_date DATETIME, quantity INT, reason TEXT, status VARCHAR(20)[pending,approved,rejected,refunded], refund_amount DECIMAL(10,2))
+suppliers(supplier_id INT PK, name VARCHAR(100), contact_person VARCHAR(50), email VARCHAR(100), phone VARCHAR(20), address TEXT, status VARCHAR(20)[active,inactive])
+外键:
+orders.user_id -> users.user_id
+order_items.order_id -> orders.order_id
+order_items.product_id -> products.product_id
+products.category_id -> categories.category_id
+categories.parent_id -> categories.category_id
+reviews.product_id -> products.product_id
+reviews.user_id -> users.user_id
+returns.order_id -> orders.order_id
+returns.product_id -> products.product_id
+inventory_history.product_id -> products.product_id
 """
 
 # 生成基本的SQL查询的提示模板
-SQL_GENERATION_PROMPT = """
+# 静态内容(说明、表结构、示例、输出格式)全部位于前缀，用户查询追加在末尾，
+# 使同一表结构下的请求共享完全相同的前缀，便于模型服务端的前缀缓存命中
+SQL_GENERATION_PREFIX = """
 你是一位电商数据分析专家，负责将自然语言查询转换为SQL查询并提供后续查询建议。
 
 ## 任务说明
@@ -183,10 +121,7 @@ LIMIT 5;
 1. 这些热销产品的客户评价如何？
 2. 销量最高的产品在不同季节的销售趋势如何？
 3. 这些产品的利润率与其他产品相比如何？
-
-## 当前查询
-{query}
-
+{examples}
 ## 输出格式
 请严格按照以下格式输出：
 
@@ -204,6 +139,83 @@ SELECT ...
 ```
 """
 
+SQL_GENERATION_SUFFIX = """
+## 当前查询
+{query}
+"""
+
+# 提示词中固定包含的NL->SQL示例，覆盖常见的查询类型
+SQL_EXAMPLES: Tuple[Tuple[str, str], ...] = (
+    (
+        "最近30天每天的订单数和销售额是多少？",
+        "SELECT DATE(order_date) AS order_day, COUNT(*) AS order_count, SUM(total_amount) AS sales_amount\n"
+        "FROM orders\n"
+        "WHERE order_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY) AND status <> 'canceled'\n"
+        "GROUP BY DATE(order_date)\n"
+        "ORDER BY order_day\n"
+        "LIMIT 100;"
+    ),
+    (
+        "各类别的销售额排名如何？",
+        "SELECT c.name AS category_name, SUM(oi.subtotal) AS sales_amount\n"
+        "FROM order_items oi\n"
+        "JOIN products p ON oi.product_id = p.product_id\n"
+        "JOIN categories c ON p.category_id = c.category_id\n"
+        "GROUP BY c.category_id, c.name\n"
+        "ORDER BY sales_amount DESC\n"
+        "LIMIT 100;"
+    ),
+    (
+        "消费金额最高的10位用户是谁？",
+        "SELECT u.user_id, u.username, SUM(o.total_amount) AS total_spent, COUNT(*) AS order_count\n"
+        "FROM orders o\n"
+        "JOIN users u ON o.user_id = u.user_id\n"
+        "WHERE o.status <> 'canceled'\n"
+        "GROUP BY u.user_id, u.username\n"
+        "ORDER BY total_spent DESC\n"
+        "LIMIT 10;"
+    ),
+    (
+        "评分低于3分的产品有哪些？",
+        "SELECT p.product_id, p.name AS product_name, AVG(r.rating) AS avg_rating, COUNT(*) AS review_count\n"
+        "FROM reviews r\n"
+        "JOIN products p ON r.product_id = p.product_id\n"
+        "GROUP BY p.product_id, p.name\n"
+        "HAVING AVG(r.rating) < 3\n"
+        "ORDER BY avg_rating\n"
+        "LIMIT 100;"
+    ),
+    (
+        "退货率最高的产品是哪些？",
+        "SELECT p.product_id, p.name AS product_name,\n"
+        "       SUM(rt.quantity) / NULLIF(SUM(oi.quantity), 0) AS return_rate\n"
+        "FROM products p\n"
+        "JOIN order_items oi ON oi.product_id = p.product_id\n"
+        "LEFT JOIN returns rt ON rt.order_id = oi.order_id AND rt.product_id = oi.product_id\n"
+        "GROUP BY p.product_id, p.name\n"
+        "ORDER BY return_rate DESC\n"
+        "LIMIT 10;"
+    ),
+)
+
+# 上一次响应无法解析时追加的更严格的输出要求
+SQL_STRICT_SUFFIX = """
+注意：只输出上述格式的```sql代码块，不要输出任何解释或其他内容。
+"""
+
+# 完整的SQL生成提示模板
+SQL_GENERATION_PROMPT = SQL_GENERATION_PREFIX + SQL_GENERATION_SUFFIX
+
+# 判断两个查询是否等价的提示模板，用于语义缓存的灰区校验
+SAME_QUERY_PROMPT = """判断下面两个电商数据查询问题是否需要完全相同的SQL才能回答。只回答"是"或"否"。
+
+问题A: {query_a}
+问题B: {query_b}
+"""
+
+# 温度高于该值时LLM输出不稳定，不写入SQL结果缓存
+_SQL_CACHE_MAX_TEMPERATURE = 0.2
+
 # 解释SQL查询结果的提示模板
 SQL_EXPLANATION_PROMPT = """
 你是一位电商数据分析专家，负责解释SQL查询结果并提供业务洞察。请分析以下信息：
@@ -337,6 +349,635 @@ SQL查询: {sql}
 每个建议应简洁明了，直接以问句形式呈现，避免重复，并确保能通过SQL实现。
 """
 
+class _PromptTemplate:
+    """预先切分的提示词模板
+    
+    导入时将模板解析为(字面文本, 字段名)片段，渲染时直接按顺序拼接，
+    不再在每次调用时重新扫描模板中的占位符。
+    """
+    
+    __slots__ = ("_segments",)
+    
+    def __init__(self, template: str):
+        """
+        解析模板
+        
+        Args:
+            template: str.format风格的模板，只支持不带格式说明的{name}占位符
+        """
+        self._segments: Tuple[Tuple[str, Optional[str]], ...] = tuple(
+            (literal, field) for literal, field, _, _ in string.Formatter().parse(template)
+        )
+    
+    def render(self, **values: Any) -> str:
+        """
+        渲染模板
+        
+        Args:
+            **values: 各占位符的值
+            
+        Returns:
+            渲染后的文本
+        """
+        parts = []
+        for literal, field in self._segments:
+            parts.append(literal)
+            if field is not None:
+                parts.append(str(values[field]))
+        return "".join(parts)
+
+
+_SQL_GENERATION_PREFIX_TMPL = _PromptTemplate(SQL_GENERATION_PREFIX)
+_SQL_GENERATION_SUFFIX_TMPL = _PromptTemplate(SQL_GENERATION_SUFFIX)
+_SAME_QUERY_TMPL = _PromptTemplate(SAME_QUERY_PROMPT)
+_SQL_EXPLANATION_TMPL = _PromptTemplate(SQL_EXPLANATION_PROMPT)
+_VISUALIZATION_TMPL = _PromptTemplate(VISUALIZATION_PROMPT)
+
+# 上游调用失败后的重试退避：指数增长并加入随机抖动(秒)
+_RETRY_BASE_DELAY = 0.1
+_RETRY_MAX_DELAY = 8.0
+
+# 聚合值列的列名前缀和完整列名，用于生成默认解释
+_AGGREGATE_COLUMN_PREFIXES = ('sum_', 'avg_', 'count_', 'max_', 'min_')
+_AGGREGATE_COLUMN_NAMES = frozenset(('total', 'average', 'count', 'minimum', 'maximum', 'monthly_sales'))
+
+# 提示词中示例数据的总大小上限(字节)和单个字符串字段的最大长度
+_SAMPLE_MAX_BYTES = 2048
+_SAMPLE_MAX_CELL_CHARS = 200
+
+# 查询解释和可视化配置缓存的有效期(秒)，数据变化后最多在此时间内返回旧的解释
+_POST_QUERY_CACHE_TTL = 600
+
+# LLM适配器出错时返回的提示文本前缀，视为上游调用失败
+_LLM_ERROR_PREFIXES = ("抱歉，", "生成回复失败", "处理请求时出错")
+# 其中重试也无法恢复的错误(如LLM服务初始化失败)
+_LLM_FATAL_PREFIXES = ("抱歉，LLM服务初始化失败",)
+# 流式生成出错时适配器输出的文本块前缀
+_LLM_STREAM_ERROR_PREFIX = "[生成错误"
+# 单次LLM调用的默认超时(秒)
+_DEFAULT_LLM_TIMEOUT = 30
+
+# 熔断：最近_CIRCUIT_WINDOW次LLM调用中失败超过一半时，_CIRCUIT_OPEN_SECONDS秒内直接使用回退方法
+_CIRCUIT_WINDOW = 32
+_CIRCUIT_MIN_CALLS = 8
+_CIRCUIT_OPEN_SECONDS = 10.0
+
+# 流式生成SQL时，出现该标记说明主要SQL和备用SQL已输出完毕
+_SUGGESTIONS_MARKER = "后续查询建议"
+_SUGGESTIONS_MARKER_LEN = len(_SUGGESTIONS_MARKER)
+
+# LLM未给出足够建议或生成失败时使用的默认建议，及其预先转换的小写形式
+_DEFAULT_SUGGESTIONS = (
+    "过去30天销量最高的产品是什么?",
+    "哪些客户在过去一年中贡献了最多的收入?",
+    "各产品类别的平均利润率是多少?",
+    "退货率最高的产品有哪些共同特征?",
+    "销售趋势如何随季节变化?",
+)
+_DEFAULT_SUGGESTIONS_LOWER = tuple(s.lower() for s in _DEFAULT_SUGGESTIONS)
+
+# 流式解释输出时合并相邻token的目标长度(字符)
+_STREAM_CHUNK_CHARS = 64
+# 模拟流式输出时按句末标点和换行切分
+_SENTENCE_END_PAT = re.compile(r'(?<=[。！？.!?\n])')
+
+# SQL代码块围栏
+_SQL_FENCE_PAT = re.compile(r'```sql|```')
+
+# 默认的危险SQL关键字
+_DEFAULT_DANGEROUS_KEYWORDS = ("INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE", "TRUNCATE")
+
+
+def _is_fatal_llm_error(error: BaseException) -> bool:
+    """
+    判断LLM调用错误是否不可重试
+    
+    超时、限流和5xx错误可能在重试后恢复；参数错误和其他4xx错误(鉴权失败、请求无效等)重试也不会成功
+    
+    Args:
+        error: 调用抛出的异常
+        
+    Returns:
+        不可重试时返回True
+    """
+    if isinstance(error, asyncio.TimeoutError):
+        return False
+    if isinstance(error, (ValueError, TypeError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+
+def _find_dangerous_keyword(sql: str, keywords: frozenset) -> Optional[str]:
+    """
+    单次扫描SQL，找出作为独立标识符出现的危险关键字
+    
+    跳过字符串、带引号的标识符和注释；标识符按完整单词比较，
+    因此create_time这类包含关键字的列名不会误判。
+    MySQL会执行/*! ... */中的内容，/*+ ... */为优化器提示，二者的内容按SQL继续扫描。
+    
+    Args:
+        sql: SQL语句
+        keywords: 大写的危险关键字集合
+        
+    Returns:
+        第一个危险关键字，不存在时返回None
+    """
+    n = len(sql)
+    i = 0
+    ident_start = -1
+    while i < n:
+        c = sql[i]
+        if c.isalnum() or c == '_':
+            if ident_start < 0:
+                ident_start = i
+            i += 1
+            continue
+        
+        if ident_start >= 0:
+            token = sql[ident_start:i].upper()
+            if token in keywords:
+                return token
+            ident_start = -1
+        
+        if c in ("'", '"', '`'):
+            # 跳过字符串和带引号的标识符，支持反斜杠转义
+            i += 1
+            while i < n and sql[i] != c:
+                i += 2 if sql[i] == '\\' else 1
+        elif c == '-' and sql.startswith('--', i) or c == '#':
+            # 跳过行注释
+            newline = sql.find('\n', i)
+            i = n if newline == -1 else newline
+        elif c == '/' and sql.startswith(('/*!', '/*+'), i):
+            # 可执行注释和优化器提示只跳过开头标记(及/*!后的版本号)，内容照常扫描
+            i += 3
+            while i < n and sql[i].isdigit():
+                i += 1
+            continue
+        elif c == '/' and sql.startswith('/*', i):
+            # 跳过块注释
+            end = sql.find('*/', i + 2)
+            i = n if end == -1 else end + 1
+        i += 1
+    
+    if ident_start >= 0:
+        token = sql[ident_start:].upper()
+        if token in keywords:
+            return token
+    return None
+
+
+# 提示词中的示例使用MySQL语法，LLM生成的SQL按MySQL方言解析
+_LLM_SQL_DIALECT = "mysql"
+# SQLAlchemy方言名 -> sqlglot方言名
+_SQLGLOT_DIALECTS = {"mysql": "mysql", "sqlite": "sqlite", "postgresql": "postgres"}
+
+# SQL校验用的SELECT关键字匹配
+_SELECT_RE = re.compile(r'\bselect\b', re.IGNORECASE)
+
+# 表名缓存的有效期(秒)
+_TABLE_NAMES_TTL = 300
+
+# 无需调用LLM即可直接回答的固定句式：
+# (匹配整条查询的模式, SQL模板, 从匹配结果提取整数参数的函数, 依赖的表, 后续查询建议)
+# SQL模板只使用MySQL语法，参数通过bindparam按整数类型渲染，不直接拼接用户输入
+_TEMPLATE_TAIL = r'(?:是(?:什么|哪些)|有哪些)?'
+_TEMPLATE_TRAILING_CHARS = "?？。.!！ "
+_SQL_TEMPLATES = (
+    (
+        re.compile(r'销量最高的\s*(\d{1,3})\s*(?:个|款|种)?(?:产品|商品)' + _TEMPLATE_TAIL),
+        "SELECT p.product_id, p.name AS product_name, SUM(oi.quantity) AS total_sold\n"
+        "FROM order_items oi\n"
+        "JOIN products p ON oi.product_id = p.product_id\n"
+        "GROUP BY p.product_id, p.name\n"
+        "ORDER BY total_sold DESC\n"
+        "LIMIT :n",
+        lambda m: {"n": min(int(m.group(1)), 100)},
+        frozenset(("order_items", "products")),
+        ("这些热销产品的客户评价如何？", "这些产品最近30天的销售趋势如何？", "这些产品的利润率与其他产品相比如何？"),
+    ),
+    (
+        re.compile(r'评分最高的\s*(\d{1,3})\s*(?:个|款|种)?(?:产品|商品)' + _TEMPLATE_TAIL),
+        "SELECT p.product_id, p.name AS product_name, AVG(r.rating) AS avg_rating, COUNT(*) AS review_count\n"
+        "FROM reviews r\n"
+        "JOIN products p ON r.product_id = p.product_id\n"
+        "GROUP BY p.product_id, p.name\n"
+        "ORDER BY avg_rating DESC, review_count DESC\n"
+        "LIMIT :n",
+        lambda m: {"n": min(int(m.group(1)), 100)},
+        frozenset(("reviews", "products")),
+        ("这些高评分产品的销量如何？", "评分最低的产品有哪些？", "各类别产品的平均评分是多少？"),
+    ),
+    (
+        re.compile(r'最近\s*(\d{1,4})\s*天(?:内)?的?订单' + _TEMPLATE_TAIL),
+        "SELECT order_id, user_id, order_date, total_amount, status\n"
+        "FROM orders\n"
+        "WHERE order_date >= DATE_SUB(CURDATE(), INTERVAL :days DAY)\n"
+        "ORDER BY order_date DESC\n"
+        "LIMIT 100",
+        lambda m: {"days": int(m.group(1))},
+        frozenset(("orders",)),
+        ("这段时间每天的销售额趋势如何？", "这段时间各订单状态的占比是多少？", "这段时间下单最多的用户是谁？"),
+    ),
+    (
+        re.compile(r'各(?:个)?(?:类别|品类|分类)的?销售额' + _TEMPLATE_TAIL),
+        "SELECT c.category_id, c.name AS category_name, SUM(oi.subtotal) AS sales_amount\n"
+        "FROM order_items oi\n"
+        "JOIN products p ON oi.product_id = p.product_id\n"
+        "JOIN categories c ON p.category_id = c.category_id\n"
+        "GROUP BY c.category_id, c.name\n"
+        "ORDER BY sales_amount DESC\n"
+        "LIMIT 100",
+        lambda m: {},
+        frozenset(("order_items", "products", "categories")),
+        ("销售额最高的类别中哪些产品卖得最好？", "各类别的销售额在过去12个月的趋势如何？", "各类别的退货率是多少？"),
+    ),
+)
+
+# 无需转换即可JSON序列化的字段值类型
+_JSON_NATIVE_TYPES = frozenset((str, int, float, bool, list, dict, type(None)))
+
+# 并发获取表结构的最大线程数
+_SCHEMA_FETCH_MAX_WORKERS = 16
+
+# LLM响应中的段落：主要SQL、备用SQL、后续查询建议
+_SECTION_NONE, _SECTION_MAIN, _SECTION_FALLBACK, _SECTION_SUGGESTIONS = range(4)
+_SECTION_MARKERS = (
+    ("主要SQL", _SECTION_MAIN),
+    ("备用SQL", _SECTION_FALLBACK),
+    (_SUGGESTIONS_MARKER, _SECTION_SUGGESTIONS),
+)
+
+# 新格式响应中的段落标记行
+_MAIN_MARKER = "-- 主要SQL"
+_FALLBACK_MARKER = "-- 备用SQL"
+_SUGGESTIONS_LINE_MARKER = "-- " + _SUGGESTIONS_MARKER
+
+# 建议行序号后的分隔符，如"1." "2)" "3、"
+_SUGGESTION_NUM_DELIMITERS = ".)、"
+# 建议须为问句
+_QUESTION_SUFFIXES = ("?", "？")
+# 段落之外的编号问句，作为建议的兜底来源
+_LOOSE_SUGGESTION_RE = re.compile(r'^\s*\d+[.)、]\s*(.+?[?？])')
+
+
+def _strip_suggestion_number(line: str) -> str:
+    """
+    去除建议行开头的序号及其后的分隔符和空白
+    
+    Args:
+        line: 去除首尾空白后的建议行
+        
+    Returns:
+        去除序号后的文本，没有序号时原样返回
+    """
+    i = 0
+    n = len(line)
+    while i < n and line[i].isdecimal():
+        i += 1
+    if not i:
+        return line
+    if i < n and line[i] in _SUGGESTION_NUM_DELIMITERS:
+        i += 1
+    return line[i:].lstrip()
+
+
+def _find_json_object(text: str, start: int) -> int:
+    """
+    从start处的左花括号开始，跳过字符串字面量匹配对应的右花括号
+    
+    Args:
+        text: 文本
+        start: 左花括号的位置
+        
+    Returns:
+        对应右花括号之后的位置，括号不完整时返回-1
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+
+def _is_numeric_value(value: Any) -> bool:
+    """
+    判断字段值是否为数值，数值字符串(如Decimal转换后的"12.50")也视为数值
+    
+    Args:
+        value: 字段值
+        
+    Returns:
+        是否为数值
+    """
+    if isinstance(value, (int, float)):
+        return True
+    return isinstance(value, str) and value.replace('.', '', 1).isdigit()
+
+
+def _is_aggregate_column(name: str) -> bool:
+    """
+    根据列名判断是否为聚合值列
+    
+    Args:
+        name: 列名
+        
+    Returns:
+        是否为聚合值列
+    """
+    lowered = name.lower()
+    return lowered.startswith(_AGGREGATE_COLUMN_PREFIXES) or lowered in _AGGREGATE_COLUMN_NAMES
+
+
+def _match_section(line: str) -> Optional[int]:
+    """
+    判断一行是否为段落标记
+    
+    支持新格式"-- 主要SQL"和旧格式"主要SQL："。
+    
+    Args:
+        line: 去除首尾空白后的行
+        
+    Returns:
+        段落类型，不是段落标记时返回None
+    """
+    if line.startswith("--"):
+        title = line.lstrip("-").lstrip()
+        for name, section in _SECTION_MARKERS:
+            if title.startswith(name):
+                return section
+        return None
+    
+    for name, section in _SECTION_MARKERS:
+        if line.startswith(name) and line[len(name):len(name) + 1] in ("：", ":"):
+            return section
+    return None
+
+
+def _format_examples(examples: List[Tuple[str, str]]) -> str:
+    """
+    将NL->SQL示例渲染为提示词中的示例区块
+    
+    Args:
+        examples: (自然语言查询, SQL)列表
+        
+    Returns:
+        示例区块文本
+    """
+    parts = []
+    for query, sql in examples:
+        parts.append(f"\n查询: {query}\n\n-- 主要SQL\n{sql}\n")
+    return "".join(parts)
+
+
+# 提示词前缀中的示例区块只包含人工整理的固定示例：
+# 提示词前缀由所有用户共享，未经审核的用户查询不能进入其中
+_EXAMPLES_BLOCK = _format_examples(list(SQL_EXAMPLES))
+
+
+def _to_json_safe(value: Any) -> Any:
+    """
+    将不可JSON序列化的值(日期时间、Decimal等)转换为字符串
+    
+    Args:
+        value: 字段值
+        
+    Returns:
+        可序列化的值
+    """
+    if isinstance(value, (str, int, float, bool, list, dict)):
+        return value
+    return str(value)
+
+
+def _dumps_sample(rows: List[Dict[str, Any]]) -> str:
+    """
+    将示例数据序列化为缩进的JSON数组文本，用于填入提示词
+    
+    超长的字符串字段会被截断；累计大小超过_SAMPLE_MAX_BYTES后不再加入后续行(至少保留一行)，
+    以免宽表或长文本字段使提示词过长
+    
+    Args:
+        rows: 示例数据行
+        
+    Returns:
+        JSON文本
+    """
+    option = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+    max_chars = _SAMPLE_MAX_CELL_CHARS
+    parts: List[bytes] = []
+    size = 0
+    for row in rows:
+        trimmed = {
+            key: value[:max_chars] + "…" if isinstance(value, str) and len(value) > max_chars else value
+            for key, value in row.items()
+        }
+        part = orjson.dumps(trimmed, default=str, option=option)
+        if parts and size + len(part) > _SAMPLE_MAX_BYTES:
+            break
+        parts.append(part)
+        size += len(part)
+    if not parts:
+        return "[]"
+    return (b"[\n" + b",\n".join(parts) + b"\n]").decode()
+
+
+def _dumps_rows_lines(rows: List[Dict[str, Any]]) -> str:
+    """
+    将数据行逐行序列化为紧凑JSON，每行一个对象，用于填入提示词
+    
+    Args:
+        rows: 数据行
+        
+    Returns:
+        以换行分隔的JSON文本
+    """
+    option = orjson.OPT_NON_STR_KEYS
+    return b"\n".join([orjson.dumps(row, default=str, option=option) for row in rows]).decode()
+
+
+def _pool_capacity(engine: Any) -> int:
+    """
+    获取引擎连接池的常驻连接数
+    
+    Args:
+        engine: SQLAlchemy引擎
+        
+    Returns:
+        连接池大小，无法获取时返回并发线程数上限
+    """
+    size = getattr(getattr(engine, "pool", None), "size", None)
+    if callable(size):
+        size = size()
+    if isinstance(size, int) and size > 0:
+        return size
+    return _SCHEMA_FETCH_MAX_WORKERS
+
+
+def _parse_marked_block(sql_response: str) -> Optional[Tuple[str, str, List[str]]]:
+    """
+    用str.find定位三个段落标记并直接切片，处理格式规范的响应
+    
+    Args:
+        sql_response: LLM响应
+        
+    Returns:
+        (主要SQL, 备用SQL, 后续查询建议)元组，标记不完整或段落中夹有围栏时返回None
+    """
+    i_main = sql_response.find(_MAIN_MARKER)
+    if i_main == -1:
+        return None
+    i_fallback = sql_response.find(_FALLBACK_MARKER, i_main)
+    if i_fallback == -1:
+        return None
+    i_suggestions = sql_response.find(_SUGGESTIONS_LINE_MARKER, i_fallback)
+    if i_suggestions == -1:
+        return None
+    end = sql_response.find("```", i_suggestions)
+    if end == -1:
+        end = len(sql_response)
+    
+    def section(marker_pos: int, stop: int) -> Optional[str]:
+        newline = sql_response.find("\n", marker_pos, stop)
+        if newline == -1:
+            return ""
+        body = sql_response[newline + 1:stop]
+        # 段落中夹有围栏等非常规格式时交给逐行扫描处理
+        return None if "```" in body else body.strip()
+    
+    main_sql = section(i_main, i_fallback)
+    fallback_sql = section(i_fallback, i_suggestions)
+    suggestions_text = section(i_suggestions, end)
+    if main_sql is None or fallback_sql is None or suggestions_text is None:
+        return None
+    
+    suggestions = []
+    for line in suggestions_text.splitlines():
+        # 去除序号，只保留问句形式的建议
+        clean_line = _strip_suggestion_number(line.strip())
+        if clean_line.endswith(_QUESTION_SUFFIXES):
+            suggestions.append(clean_line)
+    return main_sql, fallback_sql, suggestions
+
+
+def _scan_sql_sections(sql_response: str) -> Tuple[str, str, List[str]]:
+    """
+    逐行扫描LLM响应，按段落标记切换状态提取SQL和建议，兼容旧格式和非常规格式
+    
+    Args:
+        sql_response: LLM响应
+        
+    Returns:
+        (主要SQL, 备用SQL, 后续查询建议)元组
+    """
+    suggestions: List[str] = []
+    main_lines: List[str] = []
+    fallback_lines: List[str] = []
+    loose_suggestions: List[str] = []
+    sql_blocks: List[List[str]] = []
+    section = _SECTION_NONE
+    in_fence = False
+    in_sql_fence = False
+    
+    for line in sql_response.splitlines():
+        stripped = line.strip()
+        
+        # 代码块围栏本身不计入内容，闭合围栏结束当前段落
+        if stripped.startswith("```"):
+            if in_fence:
+                in_fence = in_sql_fence = False
+                section = _SECTION_NONE
+            else:
+                in_fence = True
+                in_sql_fence = stripped[3:].strip().lower() in ("sql", "")
+                if in_sql_fence:
+                    sql_blocks.append([])
+            continue
+        
+        next_section = _match_section(stripped)
+        if next_section is not None:
+            section = next_section
+            continue
+        
+        if in_sql_fence:
+            sql_blocks[-1].append(line)
+        
+        if section == _SECTION_MAIN:
+            main_lines.append(line)
+        elif section == _SECTION_FALLBACK:
+            fallback_lines.append(line)
+        elif section == _SECTION_SUGGESTIONS:
+            # 去除序号，只保留问句形式的建议
+            clean_line = _strip_suggestion_number(stripped)
+            if clean_line.endswith(_QUESTION_SUFFIXES):
+                suggestions.append(clean_line)
+        else:
+            loose_match = _LOOSE_SUGGESTION_RE.match(line)
+            if loose_match:
+                loose_suggestions.append(loose_match.group(1).strip())
+    
+    main_sql = "\n".join(main_lines).strip()
+    fallback_sql = "\n".join(fallback_lines).strip()
+    
+    # 没有建议段落时，使用段落之外的编号问句
+    if not suggestions:
+        suggestions = loose_suggestions
+    
+    # 没有任何SQL标记时，依次使用SQL代码块作为主要SQL和备用SQL
+    if not main_sql and not fallback_sql:
+        blocks = [block for block in ("\n".join(lines).strip() for lines in sql_blocks) if block]
+        if blocks:
+            main_sql = blocks[0]
+            if len(blocks) > 1:
+                fallback_sql = blocks[1]
+    
+    return main_sql, fallback_sql, suggestions
+
+
+def _rows_to_dicts(rows: List[Any]) -> List[Dict[str, Any]]:
+    """
+    将非字典的查询结果行转换为字典列表
+    
+    只根据第一行判断一次行类型，不再整体做JSON序列化再解析。
+    
+    Args:
+        rows: 查询结果行
+        
+    Returns:
+        字典列表
+    """
+    first = rows[0]
+    if hasattr(first, "_asdict"):
+        # 命名元组
+        return [row._asdict() for row in rows]
+    if hasattr(first, "_mapping"):
+        # SQLAlchemy Row
+        return [dict(row._mapping) for row in rows]
+    if hasattr(first, "keys"):
+        # 类字典对象
+        return [dict(row) for row in rows]
+    # 普通序列没有列名，按位置生成列名
+    keys = [f"column_{i + 1}" for i in range(len(first))]
+    return [dict(zip(keys, row)) for row in rows]
+
+
 class DatabaseToolkit:
     """数据库工具类，用于提供数据库元数据和执行查询"""
     
@@ -374,31 +1015,48 @@ class DatabaseToolkit:
             )
         
         # 创建SQLAlchemy数据库实例
-        try:
-            # 尝试创建SQLDatabase
+        self.db = None
+        if _SQLDatabase is None:
+            logger.warning("无法导入SQLDatabase，某些功能将不可用")
+        else:
             try:
-                # 尝试最新版本的langchain导入
-                try:
-                    from langchain_community.utilities import SQLDatabase
-                    self.db = SQLDatabase(engine=self.sql_query_tool.engine)
-                except (ImportError, AttributeError, TypeError):
-                    # 尝试旧版本的langchain导入
-                    try:
-                        from langchain.utilities import SQLDatabase
-                        self.db = SQLDatabase(engine=self.sql_query_tool.engine)
-                    except (ImportError, AttributeError, TypeError):
-                        # 最后尝试原始版本
-                        from langchain.utilities.sql_database import SQLDatabase
-                        self.db = SQLDatabase(self.sql_query_tool.engine)
+                self.db = _SQLDatabase(self.sql_query_tool.engine)
             except Exception as e:
                 logger.warning(f"无法创建SQLDatabase: {str(e)}，某些功能将不可用")
-                self.db = None
-        except ImportError:
-            logger.warning("无法导入SQLDatabase，某些功能将不可用")
-            self.db = None
         
         # 保存引擎引用
         self.engine = self.sql_query_tool.engine if self.sql_query_tool else engine
+        
+        # 复用的Inspector，其内部会缓存反射结果；表名缓存过期或invalidate()时重建
+        self._inspector = None
+        # 表名缓存：(获取时间, 表名列表)，避免每次校验SQL都反射整个数据库
+        self._table_names_cache: Optional[Tuple[float, List[str]]] = None
+        # 表结构缓存：(表名元组, 版本号) -> 表结构，invalidate()时递增版本号
+        self._schema_cache: Dict[Tuple[Tuple[str, ...], int], Dict[str, List[Dict[str, Any]]]] = {}
+        self._schema_version = 0
+        # 工具包在多个NL2SQLChain间共享，首次加载表结构时加锁避免重复反射
+        self._schema_lock = threading.Lock()
+    
+    def get_inspector(self):
+        """
+        获取复用的SQLAlchemy Inspector
+        
+        Returns:
+            Inspector实例
+        """
+        inspector = self._inspector
+        if inspector is None:
+            inspector = self._inspector = inspect(self.engine)
+        return inspector
+    
+    def invalidate(self) -> None:
+        """
+        使表名和表结构缓存失效，数据库结构变更后调用
+        """
+        self._inspector = None
+        self._table_names_cache = None
+        self._schema_cache.clear()
+        self._schema_version += 1
     
     def get_database_schema(self) -> Dict[str, List[Dict[str, Any]]]:
         """
@@ -408,9 +1066,6 @@ class DatabaseToolkit:
             数据库表结构的字典，键为表名，值为列定义列表
         """
         try:
-            # 使用SQL查询工具获取数据库表结构
-            tables_info = {}
-            
             # 获取所有表名
             table_names = self.get_table_names()
             
@@ -420,45 +1075,96 @@ class DatabaseToolkit:
             if self.exclude_tables:
                 table_names = [t for t in table_names if t not in self.exclude_tables]
             
-            # 获取每个表的结构
-            for table_name in table_names:
-                try:
-                    schema_info = self.sql_query_tool.get_table_schema(table_name)
-                    
-                    if not schema_info.get("success", False):
-                        logger.warning(f"获取表 {table_name} 结构失败: {schema_info.get('error', '未知错误')}")
-                        continue
-                    
-                    # 提取列信息
-                    columns = []
-                    for col in schema_info.get("columns", []):
-                        column_info = {
-                            "name": col["name"],
-                            "type": col["type"],
-                            "primary_key": col.get("primary_key", False),
-                            "nullable": col.get("nullable", True),
-                            "description": f"{col['name']} ({col['type']})"
-                        }
-                        
-                        # 添加外键信息
-                        for fk in schema_info.get("foreign_keys", []):
-                            if col["name"] in fk["constrained_columns"]:
-                                column_info["foreign_key"] = f"{fk['referred_table']}.{','.join(fk['referred_columns'])}"
-                                break
-                        
-                        columns.append(column_info)
-                    
-                    tables_info[table_name] = columns
-                    
-                except Exception as e:
-                    logger.error(f"获取表 {table_name} 结构时出错: {str(e)}")
+            # 表集合与版本号不变时直接返回缓存的表结构
+            cache_key = (tuple(table_names), self._schema_version)
+            cached = self._schema_cache.get(cache_key)
+            if cached is not None:
+                return cached
             
-            return tables_info
+            with self._schema_lock:
+                # 等待锁期间其他线程可能已完成加载
+                cached = self._schema_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+                return self._load_database_schema(table_names, cache_key)
             
         except Exception as e:
             logger.error(f"获取数据库模式失败: {str(e)}")
             return {}
     
+    def _load_database_schema(
+        self,
+        table_names: List[str],
+        cache_key: Tuple[Tuple[str, ...], int]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        反射各表结构并写入缓存
+        
+        Args:
+            table_names: 过滤后的表名列表
+            cache_key: 表结构缓存键
+            
+        Returns:
+            数据库表结构的字典
+        """
+        tables_info = {}
+        
+        # 各表的结构查询互不依赖，并发发起；线程数不超过连接池大小，避免耗尽连接
+        if table_names:
+            max_workers = min(_SCHEMA_FETCH_MAX_WORKERS, len(table_names), _pool_capacity(self.sql_query_tool.engine))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # 先全部提交再依次收集结果，保持表的原有顺序
+                futures = [(table_name, executor.submit(self._fetch_table_columns, table_name)) for table_name in table_names]
+                for table_name, future in futures:
+                    columns = future.result()
+                    if columns is not None:
+                        tables_info[table_name] = columns
+        
+        self._schema_cache = {cache_key: tables_info}
+        return tables_info
+    
+    def _fetch_table_columns(self, table_name: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        获取单个表的列定义
+        
+        Args:
+            table_name: 表名
+            
+        Returns:
+            列定义列表，获取失败时返回None
+        """
+        try:
+            schema_info = self.sql_query_tool.get_table_schema(table_name)
+            
+            if not schema_info.get("success", False):
+                logger.warning(f"获取表 {table_name} 结构失败: {schema_info.get('error', '未知错误')}")
+                return None
+            
+            # 提取列信息
+            columns = []
+            for col in schema_info.get("columns", []):
+                column_info = {
+                    "name": col["name"],
+                    "type": col["type"],
+                    "primary_key": col.get("primary_key", False),
+                    "nullable": col.get("nullable", True),
+                    "description": f"{col['name']} ({col['type']})"
+                }
+                
+                # 添加外键信息
+                for fk in schema_info.get("foreign_keys", []):
+                    if col["name"] in fk["constrained_columns"]:
+                        column_info["foreign_key"] = f"{fk['referred_table']}.{','.join(fk['referred_columns'])}"
+                        break
+                
+                columns.append(column_info)
+            
+            return columns
+            
+        except Exception as e:
+            logger.error(f"获取表 {table_name} 结构时出错: {str(e)}")
+            return None
+    
     def get_schema_description(self) -> str:
         """
         获取数据库Schema的详细描述
@@ -478,12 +1184,19 @@ class DatabaseToolkit:
         Returns:
             表名列表
         """
-        if self.db:
-            metadata = sqlalchemy.MetaData()
-            metadata.reflect(bind=self.sql_query_tool.engine)
-            return list(metadata.tables.keys())
-        else:
+        if not self.db:
             return []
+        
+        cached = self._table_names_cache
+        if cached is not None and time.monotonic() - cached[0] < _TABLE_NAMES_TTL:
+            return cached[1]
+        
+        # inspector只查询表名，不像MetaData.reflect那样反射每个表的完整DDL；
+        # 缓存过期时重建Inspector，丢弃其内部缓存的旧反射结果
+        self._inspector = inspect(self.engine)
+        table_names = self._inspector.get_table_names()
+        self._table_names_cache = (time.monotonic(), table_names)
+        return table_names
     
     def get_table_description(self, table_name: str) -> str:
         """
@@ -501,36 +1214,36 @@ class DatabaseToolkit:
         if not schema_info.get("success", False):
             return f"无法获取表 {table_name} 的结构: {schema_info.get('error', '未知错误')}"
         
-        # 构建描述字符串
-        description = f"Table '{table_name}':\n"
+        # 构建描述字符串：各片段追加到列表，最后一次性拼接
+        parts = [f"Table '{table_name}':\n"]
         
         # 添加列信息
         for column in schema_info.get("columns", []):
-            description += f"- {column['name']} ({column['type']})"
+            parts.append(f"- {column['name']} ({column['type']})")
             if column.get("primary_key"):
-                description += " (PK)"
+                parts.append(" (PK)")
             if not column.get("nullable"):
-                description += " (NOT NULL)"
-            description += "\n"
+                parts.append(" (NOT NULL)")
+            parts.append("\n")
         
         # 添加外键信息
         foreign_keys = schema_info.get("foreign_keys", [])
         if foreign_keys:
-            description += "\nForeign Keys:\n"
+            parts.append("\nForeign Keys:\n")
             for fk in foreign_keys:
-                description += f"- {', '.join(fk['constrained_columns'])} -> {fk['referred_table']}.{', '.join(fk['referred_columns'])}\n"
+                parts.append(f"- {', '.join(fk['constrained_columns'])} -> {fk['referred_table']}.{', '.join(fk['referred_columns'])}\n")
         
         # 添加索引信息
         indexes = schema_info.get("indexes", [])
         if indexes:
-            description += "\nIndexes:\n"
+            parts.append("\nIndexes:\n")
             for idx in indexes:
-                description += f"- {idx['name']} on ({', '.join(idx['columns'])})"
+                parts.append(f"- {idx['name']} on ({', '.join(idx['columns'])})")
                 if idx.get("unique"):
-                    description += " UNIQUE"
-                description += "\n"
+                    parts.append(" UNIQUE")
+                parts.append("\n")
         
-        return description
+        return "".join(parts)
     
     def execute_query(self, query: str) -> List[Dict[str, Any]]:
         """
@@ -550,12 +1263,12 @@ class DatabaseToolkit:
             
             if isinstance(result, dict) and "data" in result:
                 # 新版API返回的是结构化结果对象
-                logger.info(f"查询执行成功，耗时: {execution_time:.4f}秒，返回{len(result['data'])}行结果")
+                logger.info("查询执行成功，耗时: %.4f秒，返回%s行结果", execution_time, len(result['data']))
                 return result["data"]
             elif hasattr(result, "data") and hasattr(result, "success"):
                 # 新版API返回的是结构化结果对象（实例）
                 if result.success:
-                    logger.info(f"查询执行成功，耗时: {execution_time:.4f}秒，返回{len(result.data)}行结果")
+                    logger.info("查询执行成功，耗时: %.4f秒，返回%s行结果", execution_time, len(result.data))
                     return result.data
                 else:
                     logger.error(f"查询执行失败: {result.error}")
@@ -563,7 +1276,7 @@ class DatabaseToolkit:
                     return []
             elif isinstance(result, list):
                 # 返回的是直接结果列表
-                logger.info(f"查询执行成功，耗时: {execution_time:.4f}秒，返回{len(result)}行结果")
+                logger.info("查询执行成功，耗时: %.4f秒，返回%s行结果", execution_time, len(result))
                 return result
             else:
                 # 不支持的返回类型
@@ -578,6 +1291,43 @@ class DatabaseToolkit:
     
 
 
+_toolkit_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4)
+def _get_toolkit(
+    include_tables: Optional[Tuple[str, ...]],
+    exclude_tables: Optional[Tuple[str, ...]]
+) -> DatabaseToolkit:
+    """按表过滤条件创建数据库工具包，相同条件复用同一实例"""
+    return DatabaseToolkit(
+        include_tables=list(include_tables) if include_tables is not None else None,
+        exclude_tables=list(exclude_tables) if exclude_tables is not None else None
+    )
+
+
+def get_database_toolkit(
+    include_tables: Optional[List[str]] = None,
+    exclude_tables: Optional[List[str]] = None
+) -> DatabaseToolkit:
+    """
+    获取进程内共享的数据库工具包
+    
+    多个NL2SQLChain共享同一工具包及其表名、表结构缓存，表结构只需反射一次
+    
+    Args:
+        include_tables: 包含的表列表
+        exclude_tables: 排除的表列表
+        
+    Returns:
+        DatabaseToolkit实例
+    """
+    include_key = tuple(sorted(include_tables)) if include_tables is not None else None
+    exclude_key = tuple(sorted(exclude_tables)) if exclude_tables is not None else None
+    with _toolkit_lock:
+        return _get_toolkit(include_key, exclude_key)
+
+
 class NL2SQLChain:
     """自然语言到SQL转换链
     
@@ -604,6 +1354,9 @@ class NL2SQLChain:
             "need_explanation": True,  # 是否需要解释
             "need_visualization": True,  # 是否需要可视化配置
             "need_suggestions": True,   # 是否需要建议
+            "llm_timeout": _DEFAULT_LLM_TIMEOUT,  # 单次LLM调用超时(秒)
+            "viz_skip_llm_confidence": 0.9,  # 推断可视化配置的置信度达到该值时不再调用LLM
+            "fake_stream_delay": 0.0,  # 模拟流式输出时每块之间的延迟(秒)
         }
         
         # 更新配置
@@ -626,8 +1379,8 @@ class NL2SQLChain:
             self.database_toolkit = database_toolkit
         else:
             try:
-                # 创建新的数据库工具包
-                self.database_toolkit = DatabaseToolkit(
+                # 使用进程内共享的数据库工具包
+                self.database_toolkit = get_database_toolkit(
                     include_tables=include_tables,
                     exclude_tables=exclude_tables
                 )
@@ -641,6 +1394,54 @@ class NL2SQLChain:
             
         # 缓存实际的数据库模式
         self._db_schema = None
+        # 缓存表名列表对应的(小写表名, 表名)对：(表名列表, 表名对)
+        self._table_pairs: Optional[Tuple[List[str], Tuple[Tuple[str, str], ...]]] = None
+        
+        # 缓存已渲染的提示词前缀：(表结构描述, 前缀)，表结构变化时重新渲染
+        self._prompt_prefix: Optional[Tuple[str, str]] = None
+        
+        # SQL与建议的结果缓存，以表结构描述的哈希作为版本号
+        embedder = verifier = None
+        if settings.ENABLE_SEMANTIC_CACHE:
+            embedder = get_embedding_service().get_embeddings
+            verifier = self._is_same_query
+        self._resp_cache = SemanticCache(maxsize=1024, embedder=embedder, verifier=verifier)
+        # 查询解释按完整提示词缓存；可视化配置的标题和描述随查询变化，按查询、SQL和结果列缓存
+        self._explanation_cache = SemanticCache(maxsize=256, ttl=_POST_QUERY_CACHE_TTL)
+        self._visualization_cache = SemanticCache(maxsize=256, ttl=_POST_QUERY_CACHE_TTL)
+        
+        # 执行前检查的危险SQL关键字，从配置中获取，若无配置则使用默认值
+        dangerous_keywords = settings.SQL_DANGEROUS_KEYWORDS if hasattr(settings, "SQL_DANGEROUS_KEYWORDS") else _DEFAULT_DANGEROUS_KEYWORDS
+        self._dangerous_keywords = frozenset(keyword.upper() for keyword in dangerous_keywords)
+        # 最外层查询的返回行数上限
+        self._auto_limit = getattr(settings, "SQL_AUTO_LIMIT", 100)
+        
+        # 最近LLM调用的成功/失败记录与熔断截止时间
+        self._llm_failures: deque = deque(maxlen=_CIRCUIT_WINDOW)
+        self._circuit_open_until = 0.0
+        
+        # 在事件循环中创建时，后台预先获取表结构，首个请求无需等待数据库反射
+        self._schema_warmup: Optional[asyncio.Task] = None
+        if self.database_toolkit:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                self._schema_warmup = loop.create_task(asyncio.to_thread(self.get_schema_description))
+    
+    def _get_table_pairs(self) -> Tuple[Tuple[str, str], ...]:
+        """
+        获取(小写表名, 表名)对，表名列表未变化时复用
+        
+        Returns:
+            (小写表名, 表名)元组
+        """
+        table_names = self.database_toolkit.get_table_names()
+        cached = self._table_pairs
+        if cached is None or cached[0] is not table_names:
+            cached = self._table_pairs = (table_names, tuple((t.lower(), t) for t in table_names))
+        return cached[1]
     
     def validate_sql_query(self, sql_query: str) -> Tuple[bool, str]:
         """
@@ -658,22 +1459,126 @@ class NL2SQLChain:
                 return False, "SQL查询为空或过短"
                 
             # 检查必要关键字
-            if "SELECT" not in sql_query.upper():
+            if not _SELECT_RE.search(sql_query):
                 return False, "缺少SELECT语句"
                 
-            # 检查表名对应
-            if self.database_toolkit:
-                all_tables = self.database_toolkit.get_table_names()
-                for table in all_tables:
-                    # 统一小写比较
-                    table_lower = table.lower()
-                    if table_lower in sql_query.lower() and table not in sql_query:
-                        return False, f"表名'{table}'大小写不匹配"
+            # 解析为语法树，语法错误在执行前即可发现
+            try:
+                expression = sqlglot.parse_one(sql_query, read=_LLM_SQL_DIALECT)
+            except sqlglot.errors.ParseError as e:
+                return False, f"SQL语法错误: {str(e).splitlines()[0]}"
+            
+            # 检查引用的表是否存在、大小写是否一致
+            table_pairs = self._get_table_pairs() if self.database_toolkit else ()
+            if table_pairs:
+                known_tables = {table for _, table in table_pairs}
+                tables_by_lower = dict(table_pairs)
+                cte_names = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+                for table_node in expression.find_all(exp.Table):
+                    name = table_node.name
+                    # 跳过子查询别名、CTE以及带库名限定的表
+                    if not name or table_node.db or name in known_tables or name in cte_names:
+                        continue
+                    actual = tables_by_lower.get(name.lower())
+                    if actual:
+                        return False, f"表名'{actual}'大小写不匹配"
+                    return False, f"表'{name}'不存在"
                     
             return True, ""
         except Exception as e:
             return False, f"验证SQL时出错: {str(e)}"
     
+    def _engine_sql_dialect(self) -> str:
+        """
+        获取当前数据库对应的sqlglot方言名
+        
+        Returns:
+            方言名，无法确定时返回LLM生成SQL所用的方言
+        """
+        engine = self.database_toolkit.engine if self.database_toolkit else None
+        if engine is None:
+            return _LLM_SQL_DIALECT
+        return _SQLGLOT_DIALECTS.get(engine.dialect.name, _LLM_SQL_DIALECT)
+    
+    def _transpile_for_engine(self, sql_query: str) -> str:
+        """
+        将MySQL方言的SQL转换为当前数据库的方言
+        
+        Args:
+            sql_query: SQL查询
+            
+        Returns:
+            转换后的SQL，无需转换或转换失败时返回原SQL
+        """
+        dialect = self._engine_sql_dialect()
+        if dialect == _LLM_SQL_DIALECT:
+            return sql_query
+        try:
+            return sqlglot.transpile(sql_query, read=_LLM_SQL_DIALECT, write=dialect)[0]
+        except sqlglot.errors.SqlglotError as e:
+            logger.warning(f"SQL方言转换失败，使用原SQL: {str(e)}")
+            return sql_query
+    
+    async def _is_same_query(self, query_a: str, query_b: str) -> bool:
+        """
+        让LLM判断两个查询是否可以共用同一SQL
+        
+        Args:
+            query_a: 新查询
+            query_b: 已缓存的查询
+            
+        Returns:
+            是否等价
+        """
+        if not self.llm_adapter:
+            return False
+        answer = await self.llm_adapter.generate(
+            prompt=_SAME_QUERY_TMPL.render(query_a=query_a, query_b=query_b),
+            max_tokens=5
+        )
+        return answer.strip().startswith("是")
+    
+    async def _cache_sql_result(self, query: str, schema_version: int, sql: str, suggestions: List[str]) -> None:
+        """
+        缓存LLM生成的SQL和建议
+        
+        Args:
+            query: 自然语言查询
+            schema_version: 表结构版本号
+            sql: 生成的SQL
+            suggestions: 后续查询建议
+        """
+        if self.llm_adapter.temperature > _SQL_CACHE_MAX_TEMPERATURE:
+            return
+        await self._resp_cache.put(query, (sql, tuple(suggestions)), schema_version)
+    
+    def refresh_schema(self) -> None:
+        """
+        丢弃缓存的表结构描述和提示词前缀，数据库结构变更后调用
+        
+        SQL结果缓存以表结构描述的哈希为版本号，下次生成时随之失效
+        """
+        self._db_schema = None
+        self._prompt_prefix = None
+        if self.database_toolkit:
+            self.database_toolkit.invalidate()
+    
+    def get_prompt_prefix(self) -> str:
+        """
+        获取SQL生成提示词的静态前缀
+        
+        Returns:
+            填入表结构后的提示词前缀，表结构不变时复用同一字符串
+        """
+        db_schema = self.get_schema_description()
+        cached = self._prompt_prefix
+        if cached is None or cached[0] != db_schema:
+            cached = self._prompt_prefix = (
+                db_schema,
+                _SQL_GENERATION_PREFIX_TMPL.render(db_schema=db_schema, examples=_EXAMPLES_BLOCK)
+            )
+        return cached[1]
+    
     def get_schema_description(self) -> str:
         """
         获取数据库模式描述
@@ -686,57 +1591,57 @@ class NL2SQLChain:
             try:
                 # 获取实际数据库表列表
                 tables = []
-                inspector = inspect(self.database_toolkit.engine)
+                inspector = self.database_toolkit.get_inspector()
                 tables = inspector.get_table_names()
                 
                 if not tables:
                     logger.warning("数据库中未找到任何表，使用默认表结构")
                     return DEFAULT_DB_SCHEMA
                 
-                # 构建表结构描述
-                schema_text = "数据库表结构:\n\n"
+                # 构建紧凑的表结构描述：每表一行，外键集中列在末尾
+                lines = ["数据库表结构(表名(列 类型), PK=主键, NN=非空):"]
+                fk_lines = []
                 
                 for table_name in tables:
-                    schema_text += f"{table_name} 表:\n"
-                    
                     try:
-                        # 获取列信息
-                        columns = inspector.get_columns(table_name)
-                        for col in columns:
-                            col_type = str(col["type"])
-                            schema_text += f"  - {col['name']}: {col_type} "
-                            if col.get('primary_key', False):
-                                schema_text += "(主键) "
-                            if col.get('nullable') is False:
-                                schema_text += "(非空) "
-                            schema_text += "\n"
-                        
                         # 获取主键信息
                         try:
                             pk = inspector.get_pk_constraint(table_name)
-                            if pk and 'constrained_columns' in pk and pk['constrained_columns']:
-                                schema_text += f"  主键: {', '.join(pk['constrained_columns'])}\n"
+                            pk_columns = set(pk.get('constrained_columns') or ()) if pk else set()
                         except Exception as e:
                             logger.warning(f"获取表 {table_name} 主键信息时出错: {str(e)}")
+                            pk_columns = set()
+                        
+                        # 获取列信息
+                        col_defs = []
+                        for col in inspector.get_columns(table_name):
+                            col_def = f"{col['name']} {col['type']}"
+                            if col['name'] in pk_columns or col.get('primary_key', False):
+                                col_def += " PK"
+                            elif col.get('nullable') is False:
+                                col_def += " NN"
+                            col_defs.append(col_def)
+                        lines.append(f"{table_name}({', '.join(col_defs)})")
                         
                         # 获取外键信息
                         try:
-                            fks = inspector.get_foreign_keys(table_name)
-                            if fks:
-                                schema_text += "  外键关系:\n"
-                                for fk in fks:
-                                    schema_text += f"    - {', '.join(fk.get('constrained_columns', []))} -> {fk.get('referred_table')}.{', '.join(fk.get('referred_columns', []))}\n"
+                            for fk in inspector.get_foreign_keys(table_name):
+                                fk_lines.append(f"{table_name}.{','.join(fk.get('constrained_columns', []))} -> {fk.get('referred_table')}.{','.join(fk.get('referred_columns', []))}")
                         except Exception as e:
                             logger.warning(f"获取表 {table_name} 外键信息时出错: {str(e)}")
-                        
-                        schema_text += "\n"
                     except Exception as e:
                         logger.error(f"获取表 {table_name} 结构时出错: {str(e)}")
-                        schema_text += f"  (获取表结构失败: {str(e)})\n\n"
+                        lines.append(f"{table_name}(获取表结构失败: {str(e)})")
+                
+                if fk_lines:
+                    lines.append("外键:")
+                    lines.extend(fk_lines)
+                
+                schema_text = "\n".join(lines)
                 
                 # 缓存结果
                 self._db_schema = schema_text
-                logger.info(f"成功获取真实数据库表结构信息，包含 {len(tables)} 个表")
+                logger.info("成功获取真实数据库表结构信息，包含 %s 个表", len(tables))
                 return schema_text
                 
             except Exception as e:
@@ -769,11 +1674,14 @@ class NL2SQLChain:
                     logger.warning(f"SQL查询无效: {error_msg}")
                     return [], 0
                 
+                # 数据库不是MySQL时，把LLM生成的MySQL方言SQL转换为目标方言
+                sql_query = self._transpile_for_engine(sql_query)
+                
                 # 测试SQL是否可以执行
                 safe_sql = self._ensure_safe_sql(sql_query)
                 
                 # 记录查询开始
-                logger.info(f"执行SQL查询: {safe_sql}")
+                logger.info("执行SQL查询: %s", safe_sql)
                 start_time = time.perf_counter()
                 
                 results = self.database_toolkit.execute_query(safe_sql)
@@ -781,7 +1689,7 @@ class NL2SQLChain:
                 # 记录结果行数
                 row_count = len(results) if results else 0
                 elapsed = time.perf_counter() - start_time
-                logger.info(f"查询执行完成，返回 {row_count} 条真实数据，耗时 {elapsed:.2f}秒")
+                logger.info("查询执行完成，返回 %s 条真实数据，耗时 %.2f秒", row_count, elapsed)
                 
                 # 确保结果不会太大
                 if row_count > 100:
@@ -791,12 +1699,7 @@ class NL2SQLChain:
                 # 验证结果格式
                 if results and isinstance(results, list) and not isinstance(results[0], dict):
                     logger.warning(f"查询结果格式异常: {type(results[0])}")
-                    # 尝试转换为字典列表
-                    if hasattr(results[0], "_asdict"):  # 处理命名元组
-                        results = [dict(row._asdict()) for row in results]
-                    else:
-                        # 最后尝试将结果转为JSON再解析回来规范化格式
-                        results = json.loads(json.dumps(results))
+                    results = _rows_to_dicts(results)
                 
                 # 转换所有内容为可序列化格式
                 results = self._format_results(results)
@@ -811,6 +1714,39 @@ class NL2SQLChain:
             # 失败时返回空结果
             return [], 0
     
+    def _match_sql_template(self, query: str) -> Optional[Tuple[str, List[str]]]:
+        """
+        匹配固定句式的查询，直接生成SQL而不调用LLM
+        
+        Args:
+            query: 自然语言查询
+            
+        Returns:
+            (SQL查询字符串, 建议列表)元组，未匹配时返回None
+        """
+        engine = self.database_toolkit.engine if self.database_toolkit else None
+        if engine is None or engine.dialect.name != "mysql":
+            return None
+        
+        text_query = query.strip().rstrip(_TEMPLATE_TRAILING_CHARS)
+        for pattern, sql_template, get_params, tables, suggestions in _SQL_TEMPLATES:
+            match = pattern.fullmatch(text_query)
+            if match is None:
+                continue
+            
+            # 依赖的表不存在时交给LLM处理
+            table_names = {table for _, table in self._get_table_pairs()}
+            if not tables <= table_names:
+                return None
+            
+            statement = text(sql_template).bindparams(
+                *(bindparam(name, value, type_=Integer) for name, value in get_params(match).items())
+            )
+            sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            logger.info("查询匹配固定句式，跳过LLM生成: %s", query)
+            return sql, list(suggestions)
+        return None
+    
     async def generate_sql_with_suggestions(self, query: str) -> Tuple[str, List[str]]:
         """
         根据自然语言查询生成SQL查询和后续查询建议
@@ -826,118 +1762,338 @@ class NL2SQLChain:
         # 如果查询为空，直接返回
         if not query or len(query.strip()) < 3:
             return "", []
-            
-        # 重试机制
-        max_retries = 2  # 最大重试次数
-        retry_count = 0
         
-        while retry_count <= max_retries:
-            try:
-                if retry_count > 0:
-                    logger.info(f"SQL生成重试 #{retry_count}")
+        # 固定句式的查询直接使用SQL模板
+        matched = self._match_sql_template(query)
+        if matched is not None:
+            return matched
+        
+        # 相同(或语义等价)的查询直接复用缓存的结果，表结构变化后缓存自动失效
+        schema_version = hash(self.get_schema_description())
+        cached = await self._resp_cache.get(query, schema_version)
+        if cached is not None:
+            logger.info("SQL生成命中缓存: %s", query)
+            return cached[0], list(cached[1])
+            
+        if not (self.sql_chain and self.llm_adapter):
+            # 链不可用，使用回退方法
+            if not self.llm_adapter:
+                logger.warning("LLM适配器不可用，使用回退方法")
+            else:
+                logger.warning("SQL生成链不可用，使用回退方法")
+            return await self._fallback_sql_generation(query)
+        
+        if self._circuit_is_open():
+            logger.warning("LLM调用失败率过高，熔断期间使用回退方法")
+            return await self._fallback_sql_generation(query)
+        
+        logger.info("生成SQL查询和建议: %s", query)
+        
+        # 构建完整提示词：缓存的静态前缀 + 当前查询
+        prompt = self.get_prompt_prefix() + _SQL_GENERATION_SUFFIX_TMPL.render(query=query)
+        
+        # 最多发起max_retries+1次尝试，上一次尝试结束后才发起下一次，避免重复消耗token：
+        # - 上游调用出错(超时、限流等)时，按指数退避加全抖动后重试；不可重试的错误直接回退
+        # - 响应无法解析出有效SQL时，立即以更严格的输出要求重试
+        max_retries = 2
+        max_attempts = max_retries + 1
+        loop = asyncio.get_running_loop()
+        pending: Set[asyncio.Task] = set()
+        launched = 0
+        # 下一次尝试的发起时间，为None时表示等待当前尝试结束
+        launch_at: Optional[float] = loop.time()
+        attempt_prompt = prompt
+        fatal = False
+        try:
+            while (launched < max_attempts or pending) and not fatal:
+                if launched < max_attempts and launch_at is not None and loop.time() >= launch_at:
+                    if launched > 0:
+                        logger.info("SQL生成重试 #%s", launched)
+                    pending.add(asyncio.create_task(self._generate_sql_attempt(attempt_prompt)))
+                    launched += 1
+                    launch_at = None
                 
-                if self.sql_chain and self.llm_adapter:
-                    # 使用LangChain生成SQL
-                    logger.info(f"生成SQL查询和建议: {query}")
-                    
-                    # 获取数据库表结构描述
-                    db_schema = self.get_schema_description()
-                    
-                    # 构建完整提示词
-                    prompt = SQL_GENERATION_PROMPT.format(
-                        db_schema=db_schema,
-                        query=query
-                    )
-                    
-                    # 调用LLM生成SQL
+                timeout = None
+                if launched < max_attempts and launch_at is not None:
+                    timeout = max(0.0, launch_at - loop.time())
+                if not pending:
+                    # 等待退避结束后再发起下一次尝试
+                    await asyncio.sleep(timeout)
+                    continue
+                
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                
+                for task in done:
                     try:
-                        sql_response = await self.llm_adapter.generate(
-                            prompt=prompt,
-                            max_tokens=2000  # 增加token上限，因为现在需要生成SQL和建议
-                        )
-                        
-                        # 检查响应是否为空
-                        if sql_response is None or not isinstance(sql_response, str) or sql_response.strip() == "":
-                            logger.warning(f"LLM返回了空响应或无效响应，重试 ({retry_count}/{max_retries})")
-                            retry_count += 1
-                            if retry_count > max_retries:
-                                logger.warning("已达到最大重试次数，使用回退SQL生成")
-                                return await self._fallback_sql_generation(query), self._generate_default_suggestions(query)
-                            # 添加短暂等待，避免立即重试
-                            await asyncio.sleep(1.5)
-                            continue
-                            
-                        logger.debug(f"LLM原始响应: {sql_response}")
-                        
-                        # 从响应中提取主要SQL、备用SQL和建议
-                        main_sql, fallback_sql, suggestions = self._extract_sql_pair(sql_response)
-                        
-                        logger.debug(f"提取的主要SQL: {main_sql}")
-                        logger.debug(f"提取的备用SQL: {fallback_sql}")
-                        logger.debug(f"提取的后续查询建议: {suggestions}")
-                        
-                        # 尝试使用主要SQL
-                        if main_sql:
-                            # 验证主要SQL
-                            is_valid, error_msg = self.validate_sql_query(main_sql)
-                            if is_valid:
-                                elapsed_time = time.perf_counter() - start_time
-                                logger.info(f"SQL生成耗时: {elapsed_time:.4f}秒，使用主要SQL")
-                                return main_sql, suggestions
-                            else:
-                                logger.warning(f"主要SQL无效: {error_msg}")
-                        
-                        # 尝试使用备用SQL
-                        if fallback_sql:
-                            # 验证备用SQL
-                            is_valid, error_msg = self.validate_sql_query(fallback_sql)
-                            if is_valid:
-                                elapsed_time = time.perf_counter() - start_time
-                                logger.info(f"SQL生成耗时: {elapsed_time:.4f}秒，使用备用SQL")
-                                return fallback_sql, suggestions
-                            else:
-                                logger.warning(f"备用SQL也无效: {error_msg}")
-                        
+                        result = task.result()
                     except Exception as e:
-                        logger.error(f"LLM调用失败: {str(e)}")
-                        retry_count += 1
-                        if retry_count > max_retries:
-                            logger.warning("已达到最大重试次数，使用回退SQL生成")
-                            return await self._fallback_sql_generation(query), self._generate_default_suggestions(query)
-                        # 添加短暂等待，避免立即重试
-                        await asyncio.sleep(1.5)
+                        logger.error(f"LLM SQL生成失败: {str(e)} ({launched}/{max_attempts})")
+                        self._record_llm_call(False)
+                        if _is_fatal_llm_error(e):
+                            logger.warning("LLM调用错误不可重试，直接使用回退方法")
+                            fatal = True
+                            break
+                        delay = random.uniform(0, min(_RETRY_MAX_DELAY, _RETRY_BASE_DELAY * 2 ** launched))
+                        launch_at = loop.time() + delay
+                        continue
+                    if result is None:
+                        self._record_llm_call(False)
+                        attempt_prompt = prompt + SQL_STRICT_SUFFIX
+                        launch_at = loop.time()
                         continue
-                
-                    # 如果提取失败或SQL都无效，尝试再次重试
-                    logger.warning(f"无法从LLM响应中提取有效SQL ({retry_count}/{max_retries})")
-                    retry_count += 1
-                    if retry_count > max_retries:
-                        logger.warning("已达到最大重试次数，使用回退SQL生成")
-                        return await self._fallback_sql_generation(query), self._generate_default_suggestions(query)
-                    await asyncio.sleep(1.5)
-                    continue
                     
-                else:
-                    # 链不可用，使用回退方法
-                    if not self.llm_adapter:
-                        logger.warning("LLM适配器不可用，使用回退方法")
-                    else:
-                        logger.warning("SQL生成链不可用，使用回退方法")
-                    return await self._fallback_sql_generation(query), self._generate_default_suggestions(query)
-                
-            except Exception as e:
-                logger.error(f"LLM SQL生成失败: {str(e)}, 尝试重试 ({retry_count}/{max_retries})")
-                retry_count += 1
-                if retry_count > max_retries:
-                    logger.warning("已达到最大重试次数，使用回退SQL生成")
+                    self._record_llm_call(True)
+                    sql, suggestions, sql_kind = result
                     elapsed_time = time.perf_counter() - start_time
-                    logger.info(f"回退SQL生成耗时: {elapsed_time:.4f}秒")
-                    return await self._fallback_sql_generation(query), self._generate_default_suggestions(query)
-                # 添加短暂等待，避免立即重试
-                await asyncio.sleep(1.5)
+                    logger.info("SQL生成耗时: %.4f秒，使用%s", elapsed_time, sql_kind)
+                    await self._cache_sql_result(query, schema_version, sql, suggestions)
+                    return sql, suggestions
+                
+                if self._circuit_is_open():
+                    logger.warning("LLM调用失败率过高，停止重试")
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        # 所有尝试都失败，使用回退方法
+        logger.warning("已达到最大重试次数，使用回退SQL生成")
+        elapsed_time = time.perf_counter() - start_time
+        logger.info("回退SQL生成耗时: %.4f秒", elapsed_time)
+        return await self._fallback_sql_generation(query)
+    
+    def _circuit_is_open(self) -> bool:
+        """
+        判断LLM调用熔断是否处于打开状态
+        
+        Returns:
+            熔断期间返回True
+        """
+        return time.monotonic() < self._circuit_open_until
     
-        # 如果所有重试都失败，使用回退方法
-        return await self._fallback_sql_generation(query), self._generate_default_suggestions(query)
+    def _record_llm_call(self, success: bool) -> None:
+        """
+        记录一次LLM调用结果，失败率超过一半时打开熔断
+        
+        Args:
+            success: 调用是否得到有效SQL
+        """
+        self._llm_failures.append(not success)
+        if success or len(self._llm_failures) < _CIRCUIT_MIN_CALLS:
+            return
+        if sum(self._llm_failures) * 2 > len(self._llm_failures):
+            logger.warning(f"最近{len(self._llm_failures)}次LLM调用失败率过高，熔断{_CIRCUIT_OPEN_SECONDS:.0f}秒")
+            self._circuit_open_until = time.monotonic() + _CIRCUIT_OPEN_SECONDS
+            # 熔断结束后重新统计
+            self._llm_failures.clear()
+    
+    async def generate_sql_streaming(self, query: str) -> Tuple[str, "asyncio.Future[List[str]]"]:
+        """
+        流式生成SQL：主要SQL和备用SQL输出完毕即返回，后续查询建议在后台继续接收
+        
+        调用方可以在建议生成期间先执行SQL；流式生成失败或SQL无效时
+        回退到带重试的generate_sql_with_suggestions
+        
+        Args:
+            query: 自然语言查询
+            
+        Returns:
+            (SQL查询字符串, 结果为建议列表的Future)元组
+        """
+        loop = asyncio.get_running_loop()
+        
+        def resolved(value: List[str]) -> "asyncio.Future[List[str]]":
+            future = loop.create_future()
+            future.set_result(value)
+            return future
+        
+        if not query or len(query.strip()) < 3:
+            return "", resolved([])
+        
+        matched = self._match_sql_template(query)
+        if matched is not None:
+            return matched[0], resolved(matched[1])
+        
+        schema_version = hash(self.get_schema_description())
+        cached = await self._resp_cache.get(query, schema_version)
+        if cached is not None:
+            logger.info("SQL生成命中缓存: %s", query)
+            return cached[0], resolved(list(cached[1]))
+        
+        if not (self.sql_chain and self.llm_adapter) or self._circuit_is_open():
+            sql, suggestions = await self.generate_sql_with_suggestions(query)
+            return sql, resolved(suggestions)
+        
+        start_time = time.perf_counter()
+        prompt = self.get_prompt_prefix() + _SQL_GENERATION_SUFFIX_TMPL.render(query=query)
+        stream = self.llm_adapter.generate_stream(prompt, max_tokens=2000)
+        # 与非流式生成相同的单次调用超时，限制首个token到SQL输出完毕的总时间，避免卡住的流长时间占用请求
+        deadline = loop.time() + self.config.get("llm_timeout", _DEFAULT_LLM_TIMEOUT)
+        buffer = ""
+        sql = ""
+        exhausted = False
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                scan_from = max(0, len(buffer) - _SUGGESTIONS_MARKER_LEN)
+                buffer += chunk
+                # 建议标记出现时，主要SQL和备用SQL都已完整输出
+                if buffer.find(_SUGGESTIONS_MARKER, scan_from) != -1:
+                    break
+            # 适配器把错误转成了文本输出，按上游失败处理
+            if not buffer.startswith((_LLM_STREAM_ERROR_PREFIX,) + _LLM_ERROR_PREFIXES):
+                sql = self._select_valid_sql(buffer)
+        except asyncio.TimeoutError:
+            logger.warning("流式生成SQL超时，改用非流式生成")
+        except Exception as e:
+            logger.warning(f"流式生成SQL失败，改用非流式生成: {str(e)}")
+        
+        if not sql:
+            self._record_llm_call(False)
+            await stream.aclose()
+            sql, suggestions = await self.generate_sql_with_suggestions(query)
+            return sql, resolved(suggestions)
+        
+        self._record_llm_call(True)
+        if exhausted:
+            _, _, suggestions = self._extract_sql_pair(buffer)
+            await self._cache_sql_result(query, schema_version, sql, suggestions)
+            return sql, resolved(suggestions)
+        
+        elapsed_time = time.perf_counter() - start_time
+        logger.info("流式SQL生成耗时: %.4f秒，后续查询建议在后台继续生成", elapsed_time)
+        suggestions_task = asyncio.create_task(
+            self._finish_sql_stream(stream, buffer, query, schema_version, sql)
+        )
+        return sql, suggestions_task
+    
+    async def _finish_sql_stream(
+        self,
+        stream: AsyncGenerator[str, None],
+        buffer: str,
+        query: str,
+        schema_version: int,
+        sql: str
+    ) -> List[str]:
+        """
+        接收流式响应的剩余部分并提取后续查询建议
+        
+        Args:
+            stream: 未读完的流式响应
+            buffer: 已接收的内容
+            query: 自然语言查询
+            schema_version: 表结构版本号
+            sql: 已选定的SQL
+            
+        Returns:
+            后续查询建议列表
+        """
+        parts = [buffer]
+        loop = asyncio.get_running_loop()
+        # 剩余部分同样受单次调用超时限制，超时后只使用已接收的内容
+        deadline = loop.time() + self.config.get("llm_timeout", _DEFAULT_LLM_TIMEOUT)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    break
+                parts.append(chunk)
+        except asyncio.TimeoutError:
+            logger.warning("接收后续查询建议超时")
+        except Exception as e:
+            logger.warning(f"接收后续查询建议失败: {str(e)}")
+        finally:
+            # 任务被取消时关闭流，停止接收剩余的token
+            await stream.aclose()
+        
+        _, _, suggestions = self._extract_sql_pair("".join(parts))
+        await self._cache_sql_result(query, schema_version, sql, suggestions)
+        return suggestions
+    
+    def _select_valid_sql(self, sql_response: str) -> str:
+        """
+        从LLM响应中选出第一个通过校验的SQL(主要SQL优先)
+        
+        Args:
+            sql_response: LLM响应
+            
+        Returns:
+            有效的SQL，均无效时返回空字符串
+        """
+        main_sql, fallback_sql, _ = self._extract_sql_pair(sql_response)
+        for candidate in (main_sql, fallback_sql):
+            if candidate:
+                is_valid, error_msg = self.validate_sql_query(candidate)
+                if is_valid:
+                    return candidate
+                logger.warning(f"SQL无效: {error_msg}")
+        return ""
+    
+    async def _generate_sql_attempt(self, prompt: str) -> Optional[Tuple[str, List[str], str]]:
+        """
+        调用一次LLM生成SQL并校验
+        
+        Args:
+            prompt: SQL生成提示词
+            
+        Returns:
+            (SQL, 建议列表, SQL类型)元组，响应为空或SQL均无效时返回None
+        """
+        # 适配器调用卡住时由超时结束本次尝试，不占用后续重试的时间
+        sql_response = await asyncio.wait_for(
+            self.llm_adapter.generate(
+                prompt=prompt,
+                max_tokens=2000  # 增加token上限，因为现在需要生成SQL和建议
+            ),
+            timeout=self.config.get("llm_timeout", _DEFAULT_LLM_TIMEOUT)
+        )
+        
+        # 检查响应是否为空
+        if sql_response is None or not isinstance(sql_response, str) or sql_response.strip() == "":
+            logger.warning("LLM返回了空响应或无效响应")
+            return None
+        
+        if sql_response.startswith(_LLM_FATAL_PREFIXES):
+            raise ValueError(sql_response)
+        # 适配器把超时等异常转成了提示文本，按上游失败处理以便退避重试
+        if sql_response.startswith(_LLM_ERROR_PREFIXES):
+            raise RuntimeError(sql_response)
+            
+        logger.debug("LLM原始响应: %s", sql_response)
+        
+        # 从响应中提取主要SQL、备用SQL和建议
+        main_sql, fallback_sql, suggestions = self._extract_sql_pair(sql_response)
+        
+        logger.debug("提取的主要SQL: %s", main_sql)
+        logger.debug("提取的备用SQL: %s", fallback_sql)
+        logger.debug("提取的后续查询建议: %s", suggestions)
+        
+        # 尝试使用主要SQL
+        if main_sql:
+            is_valid, error_msg = self.validate_sql_query(main_sql)
+            if is_valid:
+                return main_sql, suggestions, "主要SQL"
+            logger.warning(f"主要SQL无效: {error_msg}")
+        
+        # 尝试使用备用SQL
+        if fallback_sql:
+            is_valid, error_msg = self.validate_sql_query(fallback_sql)
+            if is_valid:
+                return fallback_sql, suggestions, "备用SQL"
+            logger.warning(f"备用SQL也无效: {error_msg}")
+        
+        # 如果提取失败或SQL都无效
+        logger.warning("无法从LLM响应中提取有效SQL")
+        return None
 
     async def generate_sql(self, query: str) -> str:
         """
@@ -968,95 +2124,11 @@ class NL2SQLChain:
         suggestions = []
         
         try:
-            # 使用正则表达式提取SQL代码块
-            # 标记模式
-            main_pattern = r'--\s*主要SQL\s*\n([\s\S]*?)(?=--\s*备用SQL|\Z)'
-            fallback_pattern = r'--\s*备用SQL\s*\n([\s\S]*?)(?=--\s*后续查询建议|\Z)'
-            suggestions_pattern = r'--\s*后续查询建议\s*\n([\s\S]*?)(?=```|\Z)'
-            
-            # 旧格式: 寻找"主要SQL"和"备用SQL"的模式
-            old_main_pattern = r'主要SQL[：:]\s*```sql\s*(.*?)\s*```'
-            old_fallback_pattern = r'备用SQL[：:]\s*```sql\s*(.*?)\s*```'
-            
-            # 通用代码块模式（以防其他格式不匹配）
-            generic_pattern = r'```sql\s*([\s\S]*?)\s*```'
-            
-            # 1. 首先尝试匹配新格式
-            # 找到SQL代码块
-            code_blocks = re.findall(r'```sql\s*([\s\S]*?)\s*```', sql_response, re.DOTALL)
-            if code_blocks:
-                # 在代码块内查找标记的SQL
-                for block in code_blocks:
-                    main_match = re.search(main_pattern, block, re.DOTALL)
-                    fallback_match = re.search(fallback_pattern, block, re.DOTALL)
-                    suggestions_match = re.search(suggestions_pattern, block, re.DOTALL)
-                    
-                    if main_match:
-                        main_sql = main_match.group(1).strip()
-                    if fallback_match:
-                        fallback_sql = fallback_match.group(1).strip()
-                    if suggestions_match:
-                        suggestions_text = suggestions_match.group(1).strip()
-                        # 提取每行建议
-                        for line in suggestions_text.split('\n'):
-                            # 去除序号和前导空白
-                            clean_line = re.sub(r'^\d+\.?\s*', '', line.strip())
-                            if clean_line and (clean_line.endswith('?') or clean_line.endswith('？')):
-                                suggestions.append(clean_line)
-                    
-                    # 如果在一个代码块中找到了所有内容，就不再继续查找
-                    if main_sql and fallback_sql and suggestions:
-                        break
-            
-            # 2. 如果新格式未匹配成功，尝试直接在整个响应中查找
-            if not main_sql or not fallback_sql:
-                main_match = re.search(main_pattern, sql_response, re.DOTALL)
-                fallback_match = re.search(fallback_pattern, sql_response, re.DOTALL)
-                
-                if main_match:
-                    main_sql = main_match.group(1).strip() 
-                if fallback_match:
-                    fallback_sql = fallback_match.group(1).strip()
-            
-            # 尝试在整个响应中查找建议
-            if not suggestions:
-                suggestions_match = re.search(suggestions_pattern, sql_response, re.DOTALL)
-                if suggestions_match:
-                    suggestions_text = suggestions_match.group(1).strip()
-                    # 提取每行建议
-                    for line in suggestions_text.split('\n'):
-                        # 去除序号和前导空白
-                        clean_line = re.sub(r'^\d+\.?\s*', '', line.strip())
-                        if clean_line and (clean_line.endswith('?') or clean_line.endswith('？')):
-                            suggestions.append(clean_line)
-                
-                # 也可以尝试从代码块外部提取建议
-                if not suggestions:
-                    outside_suggestions = re.findall(r'\d+\.\s*(.*?[?？])', sql_response, re.DOTALL)
-                    for suggestion in outside_suggestions:
-                        if suggestion.strip():
-                            suggestions.append(suggestion.strip())
-                
-            # 3. 如果新格式未匹配成功，尝试旧格式
-            if not main_sql or not fallback_sql:
-                # 尝试匹配旧格式
-                old_main_match = re.search(old_main_pattern, sql_response, re.DOTALL)
-                old_fallback_match = re.search(old_fallback_pattern, sql_response, re.DOTALL)
-                
-                if old_main_match and not main_sql:
-                    main_sql = old_main_match.group(1).strip()
-                if old_fallback_match and not fallback_sql:
-                    fallback_sql = old_fallback_match.group(1).strip()
-                    
-            # 4. 如果都未匹配成功，尝试从通用代码块中提取
-            if not main_sql and not fallback_sql:
-                generic_matches = re.findall(generic_pattern, sql_response, re.DOTALL)
-                if generic_matches:
-                    # 使用第一个代码块作为主要SQL
-                    main_sql = generic_matches[0].strip()
-                    # 如果有第二个代码块，使用它作为备用SQL
-                    if len(generic_matches) > 1:
-                        fallback_sql = generic_matches[1].strip()
+            # 格式规范的响应直接按标记切片，否则逐行扫描
+            parsed = _parse_marked_block(sql_response)
+            if parsed is None:
+                parsed = _scan_sql_sections(sql_response)
+            main_sql, fallback_sql, suggestions = parsed
             
             # 如果没有找到足够的建议，使用默认建议
             if len(suggestions) < 3:
@@ -1074,6 +2146,45 @@ class NL2SQLChain:
             logger.error(f"提取SQL和建议失败: {str(e)}")
             return main_sql, fallback_sql, []
     
+    async def generate_post_query_artifacts(
+        self,
+        query: str,
+        sql: str,
+        results: List[Dict],
+        need_visualization: bool = True
+    ) -> Tuple[str, Optional[Dict]]:
+        """
+        并发生成查询结果解释和可视化配置
+
+        两者互不依赖，各自等待LLM响应，并发执行可将查询后阶段的耗时从两次LLM调用之和降为其中较慢的一次。
+        后续查询建议已随SQL一同生成，这里不再重复调用。
+
+        Args:
+            query: 原始自然语言查询
+            sql: 执行的SQL查询
+            results: 查询结果
+            need_visualization: 是否需要可视化配置
+
+        Returns:
+            (解释文本, 可视化配置)，不需要可视化或结果为空时配置为None
+        """
+        if not (need_visualization and results):
+            return await self.explain_results(query, sql, results), None
+
+        explanation, visualization_config = await asyncio.gather(
+            self.explain_results(query, sql, results),
+            self.generate_visualization_config(query, sql, results),
+            return_exceptions=True
+        )
+        # 任一环节失败时使用本地生成的结果，不影响另一环节
+        if isinstance(explanation, BaseException):
+            logger.error(f"生成查询解释失败: {str(explanation)}")
+            explanation = self._generate_default_explanation(query, results)
+        if isinstance(visualization_config, BaseException):
+            logger.error(f"生成可视化配置失败: {str(visualization_config)}")
+            visualization_config = self._infer_visualization_config(query, results)
+        return explanation, visualization_config
+
     async def explain_results(self, query: str, sql: str, results: List[Dict]) -> str:
         """
         解释查询结果
@@ -1112,15 +2223,20 @@ class NL2SQLChain:
                     return self._generate_default_explanation(query, results)
             
             # 生成示例数据
-            sample_data = json.dumps(results[:5], ensure_ascii=False, indent=2)
+            sample_data = _dumps_sample(results[:5])
             
             # 构建提示词
-            prompt = SQL_EXPLANATION_PROMPT.format(
+            prompt = _SQL_EXPLANATION_TMPL.render(
                 query=query,
                 sql=sql,
                 results=sample_data
             )
             
+            cached = await self._explanation_cache.get(prompt)
+            if cached is not None:
+                logger.info("查询解释命中缓存")
+                return cached
+            
             # 调用LLM生成解释
             try:
                 logger.info("开始生成查询解释...")
@@ -1132,14 +2248,15 @@ class NL2SQLChain:
                 )
                 
                 elapsed = time.perf_counter() - start_time
-                logger.info(f"查询解释生成完成，耗时: {elapsed:.2f}秒")
+                logger.info("查询解释生成完成，耗时: %.2f秒", elapsed)
                 
                 # 检查响应是否为空
                 if explanation is None or not isinstance(explanation, str) or explanation.strip() == "":
                     logger.warning("LLM返回了空响应或无效响应，无法生成解释")
                     return self._generate_default_explanation(query, results)
                     
-                logger.debug(f"LLM解释原始响应: {explanation[:500]}...")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("LLM解释原始响应: %s...", explanation[:500])
             except Exception as e:
                 logger.error(f"LLM解释生成失败: {str(e)}")
                 return self._generate_default_explanation(query, results)
@@ -1148,6 +2265,9 @@ class NL2SQLChain:
             if not explanation or explanation.strip() == "":
                 return self._generate_default_explanation(query, results)
             
+            # 适配器返回的错误提示不缓存
+            if not explanation.startswith(_LLM_ERROR_PREFIXES):
+                await self._explanation_cache.put(prompt, explanation)
             return explanation
             
         except Exception as e:
@@ -1170,9 +2290,7 @@ class NL2SQLChain:
             return "查询未返回任何结果。这可能是因为数据库中没有符合条件的数据，或者查询条件过于严格。"
         
         # 如果是聚合查询结果(单行带聚合值的结果)
-        if len(results) == 1 and any(k.lower().startswith(('sum_', 'avg_', 'count_', 'max_', 'min_')) or 
-                                    k.lower() in ('total', 'average', 'count', 'minimum', 'maximum', 'monthly_sales') 
-                                    for k in results[0].keys()):
+        if len(results) == 1 and any(_is_aggregate_column(k) for k in results[0]):
             agg_values = []
             for k, v in results[0].items():
                 agg_values.append(f"{k}: {v}")
@@ -1215,6 +2333,12 @@ class NL2SQLChain:
                 logger.warning("LLM适配器不可用，使用智能推断可视化配置")
                 return self._infer_visualization_config(query, results)
             
+            # 结果形状足以确定图表类型时，直接使用推断的配置，省去一次LLM调用
+            inferred, confidence = self._infer_visualization(query, results)
+            if confidence >= self.config.get("viz_skip_llm_confidence", 0.9):
+                logger.info("根据结果形状推断可视化配置: %s，置信度%s", inferred['chart_type'], confidence)
+                return inferred
+            
             # 提取结果模式
             schema = []
             if results and isinstance(results[0], dict):
@@ -1223,15 +2347,22 @@ class NL2SQLChain:
                     
             schema_str = ", ".join(schema)
             
+            # 相同查询、相同SQL和结果列的可视化配置直接复用；标题和描述依赖查询，查询必须计入缓存键
+            cache_key = f"{query}\n{sql}\n{schema_str}"
+            cached = await self._visualization_cache.get(cache_key)
+            if cached is not None:
+                logger.info("可视化配置命中缓存")
+                return dict(cached)
+            
             # 生成示例数据
-            sample_data = json.dumps(results[:3], ensure_ascii=False, indent=2)
+            sample_data = _dumps_sample(results[:3])
             
             # 构建提示词
-            prompt = VISUALIZATION_PROMPT.format(
+            prompt = _VISUALIZATION_TMPL.render(
                 query=query,
                 sql=sql,
-                columns=schema_str,
-                results_sample=sample_data
+                schema=schema_str,
+                sample_data=sample_data
             )
             
             # 调用LLM生成可视化配置
@@ -1245,14 +2376,15 @@ class NL2SQLChain:
                 )
                 
                 elapsed = time.perf_counter() - start_time
-                logger.info(f"可视化配置生成完成，耗时: {elapsed:.2f}秒")
+                logger.info("可视化配置生成完成，耗时: %.2f秒", elapsed)
                 
                 # 检查响应是否为空
                 if config_str is None or not isinstance(config_str, str) or config_str.strip() == "":
                     logger.warning("LLM返回了空响应或无效响应，无法生成可视化配置")
                     return self._infer_visualization_config(query, results)
                     
-                logger.debug(f"LLM可视化配置原始响应: {config_str[:300]}...")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("LLM可视化配置原始响应: %s...", config_str[:300])
             except Exception as e:
                 logger.error(f"LLM可视化配置生成失败: {str(e)}")
                 return self._infer_visualization_config(query, results)
@@ -1263,14 +2395,16 @@ class NL2SQLChain:
             # 如果解析失败，尝试智能推断配置
             if not config_json:
                 logger.warning("无法提取有效的JSON配置，将智能推断配置")
-                config_json = self._infer_visualization_config(query, results)
+                return self._infer_visualization_config(query, results)
                 
             # 加入默认值
             if "chart_type" not in config_json:
                 config_json["chart_type"] = "table"
             if "title" not in config_json:
                 config_json["title"] = "查询结果可视化"
-                
+            
+            # 只缓存LLM生成的配置
+            await self._visualization_cache.put(cache_key, dict(config_json))
             return config_json
                 
         except Exception as e:
@@ -1290,28 +2424,21 @@ class NL2SQLChain:
         """
         if not text:
             return {}
-            
-        # 尝试直接解析整个字符串
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            pass
-            
-        # 尝试使用正则表达式提取JSON对象
-        try:
-            json_match = re.search(r'(\{.*\})', text, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group(1))
-        except (json.JSONDecodeError, re.error):
-            pass
-            
-        # 尝试匹配带有```json标记的代码块
-        try:
-            json_block_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', text, re.DOTALL)
-            if json_block_match:
-                return json.loads(json_block_match.group(1))
-        except (json.JSONDecodeError, re.error):
-            pass
+        
+        # 从第一个左花括号起扫描出完整的对象再解析，前后的说明文字和```json围栏自然被跳过；
+        # 解析失败时从下一个左花括号继续
+        start = text.find("{")
+        while start != -1:
+            end = _find_json_object(text, start)
+            if end == -1:
+                break
+            try:
+                value = orjson.loads(text[start:end])
+                if isinstance(value, dict):
+                    return value
+            except orjson.JSONDecodeError:
+                pass
+            start = text.find("{", start + 1)
             
         # 所有尝试都失败，返回空字典
         return {}
@@ -1327,6 +2454,22 @@ class NL2SQLChain:
         Returns:
             推断的可视化配置
         """
+        return self._infer_visualization(query, results)[0]
+    
+    def _infer_visualization(self, query: str, results: List[Dict]) -> Tuple[Dict[str, Any], float]:
+        """
+        根据结果形状推断可视化配置，并给出推断的置信度
+        
+        单行指标卡片置信度为1.0；类型清晰的折线图、饼图、柱状图为0.9；
+        类型不够清晰的图表为0.7；只能使用表格时为0.5；无法识别结果格式时为0.0
+        
+        Args:
+            query: 查询文本
+            results: 查询结果
+            
+        Returns:
+            (可视化配置, 置信度)元组
+        """
         # 默认配置
         config = {
             "chart_type": "table",
@@ -1336,7 +2479,7 @@ class NL2SQLChain:
         
         # 如果结果为空，返回默认配置
         if not results:
-            return config
+            return config, 0.5
             
         # 检查results是否为嵌套列表
         if isinstance(results, list) and len(results) > 0 and isinstance(results[0], list):
@@ -1347,14 +2490,14 @@ class NL2SQLChain:
         # 检查结果第一项是否为字典类型
         if not results or not isinstance(results[0], dict):
             logger.warning(f"无法识别的结果格式: {type(results)} / {type(results[0] if results else None)}")
-            return config
+            return config, 0.0
             
         # 获取所有列名
         try:
             columns = list(results[0].keys())
         except (AttributeError, TypeError, IndexError) as e:
             logger.error(f"提取列名时出错: {str(e)}")
-            return config
+            return config, 0.0
         
         # 聚合查询结果，通常是单行的汇总数据
         if len(results) == 1 and len(columns) <= 3:
@@ -1370,72 +2513,68 @@ class NL2SQLChain:
                 }
                 config["metrics"].append(metric)
                 
-            return config
+            return config, 1.0
+        
+        # 抽样前5行，一次性判定各列的数值情况，供下面各类图表的判断共用：
+        # 首行是否为数值、抽样中是否出现过数值、抽样中的非空值是否全为数值
+        sample = results[:5]
+        first_numeric: Dict[str, bool] = {}
+        any_numeric: Dict[str, bool] = {}
+        all_numeric: Dict[str, bool] = {}
+        for col in columns:
+            flags = [_is_numeric_value(row[col]) for row in sample if row.get(col) is not None]
+            first_numeric[col] = _is_numeric_value(results[0][col])
+            any_numeric[col] = any(flags)
+            all_numeric[col] = all(flags)
             
         # 检查是否有日期/时间列，适合用折线图
         date_cols = [col for col in columns if any(term in col.lower() for term in ["date", "time", "year", "month", "day"])]
         if date_cols and len(results) > 1:
             # 找到可能的数值列
-            num_cols = []
-            for row in results[:5]:  # 检查前5行就足够了
-                for col in columns:
-                    if col not in date_cols:
-                        try:
-                            val = row[col]
-                            if isinstance(val, (int, float)) or (isinstance(val, str) and val.replace('.', '', 1).isdigit()):
-                                num_cols.append(col)
-                        except (ValueError, TypeError, KeyError):
-                            pass
+            num_cols = [col for col in columns if col not in date_cols and any_numeric[col]]
             
             # 如果有日期列和数值列，使用折线图
-            if date_cols and num_cols:
+            if num_cols:
                 config["chart_type"] = "line"
                 config["title"] = f"{query}趋势"
                 config["x_axis"] = date_cols[0]  # 使用第一个日期列作为X轴
-                config["y_axis"] = list(set(num_cols))[:3]  # 最多使用3个数值列作为Y轴
-                return config
+                config["y_axis"] = num_cols[:3]  # 最多使用3个数值列作为Y轴
+                return config, 0.9
                 
         # 检查是否适合饼图（通常是分类统计）
         if len(results) <= 10 and len(columns) == 2:
             # 一列可能是分类，一列可能是数值
-            if any(isinstance(results[0][col], (int, float)) or 
-                   (isinstance(results[0][col], str) and results[0][col].replace('.', '', 1).isdigit()) 
-                   for col in columns):
+            if first_numeric[columns[0]] or first_numeric[columns[1]]:
                 config["chart_type"] = "pie"
                 config["title"] = f"{query}分布"
                 # 识别分类列和数值列
                 cat_col = columns[0]
                 val_col = columns[1]
-                if isinstance(results[0][columns[0]], (int, float)) or (isinstance(results[0][columns[0]], str) and results[0][columns[0]].replace('.', '', 1).isdigit()):
+                if first_numeric[columns[0]]:
                     cat_col = columns[1]
                     val_col = columns[0]
                 config["category"] = cat_col
                 config["value"] = val_col
-                return config
+                # 恰好一列数值、一列分类时类型清晰
+                clean = first_numeric[cat_col] != first_numeric[val_col]
+                return config, 0.9 if clean else 0.7
                 
         # 检查是否适合柱状图（分类比较）
         if len(results) <= 20 and len(columns) >= 2:
             # 至少有一个可能是分类列，一个是数值列
-            potential_cat_cols = []
-            potential_num_cols = []
-            
-            for col in columns:
-                # 抽样检查值类型
-                values = [row[col] for row in results[:5] if col in row]
-                if all(isinstance(v, (int, float)) or (isinstance(v, str) and v.replace('.', '', 1).isdigit()) for v in values if v is not None):
-                    potential_num_cols.append(col)
-                else:
-                    potential_cat_cols.append(col)
+            potential_cat_cols = [col for col in columns if not all_numeric[col]]
+            potential_num_cols = [col for col in columns if all_numeric[col]]
                     
             if potential_cat_cols and potential_num_cols:
                 config["chart_type"] = "bar"
                 config["title"] = f"{query}对比"
                 config["x_axis"] = potential_cat_cols[0]  # 使用第一个分类列作为X轴
                 config["y_axis"] = potential_num_cols[0]  # 使用第一个数值列作为Y轴
-                return config
+                # 只有一个分类列时X轴没有歧义
+                return config, 0.9 if len(potential_cat_cols) == 1 else 0.7
                 
         # 默认使用表格
-        return config
+        return config, 0.5
     
     async def suggest_queries(self, query: str, sql: str, summary: str) -> List[str]:
         """
@@ -1468,7 +2607,7 @@ class NL2SQLChain:
             return ""
             
         # 删除"```sql"和"```"标记
-        sql_text = re.sub(r'```sql|```', '', sql_text)
+        sql_text = _SQL_FENCE_PAT.sub('', sql_text)
         
         # 删除前导和尾随空白
         sql_text = sql_text.strip()
@@ -1494,72 +2633,67 @@ class NL2SQLChain:
         Returns:
             安全的SQL
         """
-        # 转换为大写以进行检查
-        sql_upper = sql.upper()
-        
-        # 从配置中获取危险关键字列表，若无配置则使用默认值
-        dangerous_keywords = settings.SQL_DANGEROUS_KEYWORDS if hasattr(settings, "SQL_DANGEROUS_KEYWORDS") else ["INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE", "TRUNCATE"]
+        logger.debug("检查SQL安全性: %s", sql)
         
-        # 定义SQL语句中的子句类型
-        sql_clauses = ["SELECT", "FROM", "WHERE", "GROUP BY", "HAVING", "ORDER BY", "LIMIT", "JOIN", "UNION", "WITH"]
+        # 检查是否包含非允许的操作：字符串、注释中的关键字以及作为标识符一部分的关键字不算
+        keyword = _find_dangerous_keyword(sql, self._dangerous_keywords)
+        if keyword is not None:
+            logger.warning(f"SQL包含危险关键字: {keyword}")
+            raise ValueError(f"不允许执行包含{keyword}的SQL")
+            
+        # 限制最外层查询的返回行数，让数据库只返回需要的行
+        sql = self._apply_row_limit(sql, self._auto_limit)
+                
+        logger.debug("SQL安全检查通过: %s", sql)
+        return sql
+    
+    def _apply_row_limit(self, sql: str, limit_value: int) -> str:
+        """
+        确保最外层查询带有不超过上限的LIMIT
         
-        # 添加详细的调试日志
-        logger.debug(f"检查SQL安全性: {sql}")
-        logger.debug(f"配置的危险关键字: {dangerous_keywords}")
+        根据语法树判断最外层查询的LIMIT，子查询中的LIMIT不影响判断
         
-        # 检查是否包含非允许的操作
-        for keyword in dangerous_keywords:
-            # 先检查关键字是否作为独立命令存在
-            pattern = r'\b' + re.escape(keyword) + r'\b'
-            matches = re.finditer(pattern, sql_upper)
+        Args:
+            sql: SQL查询
+            limit_value: 返回行数上限
             
-            for match in matches:
-                start_pos = match.start()
-                
-                # 检查该关键字是否在安全上下文中（作为列名、表名或子查询一部分）
-                is_safe = False
-                
-                # 检查前面是否有安全子句
-                for clause in sql_clauses:
-                    clause_pos = sql_upper.rfind(clause, 0, start_pos)
-                    if clause_pos != -1 and clause_pos < start_pos:
-                        # 找到子句和关键字之间的文本
-                        context_text = sql_upper[clause_pos:start_pos]
-                        # 如果子句和关键字之间没有分号，认为是安全的
-                        if ";" not in context_text:
-                            is_safe = True
-                            logger.debug(f"关键字 {keyword} 在安全上下文中: {clause} ... {keyword}")
-                            break
-                
-                # 检查是否在引号内（列名或字符串值）
-                if not is_safe:
-                    # 计算到该位置的引号数量
-                    quotes_before = sql[:start_pos].count('"') + sql[:start_pos].count("'")
-                    if quotes_before % 2 == 1:  # 奇数表示在引号内
-                        is_safe = True
-                        logger.debug(f"关键字 {keyword} 在引号内，被视为安全")
-                
-                # 检查是否作为标识符部分（如列名带下划线）
-                if not is_safe:
-                    # 检查前一个字符是否是标识符的一部分
-                    if start_pos > 0 and sql[start_pos-1].isalnum() or sql[start_pos-1] == '_':
-                        is_safe = True
-                        logger.debug(f"关键字 {keyword} 是标识符的一部分，被视为安全")
-                
-                # 如果不是安全上下文中的关键字，则拒绝查询
-                if not is_safe:
-                    logger.warning(f"SQL包含危险关键字: {keyword} 在位置 {start_pos}")
-                    raise ValueError(f"不允许执行包含{keyword}的SQL（不在安全上下文中）")
-            
-        # 如果没有LIMIT，添加LIMIT 100
-        if "LIMIT" not in sql_upper:
-            limit_value = settings.SQL_AUTO_LIMIT if hasattr(settings, "SQL_AUTO_LIMIT") else 100
-            if ";" in sql:
-                sql = sql.replace(";", f" LIMIT {limit_value};")
-            else:
-                sql = f"{sql} LIMIT {limit_value}"
-                
-        logger.debug(f"SQL安全检查通过: {sql}")
+        Returns:
+            带LIMIT的SQL
+            
+        Raises:
+            ValueError: SQL包含多条语句
+        """
+        dialect = self._engine_sql_dialect()
+        try:
+            statements = [stmt for stmt in sqlglot.parse(sql, read=dialect) if stmt is not None]
+        except sqlglot.errors.ParseError:
+            statements = None
+        
+        if not statements:
+            # 无法解析时沿用关键字判断
+            if "LIMIT" in sql.upper():
+                return sql
+            # 换行后追加，避免LIMIT落入末尾的单行注释
+            return f"{sql.strip().rstrip(';')}\nLIMIT {limit_value}"
+        
+        expression = statements[0]
+        block_type = getattr(exp, "Block", None)
+        if len(statements) > 1 or (block_type is not None and isinstance(expression, block_type)):
+            raise ValueError("不允许执行多条SQL语句")
+        
+        if not callable(getattr(expression, "limit", None)):
+            # 非查询语句(如SHOW)不支持LIMIT
+            return sql
+        
+        limit_node = expression.args.get("limit")
+        if limit_node is None:
+            # 最外层没有LIMIT，通过语法树追加(注释会被转为块注释)
+            return expression.limit(limit_value).sql(dialect=dialect)
+        
+        limit_expr = limit_node.expression
+        if isinstance(limit_expr, exp.Literal) and limit_expr.is_int and int(limit_expr.name) > limit_value:
+            # LIMIT超过上限时改写为上限
+            return expression.limit(limit_value).sql(dialect=dialect)
         return sql
     
     def _format_results(self, results: List[Dict]) -> List[Dict]:
@@ -1572,24 +2706,28 @@ class NL2SQLChain:
         Returns:
             格式化后的结果
         """
-        formatted_results = []
+        if not results:
+            return results
+        
+        # 同一列的值类型一致，按首行确定需要逐值检查的列：首行为非原生类型(日期时间、Decimal等)
+        # 或为NULL(无法判断类型)的列；其余列直接沿用原值
+        native = _JSON_NATIVE_TYPES
+        check_columns = [
+            key for key, value in results[0].items()
+            if value is None or type(value) not in native
+        ]
+        if not check_columns:
+            return results
         
+        formatted = []
         for row in results:
-            formatted_row = {}
-            
-            for key, value in row.items():
-                # 处理日期时间
-                if isinstance(value, (datetime, timedelta)):
-                    formatted_row[key] = str(value)
-                # 处理其他不可JSON序列化的类型
-                elif value is not None and not isinstance(value, (str, int, float, bool, list, dict)):
-                    formatted_row[key] = str(value)
-                else:
-                    formatted_row[key] = value
-                    
-            formatted_results.append(formatted_row)
-            
-        return formatted_results
+            new_row = dict(row)
+            for key in check_columns:
+                value = new_row.get(key)
+                if type(value) not in native:
+                    new_row[key] = _to_json_safe(value)
+            formatted.append(new_row)
+        return formatted
     
     async def _fallback_sql_generation(self, query: str) -> Tuple[str, List[str]]:
         """
@@ -1618,16 +2756,11 @@ class NL2SQLChain:
         Returns:
             默认建议列表
         """
-        default_suggestions = [
-            "过去30天销量最高的产品是什么?",
-            "哪些客户在过去一年中贡献了最多的收入?",
-            "各产品类别的平均利润率是多少?",
-            "退货率最高的产品有哪些共同特征?",
-            "销售趋势如何随季节变化?"
-        ]
-        
-        # 确保建议与当前查询不同
-        return [s for s in default_suggestions if s.lower() != query.lower()][:3]
+        # 确保建议与当前查询不同：绝大多数查询不会与默认建议相同，直接返回前3个
+        query_lower = query.lower()
+        if query_lower not in _DEFAULT_SUGGESTIONS_LOWER:
+            return list(_DEFAULT_SUGGESTIONS[:3])
+        return [s for s, s_lower in zip(_DEFAULT_SUGGESTIONS, _DEFAULT_SUGGESTIONS_LOWER) if s_lower != query_lower][:3]
     
     async def explain_results_stream(self, query: str, sql: str, results: List[Dict]) -> AsyncGenerator[str, None]:
         """
@@ -1641,14 +2774,14 @@ class NL2SQLChain:
         Yields:
             生成的解释文本块
         """
-        logger.info(f"开始流式生成查询解释...")
+        logger.info("开始流式生成查询解释...")
         
         # 准备给LLM的上下文
         result_str = ""
         if results and len(results) > 0:
             result_samples = results[:10]  # 限制样本数量
             if isinstance(result_samples[0], dict):
-                result_str = "\n".join([json.dumps(row, ensure_ascii=False, default=str) for row in result_samples])
+                result_str = _dumps_rows_lines(result_samples)
                 if len(results) > 10:
                     result_str += f"\n... 共{len(results)}条结果"
             else:
@@ -1675,33 +2808,68 @@ class NL2SQLChain:
 - 重点突出关键数据和洞察
 """
         
-        logger.info(f"流式解释查询提示构建完成，长度: {len(prompt)}")
+        logger.info("流式解释查询提示构建完成，长度: %s", len(prompt))
         
         # 使用LLM生成解释 - 流式模式
-        logger.info(f"开始流式生成解释...")
+        logger.info("开始流式生成解释...")
         
         try:
             # 确保我们的适配器支持流式输出
             if hasattr(self.llm_adapter, "generate_stream"):
+                # 相邻token合并到约_STREAM_CHUNK_CHARS个字符或换行处再输出，减少下游每块的处理开销
+                buffer: List[str] = []
+                size = 0
                 async for token in self.llm_adapter.generate_stream(prompt):
-                    yield token
+                    buffer.append(token)
+                    size += len(token)
+                    if size >= _STREAM_CHUNK_CHARS or token.endswith("\n"):
+                        yield "".join(buffer)
+                        buffer.clear()
+                        size = 0
+                if buffer:
+                    yield "".join(buffer)
             else:
                 # 如果不支持流式输出，使用模拟的流式输出
                 full_response = await self.llm_adapter.generate(prompt)
                 
-                # 模拟流式输出 (单词级别)
-                words = full_response.split(' ')
-                for word in words:
-                    yield word + ' '
-                    await asyncio.sleep(0.05)  # 模拟延迟
+                # 模拟流式输出 (句子级别)，默认不加人为延迟
+                chunk_delay = self.config.get("fake_stream_delay", 0.0)
+                for chunk in _SENTENCE_END_PAT.split(full_response):
+                    if not chunk:
+                        continue
+                    yield chunk
+                    if chunk_delay:
+                        await asyncio.sleep(chunk_delay)
                 
-            logger.info(f"流式解释生成完成")
+            logger.info("流式解释生成完成")
             
         except Exception as e:
             logger.error(f"解释生成失败: {str(e)}")
             raise
 
 
+_chain_lock = threading.Lock()
+
+
+@lru_cache(maxsize=8)
+def _get_chain(
+    include_tables: Optional[Tuple[str, ...]],
+    exclude_tables: Optional[Tuple[str, ...]],
+    config: Tuple[Tuple[str, Any], ...]
+) -> NL2SQLChain:
+    """按表过滤条件和链配置创建NL2SQL链，相同参数复用同一实例；创建失败或LLM不可用时抛出异常，不缓存"""
+    database_toolkit = get_database_toolkit(
+        include_tables=list(include_tables) if include_tables is not None else None,
+        exclude_tables=list(exclude_tables) if exclude_tables is not None else None
+    )
+    nl2sql_chain = NL2SQLChain(database_toolkit=database_toolkit, config=dict(config) if config else None)
+    if nl2sql_chain.llm_adapter is None:
+        # LLM适配器初始化失败的实例不缓存，下次请求时重新初始化
+        raise RuntimeError("LLM适配器不可用")
+    logger.info("成功创建NL2SQLChain，使用模型: %s", settings.DEFAULT_AI_MODEL.lower())
+    return nl2sql_chain
+
+
 def get_nl2sql_chain(
     include_tables: Optional[List[str]] = None,
     exclude_tables: Optional[List[str]] = None,
@@ -1730,22 +2898,15 @@ def get_nl2sql_chain(
     Returns:
         NL2SQLChain实例
     """
+    include_key = tuple(sorted(include_tables)) if include_tables is not None else None
+    exclude_key = tuple(sorted(exclude_tables)) if exclude_tables is not None else None
+    config_key = tuple(sorted(config.items())) if config else ()
     try:
-        # 确定使用哪个AI模型
-        model_type = settings.DEFAULT_AI_MODEL.lower()
-        
-        # 创建数据库工具包
-        database_toolkit = DatabaseToolkit(include_tables=include_tables, exclude_tables=exclude_tables)
-        
-        # 创建NL2SQL链实例
-        nl2sql_chain = NL2SQLChain(database_toolkit=database_toolkit, config=config)
-        
-        # 日志记录
-        logger.info(f"成功创建NL2SQLChain，使用模型: {model_type}")
-        
-        return nl2sql_chain
+        # 相同表过滤条件和配置的请求复用同一链实例及其LLM适配器和各级缓存
+        with _chain_lock:
+            return _get_chain(include_key, exclude_key, config_key)
     except Exception as e:
         logger.error(f"创建NL2SQLChain失败: {str(e)}")
         # 返回一个基本的NL2SQL链实例，没有LLM支持
-        database_toolkit = DatabaseToolkit(include_tables=include_tables, exclude_tables=exclude_tables)
+        database_toolkit = get_database_toolkit(include_tables=include_tables, exclude_tables=exclude_tables)
         return NL2SQLChain(database_toolkit=database_toolkit, config=config)
\ No newline at end of file
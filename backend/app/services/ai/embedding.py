@@ -3,17 +3,35 @@
 提供文本嵌入服务，支持不同的嵌入模型提供商。
 """
 
+import asyncio
+import hashlib
 import json
 import logging
-import os
+import time
 from abc import ABC, abstractmethod
-from typing import List, Union, Optional, Dict, Any
+from collections import OrderedDict
+from typing import List, Union, Optional, Dict, Any, Tuple
 
-import requests
+import httpx
 from app.core.config import settings
+from app.services.ai.http_clients import get_async_client
 
 logger = logging.getLogger(__name__)
 
+# 单次嵌入请求包含的最大文本数
+_EMBEDDING_MAX_BATCH = 32
+# 单次get_embeddings调用中同时进行的嵌入请求上限
+_EMBEDDING_CONCURRENCY = 8
+# 嵌入向量缓存的最大条目数和有效期(秒)
+_EMBEDDING_CACHE_SIZE = 10000
+_EMBEDDING_CACHE_TTL = 86400
+
+# 按内容寻址的嵌入向量缓存：blake2b(模型, 文本) -> (过期时间, 向量)
+# 放在模块级，get_embedding_service()每次创建的新实例之间共享
+_embedding_cache: "OrderedDict[bytes, Tuple[float, List[float]]]" = OrderedDict()
+# 缓存命中/未命中的文本数
+_cache_counters = {"hits": 0, "misses": 0}
+
 
 class EmbeddingService(ABC):
     """嵌入服务基类"""
@@ -77,75 +95,173 @@ class SiliconFlowEmbeddingService(EmbeddingService):
         if not texts:
             return []
         
+        # 先查缓存，只为未命中的文本(同一调用中重复的文本只请求一次)请求嵌入服务
+        now = time.monotonic()
+        keys = [self._cache_key(text) for text in texts]
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[bytes, List[int]] = {}
+        for i, key in enumerate(keys):
+            entry = _embedding_cache.get(key)
+            if entry is not None and entry[0] > now:
+                _embedding_cache.move_to_end(key)
+                embeddings[i] = entry[1]
+            else:
+                missing.setdefault(key, []).append(i)
+        _cache_counters["hits"] += len(texts) - sum(len(positions) for positions in missing.values())
+        _cache_counters["misses"] += len(missing)
+        if not missing:
+            return embeddings
+        
+        miss_texts = [texts[positions[0]] for positions in missing.values()]
+        fetched = await self._fetch_embeddings(miss_texts)
+        
+        expires_at = time.monotonic() + _EMBEDDING_CACHE_TTL
+        for (key, positions), embedding in zip(missing.items(), fetched):
+            for i in positions:
+                embeddings[i] = embedding
+            # 请求失败时返回的全零向量不缓存
+            if any(embedding):
+                _embedding_cache[key] = (expires_at, embedding)
+                _embedding_cache.move_to_end(key)
+                if len(_embedding_cache) > _EMBEDDING_CACHE_SIZE:
+                    _embedding_cache.popitem(last=False)
+        return embeddings
+    
+    def cache_stats(self) -> Dict[str, int]:
+        """
+        获取嵌入向量缓存的统计信息
+        
+        Returns:
+            包含缓存条目数、命中数和未命中数的字典
+        """
+        return {"size": len(_embedding_cache), **_cache_counters}
+    
+    def _cache_key(self, text: str) -> bytes:
+        """计算文本在当前模型下的缓存键"""
+        return hashlib.blake2b(f"{self.model}\0{text}".encode("utf-8"), digest_size=16).digest()
+    
+    async def _fetch_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        从嵌入服务获取文本的嵌入向量，不经过缓存
+        
+        Args:
+            texts: 要嵌入的文本列表
+            
+        Returns:
+            与输入顺序一致的嵌入向量列表
+        """
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
         
-        # 设置代理
-        proxies = self.proxy
+        # 按批次请求嵌入，各批次并发发出；批量失败后逐条请求时同样受并发上限约束，避免瞬间打满服务端限流
+        semaphore = asyncio.Semaphore(_EMBEDDING_CONCURRENCY)
+        batches = [texts[i:i + _EMBEDDING_MAX_BATCH] for i in range(0, len(texts), _EMBEDDING_MAX_BATCH)]
+        batch_embeddings = await asyncio.gather(
+            *(self._embed_batch(batch, headers, semaphore) for batch in batches)
+        )
+        return [embedding for embeddings in batch_embeddings for embedding in embeddings]
+    
+    async def _post(
+        self,
+        payload: Dict[str, Any],
+        headers: Dict[str, str],
+        semaphore: asyncio.Semaphore
+    ) -> Dict[str, Any]:
+        """
+        发送一次嵌入请求
         
-        # 如果设置了直接连接，则忽略系统代理
-        if self.use_direct_connection:
-            logger.info("使用直接连接模式，忽略系统代理")
-            proxies = {
-                "http": None,
-                "https": None
-            }
-        # 如果没有设置直接连接也没有设置自定义代理，则使用系统代理（如果有）
-        elif not proxies:
-            if os.environ.get('HTTP_PROXY') or os.environ.get('HTTPS_PROXY'):
-                logger.info("检测到系统代理设置，使用系统代理")
-                # 让requests自动使用系统代理
-                proxies = None
-            else:
-                logger.info("未检测到系统代理，使用直接连接")
-                proxies = {
-                    "http": None,
-                    "https": None
-                }
+        Args:
+            payload: 请求体
+            headers: 请求头
+            semaphore: 限制并发请求数的信号量
+            
+        Returns:
+            响应JSON
+        """
+        logger.info(f"发送嵌入请求至 {self.api_base}, 模型: {self.model}")
+        
+        client = get_async_client(self.use_direct_connection, self.proxy)
+        async with semaphore:
+            response = await client.post(self.api_base, headers=headers, json=payload)
+        response.raise_for_status()
+        return response.json()
+    
+    async def _embed_batch(
+        self,
+        texts: List[str],
+        headers: Dict[str, str],
+        semaphore: asyncio.Semaphore
+    ) -> List[List[float]]:
+        """
+        一次请求获取一批文本的嵌入向量，服务端不支持批量输入时改为逐条并发请求
+        
+        Args:
+            texts: 文本批次
+            headers: 请求头
+            semaphore: 限制并发请求数的信号量
+            
+        Returns:
+            与输入顺序一致的嵌入向量列表
+        """
+        if len(texts) == 1:
+            return [await self._embed_one(texts[0], headers, semaphore)]
         
-        all_embeddings = []
+        payload = {
+            "model": self.model,
+            "input": texts,
+            "encoding_format": "float"
+        }
+        try:
+            result = await self._post(payload, headers, semaphore)
+            data = sorted(result["data"], key=lambda item: item.get("index", 0))
+            if len(data) != len(texts):
+                raise ValueError(f"返回{len(data)}个嵌入向量，请求了{len(texts)}个文本")
+            logger.info(f"批量嵌入请求成功，共{len(texts)}个文本")
+            return [item["embedding"] for item in data]
+        except Exception as e:
+            logger.warning(f"批量获取嵌入失败，改为逐条请求: {str(e)}")
         
-        # 每个文本单独请求嵌入
-        for text in texts:
-            try:
-                payload = {
-                    "model": self.model,
-                    "input": text,
-                    "encoding_format": "float"
-                }
-                
-                logger.info(f"发送嵌入请求至 {self.api_base}, 模型: {self.model}")
-                logger.debug(f"代理设置: {proxies}")
-                
-                response = requests.post(
-                    self.api_base,
-                    headers=headers,
-                    json=payload,
-                    proxies=proxies,
-                    timeout=30  # 超时设置
-                )
-                
-                response.raise_for_status()
-                result = response.json()
-                
-                logger.info(f"嵌入请求成功，获取到响应")
-                
-                # 提取嵌入向量
-                embedding = result["data"][0]["embedding"]
-                all_embeddings.append(embedding)
-                
-            except Exception as e:
-                logger.error(f"获取嵌入失败: {str(e)}")
-                if isinstance(e, requests.RequestException) and hasattr(e, 'response') and e.response:
-                    logger.error(f"响应状态码: {e.response.status_code}")
-                    logger.error(f"响应内容: {e.response.text}")
-                
-                # 如果失败，返回一个全零向量
-                all_embeddings.append([0.0] * self.dimension)
+        return list(await asyncio.gather(*(self._embed_one(text, headers, semaphore) for text in texts)))
+    
+    async def _embed_one(
+        self,
+        text: str,
+        headers: Dict[str, str],
+        semaphore: asyncio.Semaphore
+    ) -> List[float]:
+        """
+        获取单个文本的嵌入向量，失败时返回全零向量
         
-        return all_embeddings
+        Args:
+            text: 文本
+            headers: 请求头
+            semaphore: 限制并发请求数的信号量
+            
+        Returns:
+            嵌入向量
+        """
+        payload = {
+            "model": self.model,
+            "input": text,
+            "encoding_format": "float"
+        }
+        try:
+            result = await self._post(payload, headers, semaphore)
+            logger.info(f"嵌入请求成功，获取到响应")
+            
+            # 提取嵌入向量
+            return result["data"][0]["embedding"]
+            
+        except Exception as e:
+            logger.error(f"获取嵌入失败: {str(e)}")
+            if isinstance(e, httpx.HTTPStatusError):
+                logger.error(f"响应状态码: {e.response.status_code}")
+                logger.error(f"响应内容: {e.response.text}")
+            
+            # 如果失败，返回一个全零向量
+            return [0.0] * self.dimension
 
 
 def get_embedding_service(
@@ -0,0 +1,63 @@
+"""共享HTTP客户端模块
+
+为嵌入、重排序等服务提供按代理配置复用的httpx.AsyncClient，
+保持长连接以复用TLS会话，应用关闭时统一关闭。
+"""
+
+from typing import Dict, FrozenSet, Optional, Tuple
+
+import httpx
+
+# (是否直接连接, 自定义代理) -> 共享客户端
+_clients: Dict[Tuple[bool, FrozenSet[Tuple[str, str]]], httpx.AsyncClient] = {}
+
+# 默认超时(秒)与连接池上限
+_TIMEOUT = 30.0
+_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+
+def get_async_client(
+    use_direct_connection: bool = False,
+    proxy: Optional[Dict[str, str]] = None
+) -> httpx.AsyncClient:
+    """
+    获取与代理配置对应的共享异步HTTP客户端
+
+    代理规则与原先requests的行为一致：
+    直接连接时忽略系统代理；配置了自定义代理时按协议使用；否则使用系统代理(如有)
+
+    Args:
+        use_direct_connection: 是否使用直接连接（忽略代理）
+        proxy: 自定义代理设置，如 {"http": "http://proxy:port", "https": "https://proxy:port"}
+
+    Returns:
+        httpx.AsyncClient实例
+    """
+    proxies = {scheme: url for scheme, url in (proxy or {}).items() if url}
+    key = (use_direct_connection, frozenset(proxies.items()) if not use_direct_connection else frozenset())
+    client = _clients.get(key)
+    if client is not None and not client.is_closed:
+        return client
+
+    if use_direct_connection:
+        client = httpx.AsyncClient(timeout=_TIMEOUT, limits=_LIMITS, trust_env=False)
+    elif proxies:
+        # 传入httpx.Proxy而非字符串：httpx 0.26之前的传输层只接受Proxy对象
+        mounts = {
+            f"{scheme}://": httpx.AsyncHTTPTransport(proxy=httpx.Proxy(url), limits=_LIMITS)
+            for scheme, url in proxies.items()
+        }
+        client = httpx.AsyncClient(timeout=_TIMEOUT, limits=_LIMITS, mounts=mounts)
+    else:
+        # trust_env=True时httpx读取HTTP_PROXY/HTTPS_PROXY，未设置则直接连接
+        client = httpx.AsyncClient(timeout=_TIMEOUT, limits=_LIMITS)
+    _clients[key] = client
+    return client
+
+
+async def aclose_async_clients() -> None:
+    """关闭所有共享的异步HTTP客户端，在应用关闭时调用"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
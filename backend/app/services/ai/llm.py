@@ -4,9 +4,12 @@ LLM服务模块，提供大语言模型的API调用功能
 
 import os
 import time
+import copy
+import hashlib
 import json
 import logging
-from typing import Dict, List, Optional, Any, Union
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple, Union
 import httpx
 import requests
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
@@ -19,6 +22,38 @@ from app.core.logging import get_logger
 # 配置日志
 logger = get_logger(__name__)
 
+# 确定性生成(温度不高于该值)的响应缓存：最大条目数和有效期(秒)
+_DETERMINISTIC_TEMPERATURE = 0.01
+_RESPONSE_CACHE_SIZE = 1000
+_RESPONSE_CACHE_TTL = 3600
+
+
+def _response_cache_key(
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    messages: List[Dict[str, str]]
+) -> str:
+    """
+    计算LLM请求的缓存键
+    
+    Args:
+        model: 模型名称
+        temperature: 温度参数
+        max_tokens: 最大生成token数
+        messages: 对话消息列表
+        
+    Returns:
+        请求内容的SHA-256摘要
+    """
+    canonical = json.dumps(
+        [model, temperature, max_tokens, messages],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
 
 class LLMService:
     """大语言模型服务基类"""
@@ -41,6 +76,39 @@ class LLMService:
             生成的响应
         """
         raise NotImplementedError("子类必须实现generate方法")
+    
+    def _get_cached_response(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        查找未过期的缓存响应
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            响应副本，未命中时返回None
+        """
+        entry = self._response_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._response_cache[key]
+            return None
+        self._response_cache.move_to_end(key)
+        # 返回副本，调用方修改响应不影响缓存
+        return copy.deepcopy(entry[1])
+    
+    def _cache_response(self, key: str, response: Dict[str, Any]) -> None:
+        """
+        缓存成功的响应，超出容量时淘汰最久未使用的条目
+        
+        Args:
+            key: 缓存键
+            response: 响应字典
+        """
+        self._response_cache[key] = (time.monotonic() + _RESPONSE_CACHE_TTL, copy.deepcopy(response))
+        self._response_cache.move_to_end(key)
+        if len(self._response_cache) > _RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
 
 
 class OpenRouterLLMService(LLMService):
@@ -94,6 +162,9 @@ class OpenRouterLLMService(LLMService):
         # 初始化OpenAI客户端
         self._client = None
         
+        # 确定性请求的响应缓存：缓存键 -> (过期时间, 响应)
+        self._response_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        
         logger.info(f"初始化OpenRouter LLM服务: 模型={self.model}, API基础URL={self.api_base}")
     
     @property
@@ -185,6 +256,15 @@ class OpenRouterLLMService(LLMService):
                 "extra_headers": self._prepare_headers()  # 添加自定义头部
             }
             
+            # 确定性请求的结果可以复用，相同请求直接返回缓存的响应
+            cache_key = None
+            if temperature <= _DETERMINISTIC_TEMPERATURE:
+                cache_key = _response_cache_key(self.model, temperature, max_tokens, messages)
+                cached = self._get_cached_response(cache_key)
+                if cached is not None:
+                    logger.debug("LLM响应命中缓存")
+                    return cached
+            
             # 调用OpenAI API
             response = await self.client.chat.completions.create(**params)
             
@@ -221,6 +301,9 @@ class OpenRouterLLMService(LLMService):
                 time=elapsed_time
             )
             
+            if cache_key is not None:
+                self._cache_response(cache_key, response_dict)
+            
             return response_dict
             
         except Exception as e:
@@ -291,6 +374,9 @@ class DeepSeekLLMService(LLMService):
         # 初始化OpenAI客户端
         self._client = None
         
+        # 确定性请求的响应缓存：缓存键 -> (过期时间, 响应)
+        self._response_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        
         logger.info(f"初始化DeepSeek LLM服务: 模型={self.model}, API基础URL={self.api_base}")
     
     @property
@@ -382,6 +468,15 @@ class DeepSeekLLMService(LLMService):
                 "extra_headers": self._prepare_headers()  # 添加自定义头部
             }
             
+            # 确定性请求的结果可以复用，相同请求直接返回缓存的响应
+            cache_key = None
+            if temperature <= _DETERMINISTIC_TEMPERATURE:
+                cache_key = _response_cache_key(self.model, temperature, max_tokens, messages)
+                cached = self._get_cached_response(cache_key)
+                if cached is not None:
+                    logger.debug("LLM响应命中缓存")
+                    return cached
+            
             # 调用OpenAI API
             response = await self.client.chat.completions.create(**params)
             
@@ -418,6 +513,9 @@ class DeepSeekLLMService(LLMService):
                 time=elapsed_time
             )
             
+            if cache_key is not None:
+                self._cache_response(cache_key, response_dict)
+            
             return response_dict
             
         except Exception as e:
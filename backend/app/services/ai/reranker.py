@@ -4,11 +4,11 @@
 """
 
 import logging
-import os
 from typing import List, Dict, Any, Tuple, Optional
-import requests
+import httpx
 
 from app.core.config import settings
+from app.services.ai.http_clients import get_async_client
 
 logger = logging.getLogger(__name__)
 
@@ -61,29 +61,6 @@ class RerankerService:
             "Content-Type": "application/json"
         }
         
-        # 设置代理
-        proxies = self.proxy
-        
-        # 如果设置了直接连接，则忽略系统代理
-        if self.use_direct_connection:
-            logger.info("使用直接连接模式，忽略系统代理")
-            proxies = {
-                "http": None,
-                "https": None
-            }
-        # 如果没有设置直接连接也没有设置自定义代理，则使用系统代理（如果有）
-        elif not proxies:
-            if os.environ.get('HTTP_PROXY') or os.environ.get('HTTPS_PROXY'):
-                logger.info("检测到系统代理设置，使用系统代理")
-                # 让requests自动使用系统代理
-                proxies = None
-            else:
-                logger.info("未检测到系统代理，使用直接连接")
-                proxies = {
-                    "http": None,
-                    "https": None
-                }
-        
         try:
             payload = {
                 "model": self.model,
@@ -94,15 +71,9 @@ class RerankerService:
             }
             
             logger.info(f"发送重排序请求至 {self.api_base}, 模型: {self.model}")
-            logger.debug(f"代理设置: {proxies}")
             
-            response = requests.post(
-                self.api_base,
-                headers=headers,
-                json=payload,
-                proxies=proxies,
-                timeout=30  # 添加超时设置
-            )
+            client = get_async_client(self.use_direct_connection, self.proxy)
+            response = await client.post(self.api_base, headers=headers, json=payload)
             
             response.raise_for_status()
             result = response.json()
@@ -119,7 +90,7 @@ class RerankerService:
         
         except Exception as e:
             logger.error(f"重排序请求失败: {str(e)}")
-            if isinstance(e, requests.RequestException) and hasattr(e, 'response') and e.response:
+            if isinstance(e, httpx.HTTPStatusError):
                 logger.error(f"响应状态码: {e.response.status_code}")
                 logger.error(f"响应内容: {e.response.text}")
             # 发生错误时返回原始顺序
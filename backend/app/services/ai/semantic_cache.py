@@ -0,0 +1,246 @@
+"""语义缓存模块
+
+为自然语言查询的LLM结果提供两级缓存：
+1. 归一化查询文本的精确匹配LRU
+2. 基于嵌入向量余弦相似度的语义匹配（可选）
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# 全角标点统一为半角
+_PUNCT_TABLE = str.maketrans("，。？！：；（）", ",.?!:;()")
+
+# 嵌入函数：文本列表 -> 向量列表
+Embedder = Callable[[List[str]], Awaitable[List[List[float]]]]
+# 灰区校验函数：(新查询, 已缓存查询) -> 是否等价
+Verifier = Callable[[str, str], Awaitable[bool]]
+
+
+def normalize_query(query: str) -> str:
+    """
+    归一化自然语言查询：统一标点、小写、折叠空白并去掉结尾标点
+
+    Args:
+        query: 原始查询
+
+    Returns:
+        归一化后的查询
+    """
+    return " ".join(query.translate(_PUNCT_TABLE).lower().split()).rstrip("?.!")
+
+
+def _digest(text: str) -> str:
+    """计算归一化查询的缓存键"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SemanticCache:
+    """两级查询结果缓存
+
+    精确匹配未命中且配置了嵌入函数时，按余弦相似度查找最相近的已缓存查询：
+    相似度不低于high直接命中，不高于low视为未命中，介于两者之间时交给verifier判断。
+    所有条目都带有版本号（如表结构版本），版本不一致的条目视为失效。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 3600,
+        embedder: Optional[Embedder] = None,
+        verifier: Optional[Verifier] = None,
+        high: float = 0.95,
+        low: float = 0.80,
+        max_vectors: int = 10000
+    ):
+        """
+        初始化缓存
+
+        Args:
+            maxsize: 精确匹配缓存的最大条目数
+            ttl: 条目有效期(秒)
+            embedder: 异步嵌入函数，为None时只使用精确匹配
+            verifier: 灰区相似度时的异步校验函数，为None时灰区视为未命中
+            high: 直接命中的相似度阈值
+            low: 直接未命中的相似度阈值
+            max_vectors: 语义索引保留的最大向量数
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.embedder = embedder
+        self.verifier = verifier
+        self.high = high
+        self.low = low
+        self.max_vectors = max_vectors
+
+        # 缓存键 -> (过期时间, 版本, 归一化查询, 值)
+        self._entries: "OrderedDict[str, Tuple[float, Hashable, str, Any]]" = OrderedDict()
+        # 归一化查询 -> 单位化的嵌入向量，避免同一查询重复请求嵌入服务
+        self._embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # 同一事件循环轮次内的嵌入请求合并为一次批量调用；同一文本只请求一次
+        self._embed_batch: List[str] = []
+        self._embed_inflight: Dict[str, "asyncio.Future[Optional[np.ndarray]]"] = {}
+        self._embed_flush_task: Optional[asyncio.Task] = None
+        # 语义索引：预分配的向量矩阵按环形缓冲写入，与_vector_keys一一对应
+        self._vectors: Optional[np.ndarray] = None
+        self._vector_keys: List[Optional[str]] = [None] * max_vectors
+        self._vector_pos = 0
+        self._vector_count = 0
+
+    def _get_exact(self, key: str, version: Hashable) -> Optional[Any]:
+        """按缓存键查找未过期且版本一致的条目"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic() or entry[1] != version:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[3]
+
+    async def _embed(self, normalized: str) -> Optional[np.ndarray]:
+        """获取归一化查询的单位嵌入向量，失败或为零向量时返回None"""
+        vector = self._embeddings.get(normalized)
+        if vector is not None:
+            self._embeddings.move_to_end(normalized)
+            return vector
+
+        future = self._embed_inflight.get(normalized)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._embed_inflight[normalized] = loop.create_future()
+            self._embed_batch.append(normalized)
+            if len(self._embed_batch) == 1:
+                # 批量请求在当前轮次的其他协程入队之后才发出
+                self._embed_flush_task = loop.create_task(self._flush_embed_batch())
+        # 单个调用方被取消时不影响等待同一结果的其他调用方
+        return await asyncio.shield(future)
+
+    async def _flush_embed_batch(self) -> None:
+        """一次请求嵌入服务获取所有排队文本的向量，并唤醒等待方"""
+        texts, self._embed_batch = self._embed_batch, []
+        try:
+            embeddings = await self.embedder(texts)
+        except Exception as e:
+            logger.warning(f"获取查询嵌入失败，跳过语义缓存: {str(e)}")
+            embeddings = []
+
+        for i, text in enumerate(texts):
+            vector = self._to_unit_vector(embeddings[i]) if i < len(embeddings) else None
+            if vector is not None:
+                self._embeddings[text] = vector
+                if len(self._embeddings) > self.maxsize:
+                    self._embeddings.popitem(last=False)
+            future = self._embed_inflight.pop(text)
+            if not future.done():
+                future.set_result(vector)
+
+    @staticmethod
+    def _to_unit_vector(embedding: List[float]) -> Optional[np.ndarray]:
+        """将嵌入向量单位化，零向量返回None"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            # 嵌入服务失败时会返回全零向量
+            return None
+        return vector / norm
+
+    def _add_vector(self, key: str, vector: np.ndarray) -> None:
+        """将向量写入语义索引，满后覆盖最早写入的向量"""
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            self._vectors = np.zeros((self.max_vectors, vector.shape[0]), dtype=np.float32)
+            self._vector_keys = [None] * self.max_vectors
+            self._vector_pos = self._vector_count = 0
+
+        self._vectors[self._vector_pos] = vector
+        self._vector_keys[self._vector_pos] = key
+        self._vector_pos = (self._vector_pos + 1) % self.max_vectors
+        self._vector_count = min(self._vector_count + 1, self.max_vectors)
+
+    def _nearest(self, vector: np.ndarray) -> Tuple[float, Optional[str]]:
+        """返回语义索引中与向量最相近的(相似度, 缓存键)"""
+        if self._vectors is None or not self._vector_count or self._vectors.shape[1] != vector.shape[0]:
+            return 0.0, None
+        scores = self._vectors[:self._vector_count] @ vector
+        best = int(np.argmax(scores))
+        return float(scores[best]), self._vector_keys[best]
+
+    async def get(self, query: str, version: Hashable = None) -> Optional[Any]:
+        """
+        查找查询对应的缓存结果
+
+        Args:
+            query: 自然语言查询
+            version: 当前版本号，与写入时不一致的条目视为失效
+
+        Returns:
+            缓存的值，未命中时返回None
+        """
+        normalized = normalize_query(query)
+        value = self._get_exact(_digest(normalized), version)
+        if value is not None or self.embedder is None:
+            return value
+
+        vector = await self._embed(normalized)
+        if vector is None:
+            return None
+
+        score, key = self._nearest(vector)
+        if key is None or score <= self.low:
+            return None
+        value = self._get_exact(key, version)
+        if value is None:
+            return None
+        if score >= self.high:
+            logger.info(f"语义缓存命中，相似度: {score:.3f}")
+            return value
+
+        # 灰区：相似但不确定是否等价，交给校验函数判断
+        if self.verifier is None:
+            return None
+        cached_query = self._entries[key][2]
+        try:
+            if await self.verifier(normalized, cached_query):
+                logger.info(f"语义缓存经校验命中，相似度: {score:.3f}")
+                return value
+        except Exception as e:
+            logger.warning(f"语义缓存校验失败: {str(e)}")
+        return None
+
+    async def put(self, query: str, value: Any, version: Hashable = None) -> None:
+        """
+        写入查询结果
+
+        Args:
+            query: 自然语言查询
+            value: 要缓存的值
+            version: 当前版本号
+        """
+        normalized = normalize_query(query)
+        key = _digest(normalized)
+        self._entries[key] = (time.monotonic() + self.ttl, version, normalized, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+        if self.embedder is not None:
+            vector = await self._embed(normalized)
+            if vector is not None:
+                self._add_vector(key, vector)
+
+    def clear(self) -> None:
+        """清空所有缓存条目和语义索引"""
+        self._entries.clear()
+        self._embeddings.clear()
+        self._vectors = None
+        self._vector_keys = [None] * self.max_vectors
+        self._vector_pos = self._vector_count = 0
@@ -0,0 +1,107 @@
+"""
+SQL安全检查单元测试
+
+覆盖危险关键字扫描(_find_dangerous_keyword)和最外层LIMIT处理(_apply_row_limit)。
+
+用法:
+    python -m unittest tests/test_sql_safety.py
+"""
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+# 后端代码位于backend目录，按app包导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from app.services.ai.chains.nl2sql import NL2SQLChain, _find_dangerous_keyword  # noqa: E402
+
+KEYWORDS = frozenset({"DROP", "DELETE", "UPDATE", "INSERT", "ALTER", "TRUNCATE"})
+
+
+class FindDangerousKeywordTest(unittest.TestCase):
+    """危险关键字扫描测试"""
+
+    def test_plain_keyword(self):
+        self.assertEqual(_find_dangerous_keyword("DROP TABLE orders", KEYWORDS), "DROP")
+        self.assertEqual(_find_dangerous_keyword("select 1; delete from t", KEYWORDS), "DELETE")
+
+    def test_keyword_inside_identifier(self):
+        self.assertIsNone(_find_dangerous_keyword("SELECT update_time, drop_rate FROM t", KEYWORDS))
+
+    def test_quoted_text(self):
+        self.assertIsNone(_find_dangerous_keyword("SELECT * FROM t WHERE note = 'drop table'", KEYWORDS))
+        self.assertIsNone(_find_dangerous_keyword('SELECT "delete" FROM t', KEYWORDS))
+        self.assertIsNone(_find_dangerous_keyword("SELECT `update` FROM t", KEYWORDS))
+        self.assertIsNone(_find_dangerous_keyword("SELECT 'it\\'s drop' FROM t", KEYWORDS))
+
+    def test_plain_comments(self):
+        self.assertIsNone(_find_dangerous_keyword("SELECT 1 -- drop table t", KEYWORDS))
+        self.assertIsNone(_find_dangerous_keyword("SELECT 1 # drop table t", KEYWORDS))
+        self.assertIsNone(_find_dangerous_keyword("SELECT 1 /* drop table t */", KEYWORDS))
+
+    def test_keyword_after_comment(self):
+        self.assertEqual(_find_dangerous_keyword("SELECT 1 -- note\nDROP TABLE t", KEYWORDS), "DROP")
+        self.assertEqual(_find_dangerous_keyword("SELECT 1 /* note */ DROP TABLE t", KEYWORDS), "DROP")
+
+    def test_executable_comment(self):
+        # MySQL会执行/*! ... */中的内容
+        self.assertEqual(
+            _find_dangerous_keyword("SELECT * FROM t /*!50000 ; DROP TABLE t */", KEYWORDS), "DROP"
+        )
+        self.assertEqual(
+            _find_dangerous_keyword("SELECT * FROM t /*!50000DROP TABLE t */", KEYWORDS), "DROP"
+        )
+        self.assertEqual(_find_dangerous_keyword("SELECT * FROM t /*! DELETE */", KEYWORDS), "DELETE")
+
+    def test_optimizer_hint(self):
+        self.assertEqual(_find_dangerous_keyword("SELECT /*+ UPDATE */ 1", KEYWORDS), "UPDATE")
+
+    def test_keyword_at_end(self):
+        self.assertEqual(_find_dangerous_keyword("SELECT 1; TRUNCATE", KEYWORDS), "TRUNCATE")
+
+
+class ApplyRowLimitTest(unittest.TestCase):
+    """最外层LIMIT处理测试"""
+
+    def setUp(self):
+        # _apply_row_limit只依赖方言，不需要数据库和LLM
+        self.chain = SimpleNamespace(_engine_sql_dialect=lambda: "mysql")
+
+    def apply(self, sql: str, limit_value: int = 100) -> str:
+        return NL2SQLChain._apply_row_limit(self.chain, sql, limit_value)
+
+    def test_adds_limit(self):
+        self.assertEqual(self.apply("SELECT a FROM t"), "SELECT a FROM t LIMIT 100")
+
+    def test_keeps_smaller_limit(self):
+        self.assertEqual(self.apply("SELECT a FROM t LIMIT 5"), "SELECT a FROM t LIMIT 5")
+
+    def test_caps_larger_limit(self):
+        self.assertEqual(self.apply("SELECT a FROM t LIMIT 500"), "SELECT a FROM t LIMIT 100")
+
+    def test_subquery_limit_does_not_count(self):
+        result = self.apply("SELECT * FROM (SELECT a FROM t LIMIT 5) AS s")
+        self.assertTrue(result.endswith("LIMIT 100"))
+
+    def test_trailing_line_comment(self):
+        for sql in ("SELECT a FROM t -- note", "SELECT a FROM t # note"):
+            result = self.apply(sql)
+            self.assertTrue(result.endswith("LIMIT 100"), result)
+            self.assertNotIn("--", result)
+            self.assertNotIn("#", result)
+
+    def test_union(self):
+        self.assertTrue(self.apply("SELECT 1 UNION SELECT 2").endswith("LIMIT 100"))
+
+    def test_rejects_multiple_statements(self):
+        with self.assertRaises(ValueError):
+            self.apply("SELECT 1; SELECT 2")
+
+    def test_trailing_semicolon(self):
+        self.assertEqual(self.apply("SELECT a FROM t;"), "SELECT a FROM t LIMIT 100")
+
+
+if __name__ == "__main__":
+    unittest.main()